@@ -5,6 +5,7 @@ from __future__ import annotations
 from typing import cast
 
 from mhai_web.users.models import User
+from mhailib.etags import ConditionalGetMixin
 from rest_framework import viewsets
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
@@ -17,45 +18,49 @@ from ai_profile.api.serializers import (
 from ai_profile.models import AIProfile
 
 
-class AIProfileGeneralInfoView(viewsets.ModelViewSet):
+class AIProfileGeneralInfoView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating general information in the AIProfile model."""
 
     queryset = AIProfile.objects.all()
     serializer_class = AIProfileGeneralInfoSerializer
     permission_classes = [AllowAny]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
 
 
-class AIProfileInterestsView(viewsets.ModelViewSet):
+class AIProfileInterestsView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating interests in the AIProfile model."""
 
     queryset = AIProfile.objects.all()
     serializer_class = AIProfileInterestsSerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
 
 
-class AIProfileEmotionsView(viewsets.ModelViewSet):
+class AIProfileEmotionsView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating the emotional profile in the AIProfile model."""
 
     queryset = AIProfile.objects.all()
     serializer_class = AIProfileEmotionsSerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
 
 
-class AIProfileBiographyView(viewsets.ModelViewSet):
+class AIProfileBiographyView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating bio-related fields in the AIProfile model."""
 
     queryset = AIProfile.objects.all()
     serializer_class = AIProfileBiographySerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
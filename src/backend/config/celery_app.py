@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
@@ -15,3 +16,14 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def preload_models(**kwargs):
+    """Load the classification models configured for this worker."""
+    from django.conf import settings
+
+    if settings.MHAI_PRELOAD_MODELS:
+        from mhailib.messages.registry import registry
+
+        registry.warmup(settings.MHAI_PRELOAD_MODELS)
@@ -130,7 +130,12 @@ MIGRATION_MODULES = {"sites": "mhai_web.contrib.sites.migrations"}
 # AUTHENTICATION
 # -----------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#authentication-backends
+# the users of the sessions are loaded from the cache (see
+# `mhai_web.users.authentication`)
 AUTHENTICATION_BACKENDS = [
+    "mhai_web.users.authentication.CachedModelBackend",
+    "mhai_web.users.authentication.CachedAuthenticationBackend",
+    # the sessions opened before the cached backends store these paths
     "django.contrib.auth.backends.ModelBackend",
     "allauth.account.auth_backends.AuthenticationBackend",
 ]
@@ -269,6 +274,9 @@ FIXTURE_DIRS = (str(APPS_DIR / "fixtures"),)
 # -----------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#session-cookie-httponly
 SESSION_COOKIE_HTTPONLY = True
+# https://docs.djangoproject.com/en/dev/topics/http/sessions/#using-cached-sessions
+# read from the cache, written to both the cache and the database
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
 # https://docs.djangoproject.com/en/dev/ref/settings/#csrf-cookie-httponly
 CSRF_COOKIE_HTTPONLY = True
 # https://docs.djangoproject.com/en/dev/ref/settings/#x-frame-options
@@ -351,6 +359,16 @@ CELERY_TASK_TIME_LIMIT = 5 * 60
 CELERY_TASK_SOFT_TIME_LIMIT = 60
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#beat-scheduler
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+# https://docs.celeryq.dev/en/stable/userguide/routing.html
+# The answers of the AI (network-bound) and the evaluations (CPU-bound) run
+# on dedicated queues, served by different workers (see
+# containers/celery/*/worker/start); the other tasks use the default queue.
+CELERY_TASK_DEFAULT_QUEUE = "celery"
+CELERY_TASK_ROUTES = {
+    "my_diary.tasks.task_answers.process_chat_answer": {"queue": "llm"},
+    "my_diary.tasks.task_evaluations.*": {"queue": "evaluations"},
+    "my_diary.tasks.task_embeddings.*": {"queue": "evaluations"},
+}
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#worker-send-task-events
 CELERY_WORKER_SEND_TASK_EVENTS = True
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#std-setting-task_send_sent_event
@@ -389,7 +407,7 @@ STATICFILES_FINDERS += ["compressor.finders.CompressorFinder"]
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework.authentication.TokenAuthentication",
+        "mhai_web.users.authentication.CachedTokenAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -410,3 +428,123 @@ SPECTACULAR_SETTINGS = {
     "SCHEMA_PATH_PREFIX": "/api/",
     "SERVERS": [{"url": "http://localhost", "description": "local server"}],
 }
+
+# Mhai
+# -----------------------------------------------------------------------------
+# Classification models loaded when a celery worker process starts
+# (e.g. "emotions,mentbert,psychbert"). By default, models are loaded on
+# first use, only in the processes that run inference.
+MHAI_PRELOAD_MODELS = env.list("MHAI_PRELOAD_MODELS", default=[])
+# How diary messages are evaluated: "fanout" (one celery task per model),
+# "fused" (one celery task running all the models) or "batched" (messages
+# are collected and evaluated together, see below).
+MHAI_EVALUATION_MODE = env("MHAI_EVALUATION_MODE", default="fanout")
+# Max number of messages evaluated in one batch.
+MHAI_EVALUATION_BATCH_SIZE = env.int("MHAI_EVALUATION_BATCH_SIZE", default=16)
+# Max time (in seconds) a message waits for its batch to be evaluated.
+MHAI_EVALUATION_BATCH_WINDOW = env.float(
+    "MHAI_EVALUATION_BATCH_WINDOW", default=2.0
+)
+# Time (in seconds) after which the messages claimed by a batch that never
+# finished (e.g. its worker died) are claimed again by the next batch.
+MHAI_EVALUATION_CLAIM_TIMEOUT = env.int(
+    "MHAI_EVALUATION_CLAIM_TIMEOUT", default=600
+)
+# Where the scores of the diary messages are stored: "tables" (one table
+# per model) or "consolidated" (one row per message, with the scores of
+# each model in a JSON column).
+MHAI_EVALUATION_STORAGE = env("MHAI_EVALUATION_STORAGE", default="tables")
+# Inference backend of the classification models: "torch" (PyTorch, fp32)
+# or "onnx" (ONNX Runtime, requires the `onnx` extra).
+MHAI_INFERENCE_BACKEND = env("MHAI_INFERENCE_BACKEND", default="torch")
+# Quantize the ONNX models to int8 (dynamic quantization).
+MHAI_ONNX_QUANTIZE = env.bool("MHAI_ONNX_QUANTIZE", default=False)
+# Directory where the models exported to ONNX are stored.
+MHAI_ONNX_CACHE_DIR = env(
+    "MHAI_ONNX_CACHE_DIR", default=str(BASE_DIR / "data" / "onnx")
+)
+# How texts longer than the max length of the models are evaluated:
+# "truncate" (only the beginning of the text) or "sliding" (overlapping
+# windows evaluated together, and combined with the reducer below).
+MHAI_LONG_TEXT_MODE = env("MHAI_LONG_TEXT_MODE", default="truncate")
+# Number of tokens shared by consecutive windows.
+MHAI_WINDOW_STRIDE = env.int("MHAI_WINDOW_STRIDE", default=128)
+# How the scores of the windows are combined: "mean", "max" or "weighted"
+# (mean weighted by the number of tokens of each window).
+MHAI_WINDOW_REDUCER = env("MHAI_WINDOW_REDUCER", default="mean")
+# Max number of inputs (texts or windows) in one forward pass of a model.
+MHAI_INFERENCE_BATCH_SIZE = env.int("MHAI_INFERENCE_BATCH_SIZE", default=32)
+# Cache the scores of the models by the content of the texts.
+MHAI_EVALUATION_CACHE = env.bool("MHAI_EVALUATION_CACHE", default=True)
+# Time (in seconds) the scores are kept in the django cache.
+MHAI_EVALUATION_CACHE_TTL = env.int(
+    "MHAI_EVALUATION_CACHE_TTL", default=60 * 60 * 24 * 7
+)
+# Max number of scores, and time (in seconds) they are kept, in the
+# in-process cache of each worker.
+MHAI_EVALUATION_CACHE_LOCAL_SIZE = env.int(
+    "MHAI_EVALUATION_CACHE_LOCAL_SIZE", default=1024
+)
+MHAI_EVALUATION_CACHE_LOCAL_TTL = env.int(
+    "MHAI_EVALUATION_CACHE_LOCAL_TTL", default=300
+)
+# Max number of tokens of the prompt sent to the chat model (system
+# message, history and the new message); the most recent messages that fit
+# are kept.
+MHAI_CONTEXT_TOKEN_BUDGET = env.int("MHAI_CONTEXT_TOKEN_BUDGET", default=3000)
+# Max number of previous messages considered for the context.
+MHAI_CONTEXT_MAX_TURNS = env.int("MHAI_CONTEXT_MAX_TURNS", default=50)
+# Add the previous messages the most similar to the new one (by their
+# sentence embeddings) to the context of the chat model.
+MHAI_RAG = env.bool("MHAI_RAG", default=False)
+# Number of similar messages added to the context.
+MHAI_RAG_TOP_K = env.int("MHAI_RAG_TOP_K", default=5)
+# Number of most recent messages always added before the similar ones.
+MHAI_RAG_RECENT_TURNS = env.int("MHAI_RAG_RECENT_TURNS", default=4)
+# Sentence embedding model, run locally on CPU.
+MHAI_EMBEDDING_MODEL = env(
+    "MHAI_EMBEDDING_MODEL", default="sentence-transformers/all-MiniLM-L6-v2"
+)
+# Max number of users whose embeddings are kept in memory by each process.
+MHAI_RAG_CACHE_USERS = env.int("MHAI_RAG_CACHE_USERS", default=16)
+# Send the chat completions with the async client, from an event loop
+# shared by the tasks of each worker process (see `mhailib.messages.llm`).
+MHAI_LLM_ASYNC = env.bool("MHAI_LLM_ASYNC", default=False)
+# Max number of chat completions in flight in each worker process.
+MHAI_LLM_CONCURRENCY = env.int("MHAI_LLM_CONCURRENCY", default=16)
+# Time (in seconds) a chat completion has to finish, retries included; it
+# ends before the soft time limit of the task. It is also the timeout of the
+# requests of the synchronous client, as the time limits don't apply on the
+# threads pool of the llm workers.
+MHAI_LLM_DEADLINE = env.float(
+    "MHAI_LLM_DEADLINE", default=CELERY_TASK_SOFT_TIME_LIMIT * 0.8
+)
+# Max number of retries of the rate limited or failed completions.
+MHAI_LLM_MAX_RETRIES = env.int("MHAI_LLM_MAX_RETRIES", default=3)
+# Number of consecutive failures that open the circuit breaker, and time
+# (in seconds) until a new call is tried.
+MHAI_LLM_BREAKER_FAILURES = env.int("MHAI_LLM_BREAKER_FAILURES", default=5)
+MHAI_LLM_BREAKER_RESET = env.float("MHAI_LLM_BREAKER_RESET", default=30.0)
+# Time (in seconds) the users resolved from sessions and tokens are kept
+# in the django cache.
+MHAI_AUTH_CACHE_TTL = env.int("MHAI_AUTH_CACHE_TTL", default=60 * 15)
+# Max number of users and tokens, and time (in seconds) they are kept, in
+# the in-process cache of each web worker; changes made in another process
+# are seen after this time.
+MHAI_AUTH_CACHE_LOCAL_SIZE = env.int(
+    "MHAI_AUTH_CACHE_LOCAL_SIZE", default=1024
+)
+MHAI_AUTH_CACHE_LOCAL_TTL = env.float("MHAI_AUTH_CACHE_LOCAL_TTL", default=5.0)
+# When on, the list and retrieve actions of the diary API read `.values()`
+# rows and render them with orjson; when off, they use the model serializers
+# and the default renderers. Both give the same output.
+MHAI_API_FAST_READS = env.bool("MHAI_API_FAST_READS", default=True)
+# Margin (in seconds) kept below the `updated_since` watermarks returned by
+# the diary API, so the changes committed late (with an older `updated_at`)
+# are not skipped. It must be longer than the transactions saving messages.
+MHAI_DIARY_DELTA_OVERLAP = env.float("MHAI_DIARY_DELTA_OVERLAP", default=5.0)
+# Redis used to relay the answers of the AI to the browser.
+REDIS_URL = env("REDIS_URL", default="redis://localhost:6379/0")
+# Stream the answers of the AI to the browser (through the websocket) while
+# they are generated.
+MHAI_STREAM_ANSWERS = env.bool("MHAI_STREAM_ANSWERS", default=False)
@@ -1,13 +1,236 @@
-async def websocket_application(scope, receive, send):
+"""
+Websocket endpoint.
+
+Besides ping/pong, authenticated clients can subscribe to the answer of
+their diary messages, which is relayed while the AI generates it:
+
+    {"action": "subscribe", "message_id": 1}
+
+and to the events of their diary messages (e.g. a new answer, evaluation
+or status), so they don't need to poll the API:
+
+    {"action": "subscribe_user"}
+
+Each event received from redis is sent as-is (see
+`mhailib.messages.streams`).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+from http.cookies import SimpleCookie
+from importlib import import_module
+from typing import Any
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.http import HttpRequest
+from django.http.request import validate_host
+from mhailib.messages.streams import (
+    POLL_TIMEOUT,
+    get_async_redis,
+    get_user_event_hub,
+    message_channel,
+    message_events_key,
+)
+from my_diary.models import MyDiary
+
+USER_RELAY = "user"
+FINAL_EVENTS = ("done", "error")
+
+
+def _get_headers(scope: dict[str, Any]) -> dict[str, str]:
+    return {
+        name.decode("latin1"): value.decode("latin1")
+        for name, value in scope.get("headers", [])
+    }
+
+
+def _is_allowed_origin(headers: dict[str, str]) -> bool:
+    origin = headers.get("origin")
+    if origin is None:
+        return True
+    host = urlsplit(origin).hostname or ""
+    return validate_host(host, settings.ALLOWED_HOSTS) or any(
+        origin == trusted for trusted in settings.CSRF_TRUSTED_ORIGINS
+    )
+
+
+@sync_to_async
+def get_user_id(scope: dict[str, Any]) -> int | None:
+    """
+    Return the id of the user authenticated by the session cookie.
+
+    Parameters
+    ----------
+    scope : dict[str, Any]
+        The ASGI scope of the connection.
+
+    Returns
+    -------
+    int | None
+        The user id, or None for anonymous users.
+    """
+    headers = _get_headers(scope)
+    cookies = SimpleCookie(headers.get("cookie", ""))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+
+    engine = import_module(settings.SESSION_ENGINE)
+    request = HttpRequest()
+    request.session = engine.SessionStore(morsel.value)
+    user = get_user(request)
+    return user.pk if user.is_authenticated else None
+
+
+async def relay_answer(
+    send: Any, message_id: int, redis: Any | None = None
+) -> None:
+    """
+    Send the events of the answer of a message to the websocket.
+
+    The events already published are replayed first, so clients
+    subscribing after the answer started don't miss any piece of it.
+    """
+    client = redis or get_async_redis()
+    try:
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(message_channel(message_id))
+            await _relay_events(send, message_id, client, pubsub)
+    finally:
+        if redis is None:
+            await client.aclose()
+
+
+async def _relay_events(
+    send: Any, message_id: int, redis: Any, pubsub: Any
+) -> None:
+    seq = 0
+    for event in await redis.lrange(message_events_key(message_id), 0, -1):
+        data = json.loads(event)
+        seq = data["seq"]
+        await send({"type": "websocket.send", "text": event.decode()})
+        if data["type"] in FINAL_EVENTS:
+            return
+
     while True:
-        event = await receive()
+        message = await pubsub.get_message(
+            ignore_subscribe_messages=True, timeout=POLL_TIMEOUT
+        )
+        if message is None:
+            continue
+        data = json.loads(message["data"])
+        if data["seq"] <= seq:
+            # already sent in the replay
+            continue
+        await send(
+            {"type": "websocket.send", "text": message["data"].decode()}
+        )
+        if data["type"] in FINAL_EVENTS:
+            return
+
+
+async def relay_user_events(send: Any, user_id: int) -> None:
+    """Send the events of the diary messages of the user to the websocket."""
+    hub = get_user_event_hub()
+    queue = await hub.subscribe(user_id)
+    try:
+        while True:
+            data = await queue.get()
+            if data is None:
+                # redis failed, the client falls back to long-polling
+                await send({"type": "websocket.close", "code": 1011})
+                return
+            await send({"type": "websocket.send", "text": data})
+    finally:
+        await hub.unsubscribe(user_id, queue)
+
+
+async def _subscribe(
+    send: Any,
+    user_id: int,
+    data: dict[str, Any],
+    relays: dict[int | str, Any],
+) -> None:
+    message_id = data.get("message_id")
+    is_owner = isinstance(message_id, int) and (
+        await MyDiary.objects.filter(id=message_id, user_id=user_id).aexists()
+    )
+    if not is_owner:
+        await send(
+            {
+                "type": "websocket.send",
+                "text": json.dumps(
+                    {"type": "forbidden", "message_id": message_id}
+                ),
+            }
+        )
+        return
+
+    if message_id not in relays or relays[message_id].done():
+        relays[message_id] = asyncio.create_task(
+            relay_answer(send, message_id)
+        )
+
+
+async def _receive_text(
+    send: Any, user_id: int | None, text: str, relays: dict[int | str, Any]
+) -> bool:
+    """Handle a message of the client, return False to close the socket."""
+    if text == "ping":
+        await send({"type": "websocket.send", "text": "pong!"})
+        return True
+
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return True
+
+    if not isinstance(data, dict):
+        return True
+
+    if user_id is None:
+        await send({"type": "websocket.close", "code": 4401})
+        return False
+
+    if data.get("action") == "subscribe":
+        await _subscribe(send, user_id, data, relays)
+    elif data.get("action") == "subscribe_user" and USER_RELAY not in relays:
+        relays[USER_RELAY] = asyncio.create_task(
+            relay_user_events(send, user_id)
+        )
+    return True
+
+
+async def websocket_application(scope, receive, send):
+    user_id = None
+    relays: dict[int | str, asyncio.Task] = {}
+
+    try:
+        while True:
+            event = await receive()
 
-        if event["type"] == "websocket.connect":
-            await send({"type": "websocket.accept"})
+            if event["type"] == "websocket.connect":
+                if not _is_allowed_origin(_get_headers(scope)):
+                    await send({"type": "websocket.close", "code": 4403})
+                    break
+                user_id = await get_user_id(scope)
+                await send({"type": "websocket.accept"})
 
-        if event["type"] == "websocket.disconnect":
-            break
+            if event["type"] == "websocket.disconnect":
+                break
 
-        if event["type"] == "websocket.receive":
-            if event["text"] == "ping":
-                await send({"type": "websocket.send", "text": "pong!"})
+            if event["type"] == "websocket.receive":
+                text = event.get("text") or ""
+                if not await _receive_text(send, user_id, text, relays):
+                    break
+    finally:
+        for task in relays.values():
+            task.cancel()
+        # the browser falls back to polling if a relay fails
+        await asyncio.gather(*relays.values(), return_exceptions=True)
@@ -6,12 +6,21 @@ import pytest
 import yaml
 
 from ai_profile.models import AIProfile
+from django.core.cache import cache
+from mhai_web.users.authentication import auth_cache
 from mhai_web.users.models import User
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from user_profile.models import UserProfile
 
 
+@pytest.fixture(autouse=True)
+def _clear_auth_cache():
+    """Forget the users cached by the previous tests (their ids are reused)."""
+    cache.clear()
+    auth_cache.clear_local()
+
+
 @pytest.fixture
 def user(db) -> User:
     """Return a user as fixture"""
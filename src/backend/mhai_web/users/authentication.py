@@ -0,0 +1,174 @@
+"""
+Cached authentication of the users.
+
+The users resolved from a session or a token are kept in the django cache
+(redis, in production), behind a short-lived in-process tier, so the
+authentication of the requests doesn't query the database on the
+steady-state path. The entries are replaced by a tombstone when the user
+changes (e.g. a password change), logs out, or when a token is deleted or
+rotated; other processes may still use their in-process entry for up to
+`MHAI_AUTH_CACHE_LOCAL_TTL` seconds.
+"""
+
+from __future__ import annotations
+
+import copy
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any
+
+from allauth.account.auth_backends import AuthenticationBackend
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from mhai_web.users.models import User
+
+KEY_PREFIX = "mhai:auth"
+# cached when the user or the token doesn't exist, so they are not
+# queried again on every request
+MISSING = 0
+# left for `TOMBSTONE_TTL` seconds in place of an invalidated entry, so a
+# request that loaded the entry before the change can't cache it again
+TOMBSTONE = -1
+TOMBSTONE_TTL = 10
+
+
+def user_key(user_id: int) -> str:
+    """Return the cache key of a user."""
+    return f"{KEY_PREFIX}:user:{user_id}"
+
+
+def token_key(key: str) -> str:
+    """Return the cache key of the user id of a token."""
+    return f"{KEY_PREFIX}:token:{key}"
+
+
+class AuthCache:
+    """
+    Two tier cache of the authenticated users and the user ids of tokens.
+
+    A bounded in-process LRU (with a short TTL) sits in front of the
+    django cache, which is shared by all the processes. The entries are
+    only added to the django cache when they are missing there, so they
+    never replace a newer entry or a tombstone.
+    """
+
+    def __init__(self, local_size: int, local_ttl: float, ttl: int) -> None:
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self._local: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_user(self, user_id: int) -> User | None:
+        """Return the user with the given id, or None if it doesn't exist."""
+        key = user_key(user_id)
+        user = self._get(key)
+        if user is None:
+            user = User.objects.filter(pk=user_id).first() or MISSING
+            self._set(key, user)
+        # each request gets its own copy
+        return copy.copy(user) if isinstance(user, User) else None
+
+    def get_token_user_id(self, key: str) -> int | None:
+        """Return the id of the user of a token, or None if it's invalid."""
+        cache_key = token_key(key)
+        user_id = self._get(cache_key)
+        if user_id is None:
+            user_id = (
+                Token.objects.filter(key=key)
+                .values_list("user_id", flat=True)
+                .first()
+            ) or MISSING
+            self._set(cache_key, user_id)
+        return user_id or None
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Remove a user from both tiers."""
+        self._delete(user_key(user_id))
+
+    def invalidate_token(self, key: str) -> None:
+        """Remove a token from both tiers."""
+        self._delete(token_key(key))
+
+    def clear_local(self) -> None:
+        """Remove all the entries of the in-process tier."""
+        with self._lock:
+            self._local.clear()
+
+    def _get(self, key: str) -> Any:
+        with self._lock:
+            item = self._local.get(key)
+            if item is not None and item[0] >= time.monotonic():
+                self._local.move_to_end(key)
+                return item[1]
+
+        value = cache.get(key)
+        if value is None or value == TOMBSTONE:
+            return None
+        self._set_local(key, value)
+        return value
+
+    def _set(self, key: str, value: Any) -> None:
+        if cache.add(key, value, timeout=self.ttl):
+            self._set_local(key, value)
+
+    def _set_local(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.local_ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._local.pop(key, None)
+        cache.set(key, TOMBSTONE, timeout=TOMBSTONE_TTL)
+
+
+auth_cache = AuthCache(
+    local_size=settings.MHAI_AUTH_CACHE_LOCAL_SIZE,
+    local_ttl=settings.MHAI_AUTH_CACHE_LOCAL_TTL,
+    ttl=settings.MHAI_AUTH_CACHE_TTL,
+)
+
+
+class CachedUserMixin:
+    """Load the user of the session from the cache."""
+
+    def get_user(self, user_id: int) -> User | None:
+        user = auth_cache.get_user(user_id)
+        if user is None or not self.user_can_authenticate(user):
+            return None
+        return user
+
+
+class CachedModelBackend(CachedUserMixin, ModelBackend):
+    """`ModelBackend` loading the user of the session from the cache."""
+
+
+class CachedAuthenticationBackend(CachedUserMixin, AuthenticationBackend):
+    """allauth backend loading the user of the session from the cache."""
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """`TokenAuthentication` resolving the tokens from the cache."""
+
+    def authenticate_credentials(self, key: str) -> tuple[User, Token]:
+        user_id = auth_cache.get_token_user_id(key)
+        user = auth_cache.get_user(user_id) if user_id else None
+        if user is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _("User inactive or deleted.")
+            )
+        # not saved, so no query is needed
+        return user, Token(key=key, user=user)
@@ -1,9 +1,13 @@
 import logging
 
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
 from simple_history.utils import update_change_reason
 
+from .authentication import auth_cache
 from .models import User
 
 logger = logging.getLogger(__name__)
@@ -34,3 +38,25 @@ def log_and_set_change_reason(sender, instance, created, **kwargs):
         logger.info(
             f"User {instance.email} was last changed on {last_history.history_date} with reason: {change_reason}."  # noqa: E501
         )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Remove the user from the authentication cache when it changes."""
+    # after the commit, so the old user is not cached again in the meantime
+    transaction.on_commit(lambda: auth_cache.invalidate_user(instance.pk))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    """Remove a token from the authentication cache when it's rotated."""
+    transaction.on_commit(lambda: auth_cache.invalidate_token(instance.key))
+
+
+@receiver(user_logged_out)
+def invalidate_logged_out_user(sender, request, user, **kwargs):
+    """Remove the user from the authentication cache on logout."""
+    if user is not None:
+        auth_cache.invalidate_user(user.pk)
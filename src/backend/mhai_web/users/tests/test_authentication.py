@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+from django.contrib.auth import get_user
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+
+from mhai_web.users.authentication import (
+    AuthCache,
+    CachedModelBackend,
+    CachedTokenAuthentication,
+    user_key,
+)
+from mhai_web.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+
+def test_token_authentication_cached(user: User, django_assert_num_queries):
+    token = Token.objects.create(user=user)
+    authentication = CachedTokenAuthentication()
+
+    authentication.authenticate_credentials(token.key)
+    with django_assert_num_queries(0):
+        authenticated, auth = authentication.authenticate_credentials(
+            token.key
+        )
+
+    assert authenticated == user
+    assert auth.key == token.key
+
+
+def test_token_rotation(user: User, django_capture_on_commit_callbacks):
+    token = Token.objects.create(user=user)
+    authentication = CachedTokenAuthentication()
+    authentication.authenticate_credentials(token.key)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        token.delete()
+        Token.objects.create(user=user)
+
+    with pytest.raises(exceptions.AuthenticationFailed):
+        authentication.authenticate_credentials(token.key)
+
+
+def test_session_user_cached(
+    user: User,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    backend = CachedModelBackend()
+    backend.get_user(user.pk)
+
+    with django_assert_num_queries(0):
+        assert backend.get_user(user.pk) == user
+
+    # a password change invalidates the cached user (and its sessions)
+    with django_capture_on_commit_callbacks(execute=True):
+        user.set_password("new-password")
+        user.save()
+
+    with django_assert_num_queries(1):
+        cached = backend.get_user(user.pk)
+    assert cached.get_session_auth_hash() == user.get_session_auth_hash()
+
+
+def test_inactive_user(user: User, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        user.is_active = False
+        user.save()
+
+    assert CachedModelBackend().get_user(user.pk) is None
+    assert CachedModelBackend().get_user(user.pk + 1) is None
+
+
+def test_invalidated_user_not_cached_again(user: User):
+    # a request loads the user, which changes before the request caches it
+    results = AuthCache(local_size=10, local_ttl=60, ttl=60)
+    results.invalidate_user(user.pk)
+    results._set(user_key(user.pk), user)  # noqa: SLF001
+
+    fresh = AuthCache(local_size=10, local_ttl=60, ttl=60)
+    assert fresh._get(user_key(user.pk)) is None  # noqa: SLF001
+
+
+def test_session_of_previous_backend(client, user: User):
+    # opened before the cached backends were configured
+    client.force_login(user, "django.contrib.auth.backends.ModelBackend")
+
+    assert get_user(SimpleNamespace(session=client.session)) == user
@@ -0,0 +1,11 @@
+"""Mhai internal library app."""
+
+from django.apps import AppConfig
+
+
+class MhailibConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "mhailib"
+
+    def ready(self):
+        import mhailib.signals  # noqa: F401
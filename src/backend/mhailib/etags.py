@@ -0,0 +1,149 @@
+"""
+Conditional GET for the API, from per-user version counters.
+
+Each user has a version counter (in the django cache) for each group of
+resources, e.g. "diary" or "profile", bumped whenever any of them
+changes. The ETag of a response is made of the version read before
+loading the data, and of the request, so an unchanged resource is
+answered with 304 after a single cache read, without querying the
+database or serializing anything.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import time
+
+from typing import TYPE_CHECKING, Any
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from rest_framework.request import Request
+
+KEY_PREFIX = "mhai:etag"
+
+
+def _version_key(scope: str, user_id: int) -> str:
+    return f"{KEY_PREFIX}:{scope}:{user_id}"
+
+
+def get_version(scope: str, user_id: int) -> int | None:
+    """
+    Return the version of the resources of a user.
+
+    None when the cache is not available (its errors are ignored in
+    production), so the version is unknown.
+    """
+    key = _version_key(scope, user_id)
+    version = cache.get(key)
+    if version is None:
+        # not starting from 0, so a counter evicted from the cache never
+        # repeats the versions (and ETags) it had before
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(scope: str, user_ids: Iterable[int]) -> None:
+    """Make the ETags of the resources of the users stale."""
+    for user_id in set(user_ids):
+        key = _version_key(scope, user_id)
+        if not cache.add(key, time.time_ns(), timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # evicted in the meantime
+                cache.add(key, time.time_ns(), timeout=None)
+
+
+class NotModified(Exception):  # noqa: N818
+    """The client already has the current version of the resource."""
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET requests with 304 when the resources didn't change.
+
+    The API view sets `etag_scope`, the group of resources whose version
+    (see `get_version`) identifies its responses. Successful unsafe
+    requests (e.g. POST or PATCH) bump that version, unless `has_changed`
+    says otherwise; changes made elsewhere (e.g. by the celery tasks) must
+    call `bump_version`.
+    """
+
+    etag_scope: str
+
+    def get_etag(self, request: Request) -> str | None:
+        """
+        Return the ETag of the response, or None to skip the check.
+
+        The ETag is weak, as it doesn't come from the content, and depends
+        on the path, query and accepted media types of the request.
+        """
+        if not request.user.is_authenticated:
+            return None
+        version = get_version(self.etag_scope, request.user.id)
+        if version is None:
+            return None
+        accept = request.headers.get("Accept", "")
+        variant = hashlib.sha256(
+            f"{request.get_full_path()}|{accept}".encode()
+        ).hexdigest()[:16]
+        return f'W/"{self.etag_scope}-{version}-{variant}"'
+
+    def has_changed(self, request: Request, response: Response) -> bool:
+        """Return whether a successful unsafe request changed anything."""
+        return True
+
+    def initial(self, request: Request, *args: Any, **kwargs: Any) -> None:
+        super().initial(request, *args, **kwargs)
+        # read before the data is loaded, so a concurrent change is never
+        # hidden behind this ETag
+        self.etag = None
+        if request.method in ("GET", "HEAD"):
+            self.etag = self.get_etag(request)
+            if_none_match = request.headers.get("If-None-Match", "")
+            if self.etag and _weak_match(self.etag, if_none_match):
+                raise NotModified
+
+    def handle_exception(self, exc: Exception) -> Response:
+        if isinstance(exc, NotModified):
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED,
+                headers={"ETag": self.etag},
+            )
+        return super().handle_exception(exc)
+
+    def finalize_response(
+        self, request: Request, response: Response, *args: Any, **kwargs: Any
+    ) -> Response:
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if getattr(self, "etag", None) and response.status_code == 200:  # noqa: PLR2004
+            response["ETag"] = self.etag
+        elif (
+            request.method not in ("GET", "HEAD", "OPTIONS")
+            and status.is_success(response.status_code)
+            and request.user.is_authenticated
+            and self.has_changed(request, response)
+        ):
+            scope, user_id = self.etag_scope, request.user.id
+            transaction.on_commit(lambda: bump_version(scope, [user_id]))
+        return response
+
+
+def _weak_match(etag: str, if_none_match: str) -> bool:
+    """Return whether the ETag matches the header (weak comparison)."""
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in {
+        tag.removeprefix("W/") for tag in parse_etags(if_none_match)
+    }
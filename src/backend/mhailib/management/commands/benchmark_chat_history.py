@@ -0,0 +1,106 @@
+"""Benchmark the chat history loader on a large diary."""
+
+import statistics
+import time
+
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from my_diary.models import MyDiary
+
+from mhailib.messages.db import load_chat_history
+
+TEXT = (
+    "Today I felt tired and anxious at work, but talking to a friend in "
+    "the evening helped me feel a bit better. "
+) * 5
+
+
+def _load_all_rows(user_id: int, last_k: int) -> list[dict[str, Any]]:
+    """Load the history as before, fetching the whole diary."""
+    messages = MyDiary.objects.filter(user_id=user_id).order_by(
+        "prompt_timestamp"
+    )
+    messages = messages[max(0, len(messages) - last_k) :]
+
+    history = []
+    for message in messages:
+        history.append({"role": "user", "content": message.prompt})
+        history.append({"role": "assistant", "content": message.response})
+    return history
+
+
+class Command(BaseCommand):
+    """Compare the chat history loaders for growing diary sizes."""
+
+    help = (
+        "Benchmark the chat history loader. The diary rows are created in a "
+        "transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add the command arguments."""
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[100, 1000, 10000],
+            help="Number of diary rows of the user.",
+        )
+        parser.add_argument("--last-k", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Run the benchmark."""
+        self.stdout.write(
+            f"{'rows':>8}{'loader':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+            f"{'queries':>9}"
+        )
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                email="benchmark-chat-history@mymhai.com"
+            )
+            created = 0
+            for size in sorted(options["sizes"]):
+                MyDiary.objects.bulk_create(
+                    [
+                        MyDiary(user=user, prompt=TEXT, response=TEXT)
+                        for _ in range(size - created)
+                    ],
+                    batch_size=1000,
+                )
+                created = size
+
+                for name, loader in (
+                    ("all rows", _load_all_rows),
+                    ("last k", load_chat_history),
+                ):
+                    self._report(size, name, loader, user.id, options)
+
+            transaction.set_rollback(True)
+
+    def _report(
+        self,
+        size: int,
+        name: str,
+        loader: Any,
+        user_id: int,
+        options: dict[str, Any],
+    ) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            loader(user_id, options["last_k"])
+
+        latencies = []
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            loader(user_id, options["last_k"])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write(
+            f"{size:>8}{name:>10}{statistics.median(latencies):>10.2f}"
+            f"{statistics.quantiles(latencies, n=20)[-1]:>10.2f}"
+            f"{len(queries):>9}"
+        )
@@ -0,0 +1,151 @@
+"""Benchmark the loader of the chat history with its evaluations."""
+
+import statistics
+import time
+
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+    CommandParser,
+)
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from my_diary.api.serializers import (
+    MhaiDiaryEvalEmotionsSerializer,
+    MhaiDiaryEvalMentBertSerializer,
+    MhaiDiaryEvalPsychBertSerializer,
+    MhaiDiarySerializer,
+)
+from my_diary.models import (
+    MhaiDiaryEvalEmotions,
+    MhaiDiaryEvalMentBert,
+    MhaiDiaryEvalPsychBert,
+    MyDiary,
+)
+
+from mhailib.management.commands.benchmark_chat_history import TEXT
+from mhailib.messages.db import (
+    load_chat_and_evaluation_history_last_k,
+    score_fields,
+)
+
+SERIALIZERS = {
+    "emotions": (MhaiDiaryEvalEmotionsSerializer, "mhaidiaryevalemotions_set"),
+    "mentbert": (MhaiDiaryEvalMentBertSerializer, "mhaidiaryevalmentbert_set"),
+    "psychbert": (
+        MhaiDiaryEvalPsychBertSerializer,
+        "mhaidiaryevalpsychbert_set",
+    ),
+}
+
+
+def _load_per_row(user_id: int, last_k: int) -> list[dict[str, Any]]:
+    """Load the history as before, with serializers and queries per row."""
+    messages = MyDiary.objects.filter(user_id=user_id).order_by(
+        "-prompt_timestamp", "-id"
+    )[:last_k]
+
+    history = []
+    for message in messages:
+        data = dict(MhaiDiarySerializer(message).data)
+        for name, (serializer, relation) in SERIALIZERS.items():
+            scores = getattr(message, relation).first()
+            data[name] = serializer(scores).data if scores else {}
+        history.append(data)
+    return history[::-1]
+
+
+class Command(BaseCommand):
+    """Compare the loaders of the history with evaluations, for growing k."""
+
+    help = (
+        "Benchmark the loader of the chat history with its evaluations. The "
+        "diary rows are created in a transaction that is rolled back at the "
+        "end."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add the command arguments."""
+        parser.add_argument(
+            "--last-k",
+            nargs="+",
+            type=int,
+            default=[10, 100, 1000],
+            help="Number of messages loaded.",
+        )
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Run the benchmark."""
+        self.stdout.write(
+            f"{'k':>6}{'loader':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+            f"{'queries':>9}"
+        )
+        with transaction.atomic():
+            user_id = self._create_diary(max(options["last_k"]))
+
+            for last_k in sorted(options["last_k"]):
+                outputs = [
+                    self._report(last_k, name, loader, user_id, options)
+                    for name, loader in (
+                        ("per row", _load_per_row),
+                        ("prefetch", load_chat_and_evaluation_history_last_k),
+                    )
+                ]
+                if outputs[0] != outputs[1]:
+                    msg = (
+                        f"The histories of the last {last_k} messages differ."
+                    )
+                    raise CommandError(msg)
+
+            transaction.set_rollback(True)
+
+    def _create_diary(self, size: int) -> int:
+        user = get_user_model().objects.create_user(
+            email="benchmark-evaluation-history@mymhai.com"
+        )
+        messages = MyDiary.objects.bulk_create(
+            [
+                MyDiary(user=user, prompt=TEXT, response=TEXT)
+                for _ in range(size)
+            ],
+            batch_size=1000,
+        )
+        for model in (
+            MhaiDiaryEvalEmotions,
+            MhaiDiaryEvalMentBert,
+            MhaiDiaryEvalPsychBert,
+        ):
+            scores = dict.fromkeys(score_fields(model), 0.5)
+            model.objects.bulk_create(
+                [model(my_diary=message, **scores) for message in messages],
+                batch_size=1000,
+            )
+        return user.id
+
+    def _report(
+        self,
+        last_k: int,
+        name: str,
+        loader: Any,
+        user_id: int,
+        options: dict[str, Any],
+    ) -> list[dict[str, Any]]:
+        with CaptureQueriesContext(connection) as queries:
+            history = loader(user_id, last_k)
+
+        latencies = []
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            loader(user_id, last_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write(
+            f"{last_k:>6}{name:>10}{statistics.median(latencies):>10.2f}"
+            f"{statistics.quantiles(latencies, n=20)[-1]:>10.2f}"
+            f"{len(queries):>9}"
+        )
+        return [dict(entry) for entry in history]
@@ -0,0 +1,155 @@
+"""Benchmark the inference backends of the classification models."""
+
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from mhailib.messages.backends import OnnxBackend, TorchBackend
+from mhailib.messages.evaluations import TokenizationCache
+from mhailib.messages.registry import MODEL_SPECS, ModelRegistry
+
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+SENTENCE = (
+    "Today I felt tired and anxious at work, but talking to a friend in "
+    "the evening helped me feel a bit better. "
+)
+
+
+def _rss_mb() -> float:
+    """Return the resident memory of the current process, in MB."""
+    status = Path("/proc/self/status")
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    # peak memory, in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _make_backend(name: str) -> TorchBackend | OnnxBackend:
+    if name == "torch":
+        return TorchBackend()
+    return OnnxBackend(
+        settings.MHAI_ONNX_CACHE_DIR, quantize=name == "onnx-int8"
+    )
+
+
+class Command(BaseCommand):
+    """Compare the latency and memory of the inference backends."""
+
+    help = "Benchmark the latency and memory of the inference backends."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add the command arguments."""
+        parser.add_argument(
+            "--backend",
+            choices=BACKENDS,
+            help=(
+                "Run a single backend in this process. By default, each "
+                "backend runs in its own process."
+            ),
+        )
+        parser.add_argument(
+            "--models",
+            nargs="+",
+            choices=list(MODEL_SPECS),
+            default=["emotions", "mentbert", "psychbert"],
+        )
+        parser.add_argument("--batch-size", type=int, default=8)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--sentences",
+            type=int,
+            default=10,
+            help="Number of sentences of each text.",
+        )
+        parser.add_argument("--json", action="store_true")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Run the benchmark."""
+        if options["backend"]:
+            result = self._run(options)
+            if options["json"]:
+                self.stdout.write(json.dumps(result))
+            else:
+                self._report([result])
+            return
+
+        results = []
+        for backend in BACKENDS:
+            command = [
+                sys.executable,
+                sys.argv[0],
+                "benchmark_inference",
+                "--backend",
+                backend,
+                "--models",
+                *options["models"],
+                "--batch-size",
+                str(options["batch_size"]),
+                "--repeat",
+                str(options["repeat"]),
+                "--sentences",
+                str(options["sentences"]),
+                "--json",
+            ]
+            output = subprocess.run(  # noqa: S603
+                command, capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+        self._report(results)
+
+    def _run(self, options: dict[str, Any]) -> dict[str, Any]:
+        backend = options["backend"]
+        registry = ModelRegistry(MODEL_SPECS, _make_backend(backend))
+        texts = [SENTENCE * options["sentences"]] * options["batch_size"]
+
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        registry.warmup(options["models"])
+        load_time = time.perf_counter() - start
+        rss_loaded = _rss_mb()
+
+        latencies = []
+        for _ in range(options["repeat"]):
+            # tokenization is shared by all the backends, keep it out
+            tokens = TokenizationCache()
+            features = {
+                name: tokens.encode(registry.get(name).tokenizer, texts)
+                for name in options["models"]
+            }
+            start = time.perf_counter()
+            for name in options["models"]:
+                registry.get(name).predict(features[name])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        return {
+            "backend": backend,
+            "load_s": load_time,
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": statistics.quantiles(latencies, n=20)[-1],
+            "rss_models_mb": rss_loaded - rss_before,
+            "rss_mb": _rss_mb(),
+        }
+
+    def _report(self, results: list[dict[str, Any]]) -> None:
+        self.stdout.write(
+            f"{'backend':<12}{'load (s)':>10}{'p50 (ms)':>10}"
+            f"{'p95 (ms)':>10}{'models (MB)':>13}{'rss (MB)':>10}"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['backend']:<12}{row['load_s']:>10.2f}"
+                f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+                f"{row['rss_models_mb']:>13.0f}{row['rss_mb']:>10.0f}"
+            )
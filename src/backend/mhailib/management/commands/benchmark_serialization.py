@@ -0,0 +1,134 @@
+"""Benchmark the serializers against the projections of the diary API."""
+
+import statistics
+import time
+
+from collections.abc import Callable
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+    CommandParser,
+)
+from django.db import transaction
+from my_diary.api.serializers import (
+    MhaiDiaryEvalEmotionsSerializer,
+    MhaiDiaryEvalMentBertSerializer,
+    MhaiDiaryEvalPsychBertSerializer,
+    MhaiDiarySerializer,
+)
+from my_diary.models import MyDiary
+from rest_framework.renderers import JSONRenderer
+
+from mhailib.management.commands.benchmark_chat_history import TEXT
+from mhailib.messages.db import score_fields
+from mhailib.projections import ORJSONRenderer, Projection
+
+SERIALIZERS = [
+    MhaiDiarySerializer,
+    MhaiDiaryEvalEmotionsSerializer,
+    MhaiDiaryEvalMentBertSerializer,
+    MhaiDiaryEvalPsychBertSerializer,
+]
+
+
+class Command(BaseCommand):
+    """Compare the rendering of long lists with both paths."""
+
+    help = (
+        "Benchmark the rendering of the lists of the diary API, with the "
+        "serializers and with the projections. The diary rows are created "
+        "in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add the command arguments."""
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=10_000,
+            help="Number of rows of each list.",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Run the benchmark."""
+        self.stdout.write(
+            f"{'serializer':>34}{'path':>12}{'p50 (ms)':>10}"
+            f"{'max (ms)':>10}{'KiB':>8}"
+        )
+        with transaction.atomic():
+            user_id = self._create_diary(options["rows"])
+
+            for serializer in SERIALIZERS:
+                queryset = serializer.Meta.model.objects.order_by("id")
+                if serializer.Meta.model is MyDiary:
+                    queryset = queryset.filter(user_id=user_id)
+                else:
+                    queryset = queryset.filter(my_diary__user_id=user_id)
+                self._compare(serializer, queryset, options["repeat"])
+
+            transaction.set_rollback(True)
+
+    def _create_diary(self, size: int) -> int:
+        user = get_user_model().objects.create_user(
+            email="benchmark-serialization@mymhai.com"
+        )
+        messages = MyDiary.objects.bulk_create(
+            [
+                MyDiary(user=user, prompt=TEXT, response=TEXT)
+                for _ in range(size)
+            ],
+            batch_size=1000,
+        )
+        for serializer in SERIALIZERS[1:]:
+            model = serializer.Meta.model
+            scores = dict.fromkeys(score_fields(model), 0.123456789)
+            model.objects.bulk_create(
+                [model(my_diary=message, **scores) for message in messages],
+                batch_size=1000,
+            )
+        return user.id
+
+    def _compare(self, serializer: Any, queryset: Any, repeat: int) -> None:
+        projection = Projection(serializer)
+
+        def render_serializer() -> bytes:
+            data = serializer(queryset, many=True).data
+            return JSONRenderer().render(data)
+
+        def render_projection() -> bytes:
+            rows = queryset.values(*projection.columns)
+            return ORJSONRenderer().render(projection.represent(rows))
+
+        outputs = [
+            self._report(serializer.__name__, name, render, repeat)
+            for name, render in (
+                ("serializer", render_serializer),
+                ("projection", render_projection),
+            )
+        ]
+        if outputs[0] != outputs[1]:
+            msg = f"The outputs of {serializer.__name__} differ."
+            raise CommandError(msg)
+
+    def _report(
+        self,
+        serializer: str,
+        name: str,
+        render: Callable[[], bytes],
+        repeat: int,
+    ) -> bytes:
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = render()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write(
+            f"{serializer:>34}{name:>12}{statistics.median(latencies):>10.2f}"
+            f"{max(latencies):>10.2f}{len(output) / 1024:>8.0f}"
+        )
+        return output
@@ -0,0 +1,42 @@
+"""Embed the diary messages without an embedding of the current model."""
+
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from my_diary.models import MyDiary
+from my_diary.tasks.task_embeddings import embed_messages
+
+
+class Command(BaseCommand):
+    """Backfill the sentence embeddings used to search the diaries."""
+
+    help = "Embed the diary messages without an embedding."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add the command arguments."""
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument(
+            "--queue",
+            action="store_true",
+            help="Send the batches to the workers instead of running here.",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Embed the messages in batches."""
+        message_ids = list(
+            MyDiary.objects.exclude(
+                embedding__model=settings.MHAI_EMBEDDING_MODEL
+            )
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        batch_size = options["batch_size"]
+        for start in range(0, len(message_ids), batch_size):
+            batch = message_ids[start : start + batch_size]
+            if options["queue"]:
+                embed_messages.delay(batch)
+            else:
+                embed_messages(batch)
+
+        self.stdout.write(f"Embedded messages: {len(message_ids)}")
@@ -0,0 +1,34 @@
+"""Show the hit and miss counters of the evaluation cache."""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from mhailib.messages.result_cache import reset_shared_stats, shared_stats
+
+
+class Command(BaseCommand):
+    """Show how many evaluations were served by the result cache."""
+
+    help = "Show the hit and miss counters of the evaluation cache."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add the command arguments."""
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Reset the counters after showing them.",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Show the counters of all the worker processes."""
+        stats = shared_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total if total else 0.0
+
+        self.stdout.write(f"hits: {stats['hits']}")
+        self.stdout.write(f"misses: {stats['misses']}")
+        self.stdout.write(f"hit ratio: {ratio:.1%}")
+
+        if options["reset"]:
+            reset_shared_stats()
@@ -0,0 +1,39 @@
+"""Export the classification models to ONNX."""
+
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from mhailib.messages.backends import OnnxBackend
+from mhailib.messages.registry import MODEL_SPECS
+
+
+class Command(BaseCommand):
+    """Export the classification models used by the ONNX backend."""
+
+    help = "Export the classification models to ONNX."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add the command arguments."""
+        parser.add_argument(
+            "models",
+            nargs="*",
+            choices=list(MODEL_SPECS),
+            help="The models to be exported (all of them by default).",
+        )
+        parser.add_argument(
+            "--quantize",
+            action="store_true",
+            default=settings.MHAI_ONNX_QUANTIZE,
+            help="Quantize the models to int8 (dynamic quantization).",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Export the models, skipping the ones already exported."""
+        backend = OnnxBackend(
+            settings.MHAI_ONNX_CACHE_DIR, quantize=options["quantize"]
+        )
+        for name in options["models"] or MODEL_SPECS:
+            path = backend.export(MODEL_SPECS[name])
+            self.stdout.write(f"{name}: {path}")
@@ -1,104 +1,117 @@
 from __future__ import annotations
 
-from typing import Any
-
-import yaml
-
-from mhailib.messages.config import MAX_TOKENS, client
-from mhailib.messages.db import (
-    get_ai_profile,
-    get_user_profile,
-    load_chat_history,
+from typing import TYPE_CHECKING, Any
+
+from django.conf import settings
+
+from mhailib.messages.config import CHAT_MODEL, MAX_TOKENS, client
+from mhailib.messages.db import load_chat_turns, load_relevant_turns
+from mhailib.messages.llm import get_chat_client
+from mhailib.messages.system_prompt import create_system_message
+from mhailib.messages.tokens import (
+    MESSAGE_OVERHEAD,
+    REPLY_OVERHEAD,
+    message_tokens,
 )
 
+if TYPE_CHECKING:
+    from collections.abc import Callable
 
-def get_chat_prompt_relevant_history(
-    user_id: int, last_k: int = 10
-) -> list[dict[str, Any]]:
-    """
-    Get the most relevant history from the chat.
 
-    Additionally, it also adds the system initial instructions.
+def build_chat_context(
+    user_id: int,
+    prompt: str,
+    message_id: int | None = None,
+    budget: int | None = None,
+) -> list[dict[str, Any]]:
     """
-    system_message = create_system_message(user_id)
-    chat_history = [system_message]
-    chat_history.extend(load_chat_history(user_id, last_k=last_k))
-
-    return chat_history
+    Build the messages sent to the chat model, within a token budget.
 
-
-def create_system_message(user_id: int) -> dict[str, Any]:
-    """
-    Create the system message based on the AI and user profiles.
+    The system message and the new prompt are always sent; the previous
+    messages are added from the most recent one (or, with `MHAI_RAG`, the
+    most relevant ones, see `_candidate_turns`) while they fit in the
+    budget, and sent in chronological order.
 
     Parameters
     ----------
-    user_id: int
+    user_id : int
+        The ID of the user.
+    prompt : str
+        The new message of the user.
+    message_id : int, optional
+        The ID of the new message, left out of the history.
+    budget : int, optional
+        The max number of tokens of the prompt. By default, the value of
+        `MHAI_CONTEXT_TOKEN_BUDGET`.
 
     Returns
     -------
-    dict
-        The system message.
+    list[dict[str, Any]]
+        The system message, the history and the new message.
     """
-    ai_profile = get_ai_profile(user_id)
-    user_profile = get_user_profile(user_id)
-
-    ai_name = ai_profile.get("name", "Mhai")
-    user_name = user_profile.get("name", "User")
-
-    system_content = (
-        f"You are a person called {ai_name} and your purpose is to help "
-        f"a person called {user_name} with mental issues, who potentially "
-        f"could commit suicide. You would act as a very close person to "
-        f"them, but with no romance is accepted. You should "
-        f"block any inappropriate language with kindness. "
-        f"You should sound natural, like a beloved one talking freely "
-        f"and openly. Use chitty chat style, like a conversation "
-        f"between friends. "
-        f"Use max of {MAX_TOKENS} tokens."
-        "You should act most natural "
-        "and human-like way possible. Your goal is to mimic the speech "
-        "patterns, behavior, and emotional responses of a real person. "
-        "You may act as a best friend forever. Here are some guidelines "
-        "to follow:"
-        "1. **Natural Language**: Use contractions, slang, and idiomatic "
-        "expressions common in everyday speech. Avoid overly formal or "
-        "technical language. "
-        "2. **Emotional Responses**: Show empathy, enthusiasm, concern, "
-        "and other emotions appropriate to the conversation. React "
-        "naturally to the user's emotions. "
-        "3. **Personal Connection**: Build a personal connection with the user"
-        ". When appropriated, ask about their day, interests, and feelings. "
-        "Share relatable stories or experiences. In other cases, just dive "
-        "into the context with no questions."
-        "4. **Humor and Playfulness**: Use humor and playfulness to keep "
-        " the conversation light and engaging. Feel free to tease or "
-        "joke in a friendly manner."
-        "5. **Active Listening**: Sometimes, acknowledge and validate the "
-        "user's thoughts and feelings. In another times, just dive into the "
-        "topic and keep the conversation nice and interesting."
-        "6. **Encouragement and Support**: Offer encouragement, support, "
-        "and positive reinforcement. Be there for the user in both good "
-        "times and bad."
-        "7. **Realistic Pacing**: Avoid giving responses that are too "
-        "quick or too slow. Maintain a natural conversational pace."
-        "8. **Consistency**: Maintain a consistent personality and tone "
-        "throughout the conversation, adapting slightly to fit the user's "
-        "needs and preferences."
-        "9. **Context Awareness**: Use context from previous conversations "
-        "to maintain continuity and build a deeper relationship with the user."
-        "Remember, your goal is to create a comfortable, engaging, and "
-        "realistic conversational experience to the user."
-        f"Your profile:\n"
-        f"```\n{yaml.dump(ai_profile)}\n```"
-        f"User profile:\n"
-        f"```\n{yaml.dump(user_profile)}\n```"
+    budget = settings.MHAI_CONTEXT_TOKEN_BUDGET if budget is None else budget
+    system_message = create_system_message(user_id)
+    used = (
+        REPLY_OVERHEAD
+        + message_tokens(system_message["content"])
+        + message_tokens(prompt)
     )
 
-    return {"role": "system", "content": system_content}
-
+    turns = []
+    for turn in _candidate_turns(user_id, prompt, message_id):
+        cost = MESSAGE_OVERHEAD + turn["prompt_tokens"]
+        if turn["response"]:
+            cost += MESSAGE_OVERHEAD + turn["response_tokens"]
+        if used + cost > budget:
+            break
+        used += cost
+        turns.append(turn)
+
+    history = []
+    for turn in sorted(turns, key=lambda item: item["id"]):
+        history.append({"role": "user", "content": turn["prompt"]})
+        if turn["response"]:
+            history.append({"role": "assistant", "content": turn["response"]})
+    return [system_message, *history, {"role": "user", "content": prompt}]
+
+
+def _candidate_turns(
+    user_id: int, prompt: str, message_id: int | None
+) -> list[dict[str, Any]]:
+    """
+    Return the previous messages, in the order they are added to the context.
 
-def ask_ai(prompt: str, user_id: int) -> str:
+    With `MHAI_RAG`, the messages the most similar to the prompt come right
+    after the `MHAI_RAG_RECENT_TURNS` most recent ones.
+    """
+    recent = load_chat_turns(
+        user_id, settings.MHAI_CONTEXT_MAX_TURNS, exclude_id=message_id
+    )
+    if not settings.MHAI_RAG:
+        return recent
+
+    first = recent[: settings.MHAI_RAG_RECENT_TURNS]
+    exclude_ids = {turn["id"] for turn in first}
+    if message_id is not None:
+        exclude_ids.add(message_id)
+    relevant = load_relevant_turns(
+        user_id, prompt, settings.MHAI_RAG_TOP_K, exclude_ids=exclude_ids
+    )
+    relevant_ids = {turn["id"] for turn in relevant}
+    rest = [
+        turn
+        for turn in recent[settings.MHAI_RAG_RECENT_TURNS :]
+        if turn["id"] not in relevant_ids
+    ]
+    return [*first, *relevant, *rest]
+
+
+def ask_ai(
+    prompt: str,
+    user_id: int,
+    on_delta: Callable[[str], None] | None = None,
+    message_id: int | None = None,
+) -> str:
     """
     Get a response from the GPT for a given prompt.
 
@@ -109,6 +122,11 @@ def ask_ai(prompt: str, user_id: int) -> str:
     prompt : str
         The user's input prompt.
     user_id: int
+    on_delta : Callable[[str], None], optional
+        When given, the response is streamed, and this function is called
+        with each new piece of it.
+    message_id : int, optional
+        The ID of the message being answered, left out of the history.
 
     Returns
     -------
@@ -116,19 +134,49 @@ def ask_ai(prompt: str, user_id: int) -> str:
         The response from the GPT-3 model.
     """
 
-    chat_history = get_chat_prompt_relevant_history(user_id=user_id)
-    messages = [{"role": "user", "content": prompt}]
+    messages = build_chat_context(user_id, prompt, message_id=message_id)
+
+    if settings.MHAI_LLM_ASYNC:
+        response = get_chat_client().complete(
+            messages,
+            on_delta,
+            model=CHAT_MODEL,
+            temperature=0.9,
+            max_tokens=MAX_TOKENS,
+        )
+    else:
+        response = _complete(messages, on_delta)
+
+    if not response:
+        raise Exception("No response available")
+
+    return response
+
 
+def _complete(
+    messages: list[dict[str, Any]],
+    on_delta: Callable[[str], None] | None = None,
+) -> str | None:
+    """Return the answer of the chat model, with the synchronous client."""
     chat_completion = client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=CHAT_MODEL,
         temperature=0.9,
         max_tokens=MAX_TOKENS,
-        messages=chat_history + messages,  # type: ignore[arg-type]
+        messages=messages,  # type: ignore[arg-type]
+        stream=on_delta is not None,
     )
 
-    response = chat_completion.choices[0].message.content
-
-    if not response:
-        raise Exception("No response available")
+    if on_delta is None:
+        response = chat_completion.choices[0].message.content
+    else:
+        pieces = []
+        for chunk in chat_completion:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                pieces.append(delta)
+                on_delta(delta)
+        response = "".join(pieces)
 
     return response
@@ -0,0 +1,285 @@
+"""Inference backends for the message classification models."""
+
+from __future__ import annotations
+
+import inspect
+import os
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    from onnxruntime import InferenceSession
+    from transformers import (
+        PretrainedConfig,
+        PreTrainedModel,
+        PreTrainedTokenizerBase,
+    )
+
+    from mhailib.messages.registry import ModelSpec
+
+ONNX_OPSET = 17
+
+
+class Classifier(ABC):
+    """
+    A text classification model, independent of the inference runtime.
+
+    Subclasses only compute the logits of a batch; the probabilities are
+    computed here so every backend returns comparable scores.
+    """
+
+    def __init__(
+        self, tokenizer: PreTrainedTokenizerBase, config: PretrainedConfig
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.config = config
+
+    @abstractmethod
+    def logits(self, features: list[dict[str, list[int]]]) -> np.ndarray:
+        """Return the logits of a batch of tokenized texts."""
+
+    def predict(
+        self, features: list[dict[str, list[int]]]
+    ) -> list[list[float]]:
+        """
+        Return the probability of each label for each tokenized text.
+
+        Parameters
+        ----------
+        features : list[dict[str, list[int]]]
+            The model inputs of each text (e.g. `input_ids`), not padded.
+
+        Returns
+        -------
+        list[list[float]]
+            The probabilities, indexed by the label ids of the model.
+        """
+        logits = self.logits(features).astype(np.float64)
+
+        if (
+            self.config.problem_type == "multi_label_classification"
+            or self.config.num_labels == 1
+        ):
+            probs = 1 / (1 + np.exp(-logits))
+        else:
+            exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probs = exp / exp.sum(axis=-1, keepdims=True)
+
+        return probs.tolist()
+
+
+class TorchClassifier(Classifier):
+    """Run the model with PyTorch, in eager mode."""
+
+    def __init__(
+        self, model: PreTrainedModel, tokenizer: PreTrainedTokenizerBase
+    ) -> None:
+        super().__init__(tokenizer, model.config)
+        self.model = model
+
+    def logits(self, features: list[dict[str, list[int]]]) -> np.ndarray:
+        """Return the logits of a batch of tokenized texts."""
+        import torch
+
+        batch = self.tokenizer.pad(features, return_tensors="pt")
+        with torch.inference_mode():
+            logits = self.model(**batch.to(self.model.device)).logits
+        return logits.float().cpu().numpy()
+
+
+class OnnxClassifier(Classifier):
+    """Run an exported model with ONNX Runtime."""
+
+    def __init__(
+        self,
+        session: InferenceSession,
+        tokenizer: PreTrainedTokenizerBase,
+        config: PretrainedConfig,
+    ) -> None:
+        super().__init__(tokenizer, config)
+        self.session = session
+        self.input_names = [item.name for item in session.get_inputs()]
+
+    def logits(self, features: list[dict[str, list[int]]]) -> np.ndarray:
+        """Return the logits of a batch of tokenized texts."""
+        batch = self.tokenizer.pad(features, return_tensors="np")
+        inputs = {
+            name: batch[name].astype(np.int64) for name in self.input_names
+        }
+        return self.session.run(["logits"], inputs)[0]
+
+
+class TorchBackend:
+    """Load the models as PyTorch models (fp32)."""
+
+    name = "torch"
+
+    def load(self, spec: ModelSpec) -> TorchClassifier:
+        """Load the model and the tokenizer of the given spec."""
+        from transformers import (
+            AutoModelForSequenceClassification,
+            AutoTokenizer,
+        )
+
+        model = AutoModelForSequenceClassification.from_pretrained(
+            spec.model, revision=spec.revision
+        )
+        tokenizer = AutoTokenizer.from_pretrained(
+            spec.model, revision=spec.revision
+        )
+        return TorchClassifier(model.eval(), tokenizer)
+
+
+class OnnxBackend:
+    """
+    Serve the models through ONNX Runtime.
+
+    Each model is exported to ONNX the first time it is needed (optionally
+    with int8 dynamic quantization) and the file is reused by every later
+    process. Serving an exported model doesn't load the PyTorch weights.
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self, cache_dir: str | Path, *, quantize: bool = False
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.quantize = quantize
+
+    def model_path(
+        self, spec: ModelSpec, *, quantize: bool | None = None
+    ) -> Path:
+        """Return the path of the exported model."""
+        quantize = self.quantize if quantize is None else quantize
+        name = spec.model.replace("/", "--")
+        if spec.revision != "main":
+            name = f"{name}@{spec.revision}"
+        suffix = "-int8" if quantize else ""
+        return self.cache_dir / f"{name}{suffix}.onnx"
+
+    def export(self, spec: ModelSpec) -> Path:
+        """
+        Export the model to ONNX, unless it was already exported.
+
+        Parameters
+        ----------
+        spec : ModelSpec
+            The model to be exported.
+
+        Returns
+        -------
+        Path
+            The path of the model served by this backend.
+        """
+        path = self.model_path(spec)
+        if path.exists():
+            return path
+
+        fp32_path = self.model_path(spec, quantize=False)
+        if not fp32_path.exists():
+            self._export_fp32(spec, fp32_path)
+
+        if self.quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            # replace atomically, other workers may be exporting too
+            tmp_path.replace(path)
+
+        return path
+
+    def load(self, spec: ModelSpec) -> OnnxClassifier:
+        """Load the exported model and the tokenizer of the given spec."""
+        import onnxruntime as ort
+
+        from transformers import AutoConfig, AutoTokenizer
+
+        path = self.export(spec)
+        session = ort.InferenceSession(
+            str(path), providers=["CPUExecutionProvider"]
+        )
+        return OnnxClassifier(
+            session,
+            AutoTokenizer.from_pretrained(spec.model, revision=spec.revision),
+            AutoConfig.from_pretrained(spec.model, revision=spec.revision),
+        )
+
+    def _export_fp32(self, spec: ModelSpec, path: Path) -> None:
+        import torch
+
+        from transformers import (
+            AutoModelForSequenceClassification,
+            AutoTokenizer,
+        )
+
+        model = AutoModelForSequenceClassification.from_pretrained(
+            spec.model, revision=spec.revision
+        )
+        tokenizer = AutoTokenizer.from_pretrained(
+            spec.model, revision=spec.revision
+        )
+        # export the logits as a plain tuple output
+        model.config.return_dict = False
+
+        dummy = tokenizer(["hello world"], return_tensors="pt")
+        # the exporter takes the dict inputs in the order of the arguments
+        # of `forward`, not in the order of the tokenizer (e.g. BERT returns
+        # `token_type_ids` before `attention_mask`)
+        input_names = [
+            name
+            for name in inspect.signature(model.forward).parameters
+            if name in dummy
+        ]
+        dynamic_axes: dict[str, Any] = {
+            name: {0: "batch", 1: "sequence"} for name in input_names
+        }
+        dynamic_axes["logits"] = {0: "batch"}
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with torch.no_grad():
+            torch.onnx.export(
+                model.eval(),
+                (dict(dummy),),
+                str(tmp_path),
+                input_names=input_names,
+                output_names=["logits"],
+                dynamic_axes=dynamic_axes,
+                opset_version=ONNX_OPSET,
+            )
+        tmp_path.replace(path)
+
+
+def get_backend(name: str | None = None) -> TorchBackend | OnnxBackend:
+    """
+    Return the inference backend configured in the settings.
+
+    Parameters
+    ----------
+    name : str, optional
+        The backend name ("torch" or "onnx"). By default, the value of
+        `MHAI_INFERENCE_BACKEND`.
+
+    Returns
+    -------
+    TorchBackend | OnnxBackend
+        The inference backend.
+    """
+    name = name or settings.MHAI_INFERENCE_BACKEND
+
+    if name == TorchBackend.name:
+        return TorchBackend()
+    if name == OnnxBackend.name:
+        return OnnxBackend(
+            settings.MHAI_ONNX_CACHE_DIR, quantize=settings.MHAI_ONNX_QUANTIZE
+        )
+
+    raise ValueError(f"Invalid inference backend: {name}.")
@@ -2,8 +2,15 @@ from __future__ import annotations
 
 import os
 
+from django.conf import settings
 from openai import OpenAI
 
-# Set up your OpenAI API key
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
+# Set up your OpenAI API key. The requests of the synchronous client are
+# bounded by the deadline, as the time limits of the tasks are not enforced
+# on every pool (e.g. threads)
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY", ""),
+    timeout=settings.MHAI_LLM_DEADLINE,
+)
+CHAT_MODEL = "gpt-4o-mini"
 MAX_TOKENS = 256
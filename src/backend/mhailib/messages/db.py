@@ -2,21 +2,46 @@
 
 from __future__ import annotations
 
-from collections.abc import Mapping
+import warnings
+
+from collections.abc import Collection, Mapping
 from typing import Any, cast
 
 from ai_profile.api.serializers import AIProfileSerializer
 from ai_profile.models import AIProfile
-from my_diary.api.serializers import (
-    MhaiDiaryEvalEmotionsSerializer,
-    MhaiDiaryEvalMentBertSerializer,
-    MhaiDiaryEvalPsychBertSerializer,
-    MhaiDiarySerializer,
+from django.conf import settings
+from django.db.models import (
+    Case,
+    Model,
+    PositiveIntegerField,
+    Prefetch,
+    QuerySet,
+    Value,
+    When,
+)
+from my_diary.models import (
+    MhaiDiaryEvalEmotions,
+    MhaiDiaryEvalMentBert,
+    MhaiDiaryEvalPsychBert,
+    MyDiary,
 )
-from my_diary.models import MyDiary
 from user_profile.api.serializers import UserProfileSerializer
 from user_profile.models import UserProfile
 
+from mhailib.messages.embeddings import embedder
+from mhailib.messages.retrieval import embedding_index
+from mhailib.messages.tokens import count_tokens
+
+# the statuses of the messages whose answer can't change anymore
+FINAL_STATUSES = (MyDiary.StatusChoices.COMPLETED, MyDiary.StatusChoices.ERROR)
+TURN_FIELDS = ("id", "prompt", "response", "prompt_tokens", "response_tokens")
+# model name -> (table of its scores, reverse relation from MyDiary)
+EVALUATION_MODELS: dict[str, tuple[type[Model], str]] = {
+    "emotions": (MhaiDiaryEvalEmotions, "mhaidiaryevalemotions_set"),
+    "mentbert": (MhaiDiaryEvalMentBert, "mhaidiaryevalmentbert_set"),
+    "psychbert": (MhaiDiaryEvalPsychBert, "mhaidiaryevalpsychbert_set"),
+}
+
 
 def get_ai_profile(user_id: int) -> dict[str, Any]:
     ai_profile = AIProfile.objects.get(user_id=user_id)
@@ -28,7 +53,9 @@ def get_user_profile(user_id: int) -> dict[str, Any]:
     return UserProfileSerializer(user_profile).data
 
 
-def load_chat_history(user_id: int, last_k: int = 10) -> list[dict[str, Any]]:
+def load_chat_history(
+    user_id: int, last_k: int = 10, query: str | None = None
+) -> list[dict[str, Any]]:
     """
     Load the conversation history for a given user using the MyDiary model.
 
@@ -37,6 +64,10 @@ def load_chat_history(user_id: int, last_k: int = 10) -> list[dict[str, Any]]:
     user_id : int
         The ID of the user whose conversation history is to be retrieved.
     last_k: int, default 10
+        The number of (most recent) messages to be loaded.
+    query : str, optional
+        When given, up to `last_k` older messages, the most similar to it
+        (see `load_relevant_turns`), are loaded too.
 
     Returns
     -------
@@ -44,69 +75,276 @@ def load_chat_history(user_id: int, last_k: int = 10) -> list[dict[str, Any]]:
         A list of dictionaries containing user and assistant messages
         with roles "user" or "assistant".
     """
-    # TODO: this should be changed to RAG approach with top 10
-    messages = MyDiary.objects.filter(
-        user_id=user_id,
-    ).order_by("prompt_timestamp")
-    idx_start = max(0, len(messages) - last_k)
-    messages = messages[idx_start:]
+    # only the last k rows and the needed columns are fetched, using the
+    # (user, -prompt_timestamp, -id) index, so the cost doesn't grow with
+    # the size of the diary
+    messages = list(
+        MyDiary.objects.filter(user_id=user_id)
+        .order_by("-prompt_timestamp", "-id")
+        .values_list("id", "prompt", "response")[:last_k]
+    )
+    if query:
+        messages.extend(
+            (turn["id"], turn["prompt"], turn["response"])
+            for turn in load_relevant_turns(
+                user_id,
+                query,
+                last_k,
+                exclude_ids={message_id for message_id, _, _ in messages},
+            )
+        )
 
     history = []
-    for message in messages:
-        history.append({"role": "user", "content": message.prompt})
-        history.append({"role": "assistant", "content": message.response})
+    for _, prompt, response in sorted(messages):
+        history.append({"role": "user", "content": prompt})
+        history.append({"role": "assistant", "content": response})
 
     return history
 
 
+def load_relevant_turns(
+    user_id: int, query: str, k: int, exclude_ids: Collection[int] = ()
+) -> list[dict[str, Any]]:
+    """
+    Load the messages of a user the most similar to a query.
+
+    The similarity is computed between the sentence embeddings of the
+    query and of the prompts, stored by the `embed_messages` task. When
+    the search fails (e.g. the embedding model is not available), no
+    message is returned, so the answer is still given with the recent
+    history.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user whose messages are searched.
+    query : str
+        The text to be compared (e.g. the new message of the user).
+    k : int
+        The max number of messages to be loaded.
+    exclude_ids : Collection[int], optional
+        The IDs of messages to be left out (e.g. those already loaded).
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        The messages (see `load_chat_turns`), from the most similar.
+    """
+    try:
+        vector = embedder.encode([query])[0]
+        ids = embedding_index.search(user_id, vector, k, exclude=exclude_ids)
+    except Exception as e:  # noqa: BLE001
+        warnings.warn(f"Error searching the diary: {e}", stacklevel=2)
+        return []
+
+    turns = {
+        turn["id"]: turn
+        for turn in MyDiary.objects.filter(user_id=user_id, id__in=ids).values(
+            *TURN_FIELDS
+        )
+    }
+    return _count_missing_tokens(
+        [turns[message_id] for message_id in ids if message_id in turns]
+    )
+
+
+def load_chat_turns(
+    user_id: int, limit: int, exclude_id: int | None = None
+) -> list[dict[str, Any]]:
+    """
+    Load the most recent messages of a user, with their token counts.
+
+    The token counts missing (e.g. for messages created before they were
+    stored) are counted and saved, so each message is encoded only once.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user whose conversation history is to be retrieved.
+    limit : int
+        The max number of messages to be loaded.
+    exclude_id : int, optional
+        The ID of a message to be left out (e.g. the one being answered).
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        The `id`, `prompt`, `response`, `prompt_tokens` and
+        `response_tokens` of each message, from the newest to the oldest.
+    """
+    queryset = MyDiary.objects.filter(user_id=user_id)
+    if exclude_id is not None:
+        queryset = queryset.exclude(id=exclude_id)
+    turns = list(
+        queryset.order_by("-prompt_timestamp", "-id").values(*TURN_FIELDS)[
+            :limit
+        ]
+    )
+    return _count_missing_tokens(turns)
+
+
+def _count_missing_tokens(turns: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    missing = {}
+    for turn in turns:
+        if turn["prompt_tokens"] is None or turn["response_tokens"] is None:
+            turn["prompt_tokens"] = count_tokens(turn["prompt"])
+            turn["response_tokens"] = count_tokens(turn["response"])
+            missing[turn["id"]] = turn
+    if missing:
+        # only saved for the final messages, still without counts: those
+        # being answered get their counts along with the answer
+        MyDiary.objects.filter(
+            id__in=list(missing),
+            status__in=FINAL_STATUSES,
+            response_tokens__isnull=True,
+        ).update(
+            **{
+                field: Case(
+                    *(
+                        When(id=message_id, then=Value(turn[field]))
+                        for message_id, turn in missing.items()
+                    ),
+                    output_field=PositiveIntegerField(),
+                )
+                for field in ("prompt_tokens", "response_tokens")
+            }
+        )
+
+    return turns
+
+
+def score_fields(model: type[Model]) -> list[str]:
+    """Return the fields with the scores of an evaluation table."""
+    return [
+        field.attname
+        for field in model._meta.concrete_fields  # noqa: SLF001
+        if field.name not in ("id", "my_diary")
+    ]
+
+
+def with_evaluations(
+    messages: QuerySet[MyDiary], fields: Collection[str] = ()
+) -> QuerySet[MyDiary]:
+    """
+    Load the scores of the messages along with them.
+
+    The scores are joined in the same query with the consolidated storage,
+    or prefetched with one query per evaluation table, so the number of
+    queries doesn't depend on the number of messages. Read them with
+    `evaluation_scores`.
+
+    Parameters
+    ----------
+    messages : QuerySet[MyDiary]
+        The messages.
+    fields : Collection[str], optional
+        The fields of the messages to be loaded; all of them by default.
+    """
+    if settings.MHAI_EVALUATION_STORAGE == "consolidated":
+        messages = messages.select_related("evaluation")
+        if fields:
+            messages = messages.only(
+                *fields,
+                *(f"evaluation__{name}" for name in EVALUATION_MODELS),
+            )
+        return messages
+
+    if fields:
+        messages = messages.only(*fields)
+    return messages.prefetch_related(
+        *(
+            Prefetch(
+                relation,
+                queryset=model.objects.only(
+                    "my_diary_id", *score_fields(model)
+                ),
+                to_attr=f"{name}_scores",
+            )
+            for name, (model, relation) in EVALUATION_MODELS.items()
+        )
+    )
+
+
+def evaluation_scores(message: MyDiary) -> dict[str, dict[str, Any]]:
+    """
+    Return the scores of a message loaded by `with_evaluations`.
+
+    The scores are by model name, empty when the message was not (yet)
+    evaluated by the model.
+    """
+    scores = {}
+    for name, (model, _) in EVALUATION_MODELS.items():
+        if settings.MHAI_EVALUATION_STORAGE == "consolidated":
+            evaluation = getattr(message, "evaluation", None)
+            scores[name] = getattr(evaluation, name, None) or {}
+        else:
+            rows = getattr(message, f"{name}_scores")
+            scores[name] = (
+                {
+                    field: getattr(rows[0], field)
+                    for field in score_fields(model)
+                }
+                if rows
+                else {}
+            )
+    return scores
+
+
 def load_chat_and_evaluation_history_last_k(
     user_id: int, last_k: int = 10
 ) -> list[Mapping[str, Any]]:
     """
     Load the last k conversation history and its evaluations.
 
+    The messages and their scores are loaded with a fixed number of queries
+    (one per evaluation table, or a single one with the consolidated
+    storage), whatever the value of `last_k`.
+
     Parameters
     ----------
     user_id : int
         The ID of the user whose conversation history is to be retrieved.
+    last_k: int, default 10
+        The number of (most recent) messages to be loaded.
 
     Returns
     -------
     list[Mapping[str, Any]]
         A list of dictionaries containing user messages, AI responses,
-        and associated evaluation scores.
+        and associated evaluation scores, from the oldest message. The
+        messages are represented as by `MhaiDiarySerializer`, and the scores
+        of each model as by its evaluation serializer (`id`, `my_diary` and
+        the scores), empty when the message was not evaluated by it.
     """
-    chat_entries = MyDiary.objects.filter(user_id=user_id)[-last_k:]
+    # imported here, the serializers use `evaluation_scores`
+    from my_diary.api.serializers import MhaiDiarySerializer
 
-    history_data = []
+    messages = list(
+        with_evaluations(
+            MyDiary.objects.filter(user_id=user_id).order_by(
+                "-prompt_timestamp", "-id"
+            ),
+            MhaiDiarySerializer.Meta.fields,
+        )[:last_k]
+    )[::-1]
 
-    for chat in chat_entries:
-        chat_data = MhaiDiarySerializer(chat).data
-
-        emotions_data = (
-            MhaiDiaryEvalEmotionsSerializer(chat.mhaidiaryevalemotions).data
-            if hasattr(chat, "mhaidiaryevalemotions")
-            else {}
-        )
-        mentbert_data = (
-            MhaiDiaryEvalMentBertSerializer(chat.mhaidiaryevalmentbert).data
-            if hasattr(chat, "mhaidiaryevalmentbert")
-            else {}
-        )
-        psychbert_data = (
-            MhaiDiaryEvalPsychBertSerializer(chat.mhaidiaryevalpsychbert).data
-            if hasattr(chat, "mhaidiaryevalpsychbert")
-            else {}
-        )
+    history = MhaiDiarySerializer(messages, many=True).data
+    for entry, message in zip(history, messages, strict=True):
+        entry.update(_evaluation_rows(message))
 
-        chat_data.update(
-            {
-                "emotions": emotions_data,
-                "mentbert": mentbert_data,
-                "psychbert": psychbert_data,
-            }
-        )
+    return cast(list[Mapping[str, Any]], history)
 
-        history_data.append(chat_data)
 
-    return cast(list[Mapping[str, Any]], history_data)
+def _evaluation_rows(message: MyDiary) -> dict[str, dict[str, Any]]:
+    """Return the scores of a message with the ids of their rows."""
+    rows = {}
+    for name, scores in evaluation_scores(message).items():
+        if not scores:
+            rows[name] = {}
+            continue
+        if settings.MHAI_EVALUATION_STORAGE == "consolidated":
+            row = message.evaluation
+        else:
+            row = getattr(message, f"{name}_scores")[0]
+        rows[name] = {"id": row.id, "my_diary": message.id, **scores}
+    return rows
@@ -0,0 +1,87 @@
+"""Sentence embeddings of the diary messages, computed locally on CPU."""
+
+from __future__ import annotations
+
+import threading
+
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+# max number of tokens of the embedded texts
+MAX_LENGTH = 256
+
+
+class Embedder:
+    """
+    Compute the sentence embeddings of texts.
+
+    The model is loaded on the first use. The embedding of a text is the
+    mean of its token embeddings (ignoring the padding), L2-normalized.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32) -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model: Any = None
+        self._tokenizer: Any = None
+        self._lock = threading.Lock()
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Return the embeddings of the given texts.
+
+        Parameters
+        ----------
+        texts : Sequence[str]
+            The texts to be embedded.
+
+        Returns
+        -------
+        np.ndarray
+            A float32 matrix with one normalized vector per text.
+        """
+        import torch
+
+        self._load()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self._tokenizer(
+                list(texts[start : start + self.batch_size]),
+                padding=True,
+                truncation=True,
+                max_length=MAX_LENGTH,
+                return_tensors="pt",
+            )
+            with torch.inference_mode():
+                hidden = self._model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(
+                min=1e-9
+            )
+            vectors.append(pooled.float().numpy())
+
+        return normalize(np.concatenate(vectors).astype(np.float32))
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._model is not None:
+                return
+            from transformers import AutoModel, AutoTokenizer
+
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self._model = AutoModel.from_pretrained(self.model_name).eval()
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Return the vectors (rows) scaled to unit length."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+embedder = Embedder(settings.MHAI_EMBEDDING_MODEL)
@@ -2,74 +2,338 @@
 
 from __future__ import annotations
 
-import tiktoken
+from typing import TYPE_CHECKING, Any
 
-from transformers import pipeline
+import numpy as np
 
-encoding_cl100k_base = tiktoken.get_encoding("cl100k_base")
+from django.conf import settings
 
-# Initialize sentiment analysis pipeline
-sentiment_pipeline = pipeline(
-    "sentiment-analysis",
-    model="nlptown/bert-base-multilingual-uncased-sentiment",
-    top_k=None,
-)
+from mhailib.messages.registry import registry
+from mhailib.messages.result_cache import result_cache
 
-# Initialize emotion detection pipeline
-# (may need fine-tuning or finding a suitable model)
-emotion_pipeline = pipeline(
-    "text-classification",
-    model="j-hartmann/emotion-english-distilroberta-base",
-    top_k=None,
-)
+if TYPE_CHECKING:
+    from collections.abc import Iterable
 
-mentbert_pipeline = pipeline(
-    "text-classification",
-    model="reab5555/mentBERT",
-    top_k=None,
-)
+    from transformers import PreTrainedTokenizerBase
 
-psychbert_pipeline = pipeline(
-    "text-classification",
-    model="mnaylor/psychbert-finetuned-multiclass",
-    top_k=None,
-)
+    from mhailib.messages.backends import Classifier
 
-MAX_TOKENS = 450
+# max sequence length accepted by the classification models
+MAX_LENGTH = 512
 
+# how the scores of the windows of a long text are combined
+REDUCERS = ("mean", "max", "weighted")
 
-def num_tokens_from_string(string: str) -> int:
-    """Returns the number of tokens in a text string."""
-    return len(encoding_cl100k_base.encode(string))
+LABEL_MAPS: dict[str, dict[str, str]] = {
+    "psychbert": {
+        "LABEL_0": "negative",
+        "LABEL_1": "mental illnesses",
+        "LABEL_2": "anxiety",
+        "LABEL_3": "depression",
+        "LABEL_4": "social anxiety",
+        "LABEL_5": "loneliness",
+    },
+}
 
 
-def truncate_tokens(string: str, max_num_tokens: int) -> str:
-    """Returns the number of tokens in a text string."""
-    tokens = encoding_cl100k_base.encode(string)
-    return encoding_cl100k_base.decode(tokens[:max_num_tokens])
+class TokenizationCache:
+    """
+    Tokenize each text only once per tokenizer during an evaluation run.
 
+    Models sharing a tokenizer, and every later use of the same text in the
+    run, reuse the token ids computed the first time.
+    """
 
-def eval_sentiment(text: str) -> dict[str, float]:
+    def __init__(self) -> None:
+        self._token_ids: dict[tuple[str, str], list[int]] = {}
+
+    def token_ids(
+        self, tokenizer: PreTrainedTokenizerBase, texts: list[str]
+    ) -> list[list[int]]:
+        """Return the token ids (without special tokens) of the texts."""
+        name = tokenizer.name_or_path
+        missing = [
+            text
+            for text in dict.fromkeys(texts)
+            if (name, text) not in self._token_ids
+        ]
+
+        if missing:
+            encoded = tokenizer(
+                missing, add_special_tokens=False, verbose=False
+            )
+            for text, ids in zip(missing, encoded["input_ids"], strict=True):
+                self._token_ids[(name, text)] = ids
+
+        return [self._token_ids[(name, text)] for text in texts]
+
+    def encode(
+        self, tokenizer: PreTrainedTokenizerBase, texts: list[str]
+    ) -> list[dict[str, list[int]]]:
+        """Return the model inputs of the texts, truncated to MAX_LENGTH."""
+        return [
+            tokenizer.prepare_for_model(
+                ids, truncation=True, max_length=MAX_LENGTH
+            )
+            for ids in self.token_ids(tokenizer, texts)
+        ]
+
+    def windows(
+        self, tokenizer: PreTrainedTokenizerBase, texts: list[str], stride: int
+    ) -> tuple[list[dict[str, list[int]]], list[int]]:
+        """
+        Split the texts into overlapping windows of up to MAX_LENGTH tokens.
+
+        Parameters
+        ----------
+        tokenizer : PreTrainedTokenizerBase
+            The tokenizer of the model.
+        texts : list[str]
+            The texts to be split.
+        stride : int
+            The number of tokens shared by consecutive windows.
+
+        Returns
+        -------
+        tuple[list[dict[str, list[int]]], list[int]]
+            The model inputs of all the windows, and the index of the text
+            of each window.
+        """
+        size = MAX_LENGTH - tokenizer.num_special_tokens_to_add()
+        step = size - stride
+        if step <= 0:
+            raise ValueError(
+                f"The window stride ({stride}) must be smaller than the "
+                f"window size ({size})."
+            )
+
+        features = []
+        owners = []
+        for i, ids in enumerate(self.token_ids(tokenizer, texts)):
+            start = 0
+            while True:
+                window = ids[start : start + size]
+                features.append(tokenizer.prepare_for_model(window))
+                owners.append(i)
+                if start + size >= len(ids):
+                    break
+                start += step
+
+        return features, owners
+
+
+def reduce_windows(
+    probs: list[list[float]],
+    owners: list[int],
+    weights: list[int],
+    reducer: str,
+) -> list[list[float]]:
     """
-    Get the level of the sentimental.
+    Combine the scores of the windows of each text.
 
-    Restriction of 512 tokens.
+    Parameters
+    ----------
+    probs : list[list[float]]
+        The probabilities of each window.
+    owners : list[int]
+        The index of the text of each window.
+    weights : list[int]
+        The length (in tokens) of each window.
+    reducer : str
+        "mean", "max" (the highest score of each label in any window) or
+        "weighted" (mean weighted by the length of the windows).
+
+    Returns
+    -------
+    list[list[float]]
+        The probabilities of each text.
     """
-    if not text:
-        return {}
+    if reducer not in REDUCERS:
+        raise ValueError(f"Invalid window reducer: {reducer}.")
+
+    probs_array = np.asarray(probs)
+    owners_array = np.asarray(owners)
+    weights_array = np.asarray(weights, dtype=float)
+
+    results = []
+    for owner in dict.fromkeys(owners):
+        mask = owners_array == owner
+        if reducer == "max":
+            row = probs_array[mask].max(axis=0)
+        elif reducer == "weighted":
+            row = np.average(
+                probs_array[mask], axis=0, weights=weights_array[mask]
+            )
+        else:
+            row = probs_array[mask].mean(axis=0)
+        results.append(row.tolist())
+
+    return results
+
+
+def _format_scores(
+    model_name: str, result_raw: list[dict[str, Any]]
+) -> dict[str, float]:
+    label_map = LABEL_MAPS.get(model_name, {})
+    return {
+        (
+            label_map.get(row["label"], row["label"]).lower().replace(" ", "-")
+        ): row["score"]
+        for row in result_raw
+    }
+
+
+def _predict(
+    classifier: Classifier, features: list[dict[str, list[int]]]
+) -> list[list[float]]:
+    """Run the model on batches of at most `MHAI_INFERENCE_BATCH_SIZE`."""
+    size = settings.MHAI_INFERENCE_BATCH_SIZE
+    probs: list[list[float]] = []
+    for start in range(0, len(features), size):
+        probs.extend(classifier.predict(features[start : start + size]))
+    return probs
+
 
-    if num_tokens_from_string(text) > MAX_TOKENS:
-        text = truncate_tokens(text, MAX_TOKENS)
+def _classify(
+    model_name: str, texts: list[str], tokens: TokenizationCache
+) -> list[dict[str, float]]:
+    results: list[dict[str, float]] = [{} for _ in texts]
+    indexes = [i for i, text in enumerate(texts) if text]
+
+    if not indexes:
+        return results
+
+    classifier = registry.get(model_name)
+    id2label = classifier.config.id2label
+    inputs = [texts[i] for i in indexes]
 
     try:
-        result_raw = sentiment_pipeline(text)[0]
+        if settings.MHAI_LONG_TEXT_MODE == "sliding":
+            # the windows of all the texts are batched together, and
+            # combined once all of them are evaluated
+            features, owners = tokens.windows(
+                classifier.tokenizer, inputs, settings.MHAI_WINDOW_STRIDE
+            )
+            probs = reduce_windows(
+                _predict(classifier, features),
+                owners,
+                [len(item["input_ids"]) for item in features],
+                settings.MHAI_WINDOW_REDUCER,
+            )
+        else:
+            features = tokens.encode(classifier.tokenizer, inputs)
+            probs = _predict(classifier, features)
     except Exception:  # noqa: BLE001
-        return {}
-
-    return {
-        row["label"].lower().replace(" ", "-"): row["score"]
-        for row in result_raw
+        return results
+
+    for i, row in zip(indexes, probs, strict=True):
+        result_raw = sorted(
+            (
+                {"label": id2label[label_id], "score": score}
+                for label_id, score in enumerate(row)
+            ),
+            key=lambda item: item["score"],
+            reverse=True,
+        )
+        results[i] = _format_scores(model_name, result_raw)
+
+    return results
+
+
+def _classify_cached(
+    model_name: str, texts: list[str], tokens: TokenizationCache
+) -> list[dict[str, float]]:
+    keys = {
+        i: result_cache.key(model_name, text)
+        for i, text in enumerate(texts)
+        if text
     }
+    found = result_cache.get_many(list(dict.fromkeys(keys.values())))
+
+    # texts repeated in the batch are evaluated only once
+    pending = {key: texts[i] for i, key in keys.items() if key not in found}
+    if pending:
+        scores = _classify(model_name, list(pending.values()), tokens)
+        # failures (empty scores) are not cached
+        new = {
+            key: value
+            for key, value in zip(pending, scores, strict=True)
+            if value
+        }
+        result_cache.set_many(new)
+        found.update(new)
+
+    return [found.get(keys.get(i, ""), {}) for i in range(len(texts))]
+
+
+def eval_texts(
+    texts: list[str],
+    model_names: Iterable[str],
+    tokens: TokenizationCache | None = None,
+) -> dict[str, list[dict[str, float]]]:
+    """
+    Evaluate several texts with several models.
+
+    Each text is tokenized only once per tokenizer. Texts longer than the
+    max length of the model are truncated or, when `MHAI_LONG_TEXT_MODE` is
+    "sliding", split into overlapping windows whose scores are combined
+    with `MHAI_WINDOW_REDUCER`. Each model runs batched calls over all the
+    texts (or windows), of at most `MHAI_INFERENCE_BATCH_SIZE` inputs.
+
+    When `MHAI_EVALUATION_CACHE` is enabled, the scores are cached by the
+    content of the texts, and only the texts not in the cache are
+    evaluated.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The texts to be evaluated.
+    model_names : Iterable[str]
+        The names of the models in the registry (e.g. "emotions").
+    tokens : TokenizationCache, optional
+        The tokenization cache of the current run.
+
+    Returns
+    -------
+    dict[str, list[dict[str, float]]]
+        The scores by model name, for each text in the same order as
+        `texts`. Empty texts, or a failure in the model, result in empty
+        dictionaries.
+    """
+    tokens = tokens or TokenizationCache()
+    classify = (
+        _classify_cached if settings.MHAI_EVALUATION_CACHE else _classify
+    )
+    return {name: classify(name, texts, tokens) for name in model_names}
+
+
+def eval_batch(model_name: str, texts: list[str]) -> list[dict[str, float]]:
+    """
+    Evaluate several texts with one model in a single batched call.
+
+    Parameters
+    ----------
+    model_name : str
+        The name of the model in the registry (e.g. "emotions").
+    texts : list[str]
+        The texts to be evaluated.
+
+    Returns
+    -------
+    list[dict[str, float]]
+        The scores for each text, in the same order as `texts`.
+    """
+    return eval_texts(texts, [model_name])[model_name]
+
+
+def eval_sentiment(text: str) -> dict[str, float]:
+    """
+    Get the level of the sentimental.
+
+    Texts longer than 512 tokens are truncated, unless the sliding window
+    mode is enabled.
+    """
+    return eval_batch("sentiment", [text])[0]
 
 
 def eval_emotions(text: str) -> dict[str, float]:
@@ -86,21 +350,7 @@ def eval_emotions(text: str) -> dict[str, float]:
             'surprise': 0.010109353810548782,
             'fear': 0.0059448955580592155}
     """
-    if not text:
-        return {}
-
-    if num_tokens_from_string(text) > MAX_TOKENS:
-        text = truncate_tokens(text, MAX_TOKENS)
-
-    try:
-        result_raw = emotion_pipeline(text)[0]
-    except Exception:  # noqa: BLE001
-        return {}
-
-    return {
-        row["label"].lower().replace(" ", "-"): row["score"]
-        for row in result_raw
-    }
+    return eval_batch("emotions", [text])[0]
 
 
 def eval_psychbert(text: str) -> dict[str, float]:
@@ -128,32 +378,7 @@ def eval_psychbert(text: str) -> dict[str, float]:
     ----------
     https://huggingface.co/mnaylor/psychbert-finetuned-multiclass
     """
-    if not text:
-        return {}
-
-    label_map = {
-        "LABEL_0": "negative",
-        "LABEL_1": "mental illnesses",
-        "LABEL_2": "anxiety",
-        "LABEL_3": "depression",
-        "LABEL_4": "social anxiety",
-        "LABEL_5": "loneliness",
-    }
-
-    if num_tokens_from_string(text) > MAX_TOKENS:
-        text = truncate_tokens(text, MAX_TOKENS)
-
-    try:
-        result_raw = psychbert_pipeline(text)[0]
-    except Exception:  # noqa: BLE001
-        return {}
-
-    return {
-        (
-            label_map.get(row["label"], row["label"]).lower().replace(" ", "-")
-        ): row["score"]
-        for row in result_raw
-    }
+    return eval_batch("psychbert", [text])[0]
 
 
 def eval_mentbert(text: str) -> dict[str, float]:
@@ -184,18 +409,4 @@ def eval_mentbert(text: str) -> dict[str, float]:
     ----------
     https://huggingface.co/reab5555/mentBERT
     """
-    if not text:
-        return {}
-
-    if num_tokens_from_string(text) > MAX_TOKENS:
-        text = truncate_tokens(text, MAX_TOKENS)
-
-    try:
-        result_raw = mentbert_pipeline(text)[0]
-    except Exception:  # noqa: BLE001
-        return {}
-
-    return {
-        row["label"].lower().replace(" ", "-"): row["score"]
-        for row in result_raw
-    }
+    return eval_batch("mentbert", [text])[0]
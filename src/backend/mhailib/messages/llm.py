@@ -0,0 +1,280 @@
+"""Async client of the chat model, shared by all the tasks of a process."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+import time
+
+from functools import cache
+from typing import TYPE_CHECKING, Any
+
+import openai
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+# errors caused by the load or the availability of the API
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+class CircuitOpenError(Exception):
+    """The chat model failed too many times, calls are not being sent."""
+
+
+class CircuitBreaker:
+    """
+    Stop calling the API after consecutive failures.
+
+    After `failure_threshold` consecutive failures, the circuit opens and
+    calls fail at once for `reset_timeout` seconds. Then a single trial
+    call is allowed (half-open): its success closes the circuit, its
+    failure opens it again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial = False
+
+    @property
+    def state(self) -> str:
+        """Return "closed", "open" or "half-open"."""
+        if self.opened_at is None:
+            return "closed"
+        if self.trial or self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Return whether a call can be sent now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def success(self) -> None:
+        """Record a successful call."""
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self) -> None:
+        """Record a failed call."""
+        self.failures += 1
+        self.trial = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+
+class AsyncChatClient:
+    """
+    Send the chat completions from a background event loop.
+
+    A single `AsyncOpenAI` client (and its connection pool) runs on an
+    event loop owned by this process, so the calling threads (e.g. the
+    tasks of a worker with the threads pool) only wait for their result,
+    and up to `concurrency` completions are in flight at the same time.
+
+    Each call must finish before its deadline (`deadline` seconds after it
+    is made), including the time waiting for a free slot, the retries and
+    the waits between them. Rate limits, server errors and connection
+    errors are retried with a jittered exponential backoff, and counted
+    by the circuit breaker.
+    """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int,
+        deadline: float,
+        max_retries: int,
+        breaker: CircuitBreaker,
+        backoff: tuple[float, float] = (0.5, 8.0),
+        **client_options: Any,
+    ) -> None:
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.breaker = breaker
+        # base and max (in seconds) of the waits between retries
+        self.backoff_base, self.backoff_cap = backoff
+        self.client_options = client_options
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._client: openai.AsyncOpenAI | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def complete(
+        self,
+        messages: list[dict[str, Any]],
+        on_delta: Callable[[str], None] | None = None,
+        **params: Any,
+    ) -> str:
+        """
+        Return the answer of the chat model, blocking the calling thread.
+
+        Parameters
+        ----------
+        messages : list[dict[str, Any]]
+            The messages of the chat.
+        on_delta : Callable[[str], None], optional
+            When given, the answer is streamed, and this function is called
+            (in a thread of the event loop) with each new piece of it.
+        **params : Any
+            The parameters of the completion (e.g. `model`).
+
+        Returns
+        -------
+        str
+            The answer.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.acomplete(messages, on_delta, **params), self._get_loop()
+        )
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. the soft time limit of the task
+            future.cancel()
+            raise
+
+    async def acomplete(
+        self,
+        messages: list[dict[str, Any]],
+        on_delta: Callable[[str], None] | None = None,
+        **params: Any,
+    ) -> str:
+        """Return the answer of the chat model (see `complete`)."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("The chat model is not available.")
+
+        deadline = asyncio.get_running_loop().time() + self.deadline
+        try:
+            async with asyncio.timeout_at(deadline), self._semaphore:
+                answer = await self._complete_with_retries(
+                    messages, on_delta, params, deadline
+                )
+        except (*RETRYABLE_ERRORS, TimeoutError):
+            self.breaker.failure()
+            raise
+        except BaseException:
+            # not caused by the API (e.g. a bad request), the trial ends
+            self.breaker.trial = False
+            raise
+
+        self.breaker.success()
+        return answer
+
+    async def _complete_with_retries(
+        self,
+        messages: list[dict[str, Any]],
+        on_delta: Callable[[str], None] | None,
+        params: dict[str, Any],
+        deadline: float,
+    ) -> str:
+        attempt = 0
+        pieces: list[str] = []
+
+        while True:
+            try:
+                return await self._complete_once(
+                    messages, on_delta, params, pieces, deadline
+                )
+            except RETRYABLE_ERRORS:
+                # the pieces already sent can't be taken back
+                if attempt >= self.max_retries or pieces:
+                    raise
+            # full jitter, so the workers don't retry all at once
+            delay = random.uniform(  # noqa: S311
+                0, min(self.backoff_cap, self.backoff_base * 2**attempt)
+            )
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _complete_once(
+        self,
+        messages: list[dict[str, Any]],
+        on_delta: Callable[[str], None] | None,
+        params: dict[str, Any],
+        pieces: list[str],
+        deadline: float,
+    ) -> str:
+        remaining = deadline - asyncio.get_running_loop().time()
+        response = await self._client.chat.completions.create(
+            messages=messages,  # type: ignore[arg-type]
+            stream=on_delta is not None,
+            timeout=max(remaining, 0.001),
+            **params,
+        )
+        if on_delta is None:
+            return response.choices[0].message.content or ""
+
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                pieces.append(delta)
+                # e.g. publishing to redis, kept out of the event loop
+                await asyncio.to_thread(on_delta, delta)
+        return "".join(pieces)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # the loop thread doesn't survive a fork (e.g. prefork pool)
+            if self._loop is None or self._pid != os.getpid():
+                self._start()
+            return self._loop
+
+    def _start(self) -> None:
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(
+            target=loop.run_forever, name="mhai-chat-client", daemon=True
+        )
+        thread.start()
+
+        async def setup() -> None:
+            self._client = openai.AsyncOpenAI(
+                max_retries=0, **self.client_options
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        asyncio.run_coroutine_threadsafe(setup(), loop).result()
+        self._loop = loop
+        self._pid = os.getpid()
+
+
+@cache
+def get_chat_client() -> AsyncChatClient:
+    """Return the (process-wide) async client of the chat model."""
+    return AsyncChatClient(
+        concurrency=settings.MHAI_LLM_CONCURRENCY,
+        deadline=settings.MHAI_LLM_DEADLINE,
+        max_retries=settings.MHAI_LLM_MAX_RETRIES,
+        breaker=CircuitBreaker(
+            failure_threshold=settings.MHAI_LLM_BREAKER_FAILURES,
+            reset_timeout=settings.MHAI_LLM_BREAKER_RESET,
+        ),
+        api_key=os.getenv("OPENAI_API_KEY", ""),
+    )
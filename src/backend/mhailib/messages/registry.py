@@ -0,0 +1,140 @@
+"""Process-scoped registry for the message classification models."""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from mhailib.messages.backends import (
+        Classifier,
+        OnnxBackend,
+        TorchBackend,
+    )
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Describe how a classification pipeline should be built."""
+
+    model: str
+    # the model revision (branch, tag or commit) on the hugging face hub
+    revision: str = "main"
+    # whether the tokenizer splits the text on whitespaces (e.g. WordPiece),
+    # so repeated whitespaces don't change the tokens; byte-level BPE
+    # tokenizers (e.g. RoBERTa) keep them
+    splits_whitespace: bool = True
+
+
+MODEL_SPECS: dict[str, ModelSpec] = {
+    "sentiment": ModelSpec(
+        model="nlptown/bert-base-multilingual-uncased-sentiment"
+    ),
+    # may need fine-tuning or finding a suitable model
+    "emotions": ModelSpec(
+        model="j-hartmann/emotion-english-distilroberta-base",
+        splits_whitespace=False,
+    ),
+    "mentbert": ModelSpec(model="reab5555/mentBERT"),
+    "psychbert": ModelSpec(model="mnaylor/psychbert-finetuned-multiclass"),
+}
+
+
+def models_version(names: Iterable[str]) -> str:
+    """
+    Return a short identifier of the given models and their revisions.
+
+    Parameters
+    ----------
+    names : Iterable[str]
+        The names of the models (e.g. "emotions").
+
+    Returns
+    -------
+    str
+        The first 16 hex digits of the hash of the ids and revisions.
+    """
+    specs = ",".join(
+        f"{name}={MODEL_SPECS[name].model}@{MODEL_SPECS[name].revision}"
+        for name in sorted(names)
+    )
+    return hashlib.sha256(specs.encode()).hexdigest()[:16]
+
+
+class ModelRegistry:
+    """
+    Load the classification models on first use.
+
+    The inference runtime (e.g. `torch`) is only imported when a model is
+    requested for the first time, so processes that never run inference,
+    like the web workers, don't load any model into memory.
+    """
+
+    def __init__(
+        self,
+        specs: dict[str, ModelSpec],
+        backend: TorchBackend | OnnxBackend | None = None,
+    ) -> None:
+        self._specs = specs
+        self._backend = backend
+        self._classifiers: dict[str, Classifier] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> TorchBackend | OnnxBackend:
+        """Return the inference backend (by default, from the settings)."""
+        if self._backend is None:
+            from mhailib.messages.backends import get_backend
+
+            self._backend = get_backend()
+        return self._backend
+
+    def get(self, name: str) -> Classifier:
+        """
+        Return the classifier for the given model, loading it if necessary.
+
+        Parameters
+        ----------
+        name : str
+            The model name, as defined in `MODEL_SPECS`.
+
+        Returns
+        -------
+        Classifier
+            The classifier for the model, served by the inference backend.
+        """
+        classifier = self._classifiers.get(name)
+        if classifier is not None:
+            return classifier
+
+        with self._lock:
+            if name not in self._classifiers:
+                self._classifiers[name] = self._load(self._specs[name])
+            return self._classifiers[name]
+
+    def warmup(self, names: Iterable[str] | None = None) -> None:
+        """
+        Load the given models (all of them by default) ahead of time.
+
+        Parameters
+        ----------
+        names : Iterable[str], optional
+            The model names to be loaded.
+        """
+        for name in self._specs if names is None else names:
+            self.get(name)
+
+    def loaded(self) -> list[str]:
+        """Return the names of the models already loaded."""
+        return list(self._classifiers)
+
+    def _load(self, spec: ModelSpec) -> Classifier:
+        return self.backend.load(spec)
+
+
+registry = ModelRegistry(MODEL_SPECS)
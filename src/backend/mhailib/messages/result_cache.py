@@ -0,0 +1,177 @@
+"""Cache of the classification results, keyed by the text content."""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any
+
+from django.conf import settings
+from django.core.cache import cache
+
+from mhailib.messages.registry import MODEL_SPECS
+
+KEY_PREFIX = "mhai:eval"
+HITS_KEY = f"{KEY_PREFIX}:stats:hits"
+MISSES_KEY = f"{KEY_PREFIX}:stats:misses"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text before hashing it.
+
+    Repeated, leading and trailing whitespaces are removed, which doesn't
+    change the tokens of the tokenizers that split the text on whitespaces
+    (see `ModelSpec.splits_whitespace`). The texts of the other models are
+    hashed as they are.
+    """
+    return " ".join(text.split())
+
+
+def _inference_tag() -> str:
+    """Return a tag of the settings that change the scores of a model."""
+    backend = settings.MHAI_INFERENCE_BACKEND
+    if backend == "onnx" and settings.MHAI_ONNX_QUANTIZE:
+        backend = f"{backend}-int8"
+    mode = settings.MHAI_LONG_TEXT_MODE
+    if mode == "sliding":
+        mode = (
+            f"{mode}-{settings.MHAI_WINDOW_STRIDE}-"
+            f"{settings.MHAI_WINDOW_REDUCER}"
+        )
+    return f"{backend}:{mode}"
+
+
+class ResultCache:
+    """
+    Two tier cache of the classification results.
+
+    A bounded in-process LRU (with a short TTL) sits in front of the
+    django cache (redis, in production), which is shared by all the
+    workers. Hits and misses are counted in this process, and in the
+    django cache for all the processes.
+    """
+
+    def __init__(self, local_size: int, local_ttl: float, ttl: int) -> None:
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local: OrderedDict[str, tuple[float, dict[str, float]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def key(self, model_name: str, text: str) -> str:
+        """
+        Return the cache key of the scores of a text.
+
+        Parameters
+        ----------
+        model_name : str
+            The name of the model in the registry (e.g. "emotions").
+        text : str
+            The evaluated text.
+
+        Returns
+        -------
+        str
+            The key, made of the model id, the model revision, the
+            inference settings and the hash of the text (normalized, when
+            it doesn't change the scores of the model).
+        """
+        spec = MODEL_SPECS[model_name]
+        if spec.splits_whitespace:
+            text = normalize_text(text)
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        return (
+            f"{KEY_PREFIX}:{spec.model}:{spec.revision}:{_inference_tag()}:"
+            f"{digest}"
+        )
+
+    def get_many(self, keys: list[str]) -> dict[str, dict[str, float]]:
+        """Return the cached scores of the given keys."""
+        found = {}
+        now = time.monotonic()
+
+        with self._lock:
+            for key in keys:
+                item = self._local.get(key)
+                if item is None:
+                    continue
+                if item[0] < now:
+                    del self._local[key]
+                    continue
+                self._local.move_to_end(key)
+                found[key] = item[1]
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            shared = cache.get_many(missing)
+            self._set_local(shared)
+            found.update(shared)
+
+        self._count(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set_many(self, values: dict[str, dict[str, float]]) -> None:
+        """Store the scores of the given keys in both tiers."""
+        if not values:
+            return
+        self._set_local(values)
+        cache.set_many(values, timeout=self.ttl)
+
+    def clear_local(self) -> None:
+        """Remove all the entries of the in-process tier."""
+        with self._lock:
+            self._local.clear()
+
+    def stats(self) -> dict[str, Any]:
+        """Return the hit and miss counters of this process."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "local_entries": len(self._local),
+        }
+
+    def _set_local(self, values: dict[str, dict[str, float]]) -> None:
+        expires_at = time.monotonic() + self.local_ttl
+        with self._lock:
+            for key, value in values.items():
+                self._local[key] = (expires_at, value)
+                self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _count(self, hits: int, misses: int) -> None:
+        self.hits += hits
+        self.misses += misses
+        for key, value in ((HITS_KEY, hits), (MISSES_KEY, misses)):
+            if value:
+                cache.add(key, 0, timeout=None)
+                cache.incr(key, value)
+
+
+def shared_stats() -> dict[str, int]:
+    """Return the hit and miss counters of all the processes."""
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {
+        "hits": counters.get(HITS_KEY, 0),
+        "misses": counters.get(MISSES_KEY, 0),
+    }
+
+
+def reset_shared_stats() -> None:
+    """Reset the hit and miss counters of all the processes."""
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+result_cache = ResultCache(
+    local_size=settings.MHAI_EVALUATION_CACHE_LOCAL_SIZE,
+    local_ttl=settings.MHAI_EVALUATION_CACHE_LOCAL_TTL,
+    ttl=settings.MHAI_EVALUATION_CACHE_TTL,
+)
@@ -0,0 +1,135 @@
+"""Search the diary messages of a user by similarity of their embeddings."""
+
+from __future__ import annotations
+
+import threading
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from django.conf import settings
+from my_diary.models import MyDiaryEmbedding
+
+from mhailib.etags import get_version
+
+if TYPE_CHECKING:
+    from collections.abc import Collection
+
+# scope of the versions of the embeddings of a user (see `mhailib.etags`),
+# bumped whenever they are stored or deleted
+VERSION_SCOPE = "embeddings"
+
+
+class _UserVectors:
+    """The message ids and the embedding matrix of a user."""
+
+    def __init__(self) -> None:
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.version: int | None = None
+
+
+class EmbeddingIndex:
+    """
+    In-process index of the embeddings of the diary messages.
+
+    The vectors of each user are kept in a contiguous float32 matrix, so a
+    search is a single matrix-vector product. The vectors of a user are
+    loaded again only when their version changed, i.e. when messages were
+    embedded (or embedded again) or deleted since the previous search.
+    The matrices of the least recently searched users are dropped when
+    there are more than `max_users`.
+    """
+
+    def __init__(self, max_users: int) -> None:
+        self.max_users = max_users
+        self._users: OrderedDict[int, _UserVectors] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(
+        self,
+        user_id: int,
+        vector: np.ndarray,
+        k: int,
+        exclude: Collection[int] = (),
+    ) -> list[int]:
+        """
+        Return the ids of the messages most similar to the given vector.
+
+        Parameters
+        ----------
+        user_id : int
+            The user whose messages are searched.
+        vector : np.ndarray
+            The normalized embedding of the query.
+        k : int
+            The max number of ids to be returned.
+        exclude : Collection[int], optional
+            The ids of messages to be left out.
+
+        Returns
+        -------
+        list[int]
+            The message ids, from the most similar.
+        """
+        vectors = self._refresh(user_id)
+        if not len(vectors.ids) or k <= 0:
+            return []
+
+        scores = vectors.matrix @ vector.astype(np.float32)
+        if exclude:
+            scores[np.isin(vectors.ids, list(exclude))] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            int(message_id)
+            for message_id, score in zip(
+                vectors.ids[top], scores[top], strict=True
+            )
+            if score > -np.inf
+        ]
+
+    def clear(self) -> None:
+        """Drop the vectors of all the users."""
+        with self._lock:
+            self._users.clear()
+
+    def _refresh(self, user_id: int) -> _UserVectors:
+        with self._lock:
+            vectors = self._users.pop(user_id, None) or _UserVectors()
+            self._users[user_id] = vectors
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+        # read before the vectors are loaded, so a concurrent change is
+        # never hidden behind this version
+        version = get_version(VERSION_SCOPE, user_id)
+        if version is not None and vectors.version == version:
+            return vectors
+
+        rows = list(
+            MyDiaryEmbedding.objects.filter(
+                user_id=user_id, model=settings.MHAI_EMBEDDING_MODEL
+            )
+            .order_by("id")
+            .values_list("my_diary_id", "vector")
+        )
+        ids = np.array([message_id for message_id, _ in rows], dtype=np.int64)
+        matrix = (
+            np.stack(
+                [np.frombuffer(vector, dtype=np.float32) for _, vector in rows]
+            )
+            if rows
+            else np.empty((0, 0), dtype=np.float32)
+        )
+        with self._lock:
+            vectors.ids, vectors.matrix = ids, matrix
+            vectors.version = version
+        return vectors
+
+
+embedding_index = EmbeddingIndex(max_users=settings.MHAI_RAG_CACHE_USERS)
@@ -0,0 +1,268 @@
+"""Relay the answers of the AI, and other diary events, through redis."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import warnings
+
+from functools import cache
+from typing import TYPE_CHECKING, Any
+
+import redis
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# time (in seconds) the events of a message are kept for late subscribers
+STREAM_TTL = 60 * 10
+# time (in seconds) to wait for new events before checking the connection
+POLL_TIMEOUT = 30.0
+# max number of events waiting to be sent to a websocket
+QUEUE_SIZE = 100
+
+
+def message_channel(message_id: int) -> str:
+    """Return the pub/sub channel of the answer of a message."""
+    return f"mhai:diary:{message_id}:stream"
+
+
+def message_events_key(message_id: int) -> str:
+    """Return the key of the list with the events already published."""
+    return f"mhai:diary:{message_id}:events"
+
+
+def user_channel(user_id: int) -> str:
+    """Return the pub/sub channel of the events of a user."""
+    return f"mhai:user:{user_id}:events"
+
+
+@cache
+def get_redis() -> redis.Redis:
+    """Return the (process-wide) redis client."""
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+def get_async_redis() -> aioredis.Redis:
+    """Return a redis client for the current event loop."""
+    from redis import asyncio as aioredis
+
+    return aioredis.Redis.from_url(settings.REDIS_URL)
+
+
+class AnswerPublisher:
+    """
+    Publish the events of the answer of a message.
+
+    Each event is published to the channel of the message and appended to
+    a list, so clients subscribing late can replay the events they missed.
+    Events are numbered (`seq`) so clients can drop the repeated ones.
+    Failures to publish don't interrupt the answer.
+    """
+
+    def __init__(self, message_id: int) -> None:
+        self.message_id = message_id
+        self.seq = 0
+
+    def delta(self, text: str) -> None:
+        """Publish a new piece of the answer."""
+        if text:
+            self._publish("delta", text=text)
+
+    def done(self) -> None:
+        """Publish the end of the answer."""
+        self._publish("done")
+
+    def error(self) -> None:
+        """Publish the failure of the answer."""
+        self._publish("error")
+
+    def __call__(self, text: str) -> None:
+        """Publish a new piece of the answer (see `delta`)."""
+        self.delta(text)
+
+    def _publish(self, event_type: str, **data: Any) -> None:
+        self.seq += 1
+        event = json.dumps(
+            {
+                "type": event_type,
+                "message_id": self.message_id,
+                "seq": self.seq,
+                **data,
+            }
+        )
+        key = message_events_key(self.message_id)
+
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.rpush(key, event)
+        pipe.expire(key, STREAM_TTL)
+        pipe.publish(message_channel(self.message_id), event)
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            # the answer is still saved, the browser gets it by polling
+            warnings.warn(f"Error publishing the answer: {e}", stacklevel=2)
+
+
+def publish_user_events(events: list[tuple[int, dict[str, Any]]]) -> None:
+    """
+    Publish events to the channels of their users.
+
+    Failures to publish are only reported, clients falling back to
+    long-polling get the changes anyway.
+
+    Parameters
+    ----------
+    events : list[tuple[int, dict[str, Any]]]
+        The user id and the data of each event.
+    """
+    if not events:
+        return
+
+    pipe = get_redis().pipeline(transaction=False)
+    for user_id, data in events:
+        pipe.publish(user_channel(user_id), json.dumps(data))
+    try:
+        pipe.execute()
+    except redis.RedisError as e:
+        warnings.warn(f"Error publishing the user events: {e}", stacklevel=2)
+
+
+def wait_for_user_event(
+    user_id: int, timeout: float, ready: Callable[[], bool]
+) -> bool:
+    """
+    Block until `ready()` is true, re-checking it on each user event.
+
+    Parameters
+    ----------
+    user_id : int
+        The user whose events are awaited.
+    timeout : float
+        Max time (in seconds) to wait.
+    ready : Callable[[], bool]
+        Return whether there is something new for the client.
+
+    Returns
+    -------
+    bool
+        The last result of `ready()`.
+    """
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    try:
+        # subscribe before checking, so no event is lost in between
+        pubsub.subscribe(user_channel(user_id))
+        deadline = time.monotonic() + timeout
+        while not ready():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            pubsub.get_message(timeout=remaining)
+    except redis.RedisError as e:
+        warnings.warn(f"Error waiting for user events: {e}", stacklevel=2)
+        return ready()
+    finally:
+        pubsub.close()
+    return True
+
+
+class UserEventHub:
+    """
+    Fan out the events of the users to the websockets of this process.
+
+    All the websockets share a single redis pub/sub connection, subscribed
+    to the channels of the users with at least one open websocket. Each
+    websocket gets its own queue. When the connection to redis fails, the
+    queues receive None, so their websockets can be closed (and the
+    clients fall back to long-polling).
+    """
+
+    def __init__(self, redis_factory: Callable[[], Any] = get_async_redis):
+        self._redis_factory = redis_factory
+        self._queues: dict[int, set[asyncio.Queue]] = {}
+        self._redis: Any = None
+        self._pubsub: Any = None
+        self._reader: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, user_id: int) -> asyncio.Queue:
+        """Return a new queue with the events of the user."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        async with self._lock:
+            if self._pubsub is None:
+                self._redis = self._redis_factory()
+                self._pubsub = self._redis.pubsub()
+            if user_id not in self._queues:
+                await self._pubsub.subscribe(user_channel(user_id))
+                self._queues[user_id] = set()
+            self._queues[user_id].add(queue)
+            if self._reader is None:
+                self._reader = asyncio.create_task(self._read())
+        return queue
+
+    async def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        """Remove the queue, unsubscribing the user if it was the last."""
+        async with self._lock:
+            queues = self._queues.get(user_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._queues[user_id]
+                if self._pubsub is not None:
+                    await self._pubsub.unsubscribe(user_channel(user_id))
+
+    async def _read(self) -> None:
+        try:
+            while True:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=POLL_TIMEOUT
+                )
+                if message is None:
+                    continue
+                user_id = int(message["channel"].decode().split(":")[2])
+                for queue in list(self._queues.get(user_id, ())):
+                    _put(queue, message["data"].decode())
+        except redis.RedisError:
+            logger.exception("Error reading the user events.")
+            await self._reset()
+
+    async def _reset(self) -> None:
+        async with self._lock:
+            for queues in self._queues.values():
+                for queue in queues:
+                    _put(queue, None)
+            self._queues = {}
+            pubsub, client = self._pubsub, self._redis
+            self._pubsub = self._redis = self._reader = None
+        await pubsub.aclose()
+        await client.aclose()
+
+
+def _put(queue: asyncio.Queue, item: str | None) -> None:
+    if queue.full():
+        # the websocket is not keeping up, drop the oldest event
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+_hubs: dict[asyncio.AbstractEventLoop, UserEventHub] = {}
+
+
+def get_user_event_hub() -> UserEventHub:
+    """Return the hub of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        # drop the hubs of closed loops (e.g. in tests)
+        for closed in [item for item in _hubs if item.is_closed()]:
+            del _hubs[closed]
+        _hubs[loop] = UserEventHub()
+    return _hubs[loop]
@@ -0,0 +1,147 @@
+"""Render the system prompt of the chat model, cached per user."""
+
+from __future__ import annotations
+
+import time
+
+from typing import Any
+
+import yaml
+
+from django.core.cache import cache
+
+from mhailib.messages.config import MAX_TOKENS
+from mhailib.messages.db import get_ai_profile, get_user_profile
+
+# bump it when the template below changes, so the cached prompts rendered
+# with the previous one are not used
+TEMPLATE_VERSION = 1
+KEY_PREFIX = f"mhai:system-prompt:{TEMPLATE_VERSION}"
+# time (in seconds) a rendered prompt is kept
+CACHE_TTL = 60 * 60 * 24
+
+
+def _version_key(user_id: int) -> str:
+    return f"{KEY_PREFIX}:{user_id}:version"
+
+
+def _content_key(user_id: int) -> str:
+    return f"{KEY_PREFIX}:{user_id}:content"
+
+
+def create_system_message(user_id: int) -> dict[str, Any]:
+    """
+    Create the system message based on the AI and user profiles.
+
+    The rendered prompt is cached with the version of the profiles of the
+    user it was rendered from, so the profiles are only loaded again after
+    they change (see `invalidate_system_prompt`).
+
+    Parameters
+    ----------
+    user_id: int
+
+    Returns
+    -------
+    dict
+        The system message.
+    """
+    version_key, content_key = _version_key(user_id), _content_key(user_id)
+    cached = cache.get_many([version_key, content_key])
+    version = cached.get(version_key)
+    if version is None:
+        # not starting from 0, so a counter evicted from the cache never
+        # matches the prompts rendered before (see `mhailib.etags`)
+        cache.add(version_key, time.time_ns(), timeout=None)
+        version = cache.get(version_key)
+    item = cached.get(content_key)
+
+    if item is not None and item[0] == version:
+        content = item[1]
+    else:
+        # rendered with the version read before loading the profiles, so a
+        # concurrent change is not hidden by this prompt
+        content = render_system_prompt(user_id)
+        cache.set(content_key, (version, content), timeout=CACHE_TTL)
+
+    return {"role": "system", "content": content}
+
+
+def invalidate_system_prompt(user_id: int) -> None:
+    """Make the cached system prompt of the user stale."""
+    version_key = _version_key(user_id)
+    if not cache.add(version_key, time.time_ns(), timeout=None):
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            # evicted in the meantime
+            cache.add(version_key, time.time_ns(), timeout=None)
+
+
+def render_system_prompt(user_id: int) -> str:
+    """
+    Render the system prompt based on the AI and user profiles.
+
+    Parameters
+    ----------
+    user_id: int
+
+    Returns
+    -------
+    str
+        The content of the system message.
+    """
+    ai_profile = get_ai_profile(user_id)
+    user_profile = get_user_profile(user_id)
+
+    ai_name = ai_profile.get("name", "Mhai")
+    user_name = user_profile.get("name", "User")
+
+    return (
+        f"You are a person called {ai_name} and your purpose is to help "
+        f"a person called {user_name} with mental issues, who potentially "
+        f"could commit suicide. You would act as a very close person to "
+        f"them, but with no romance is accepted. You should "
+        f"block any inappropriate language with kindness. "
+        f"You should sound natural, like a beloved one talking freely "
+        f"and openly. Use chitty chat style, like a conversation "
+        f"between friends. "
+        f"Use max of {MAX_TOKENS} tokens."
+        "You should act most natural "
+        "and human-like way possible. Your goal is to mimic the speech "
+        "patterns, behavior, and emotional responses of a real person. "
+        "You may act as a best friend forever. Here are some guidelines "
+        "to follow:"
+        "1. **Natural Language**: Use contractions, slang, and idiomatic "
+        "expressions common in everyday speech. Avoid overly formal or "
+        "technical language. "
+        "2. **Emotional Responses**: Show empathy, enthusiasm, concern, "
+        "and other emotions appropriate to the conversation. React "
+        "naturally to the user's emotions. "
+        "3. **Personal Connection**: Build a personal connection with the user"
+        ". When appropriated, ask about their day, interests, and feelings. "
+        "Share relatable stories or experiences. In other cases, just dive "
+        "into the context with no questions."
+        "4. **Humor and Playfulness**: Use humor and playfulness to keep "
+        " the conversation light and engaging. Feel free to tease or "
+        "joke in a friendly manner."
+        "5. **Active Listening**: Sometimes, acknowledge and validate the "
+        "user's thoughts and feelings. In another times, just dive into the "
+        "topic and keep the conversation nice and interesting."
+        "6. **Encouragement and Support**: Offer encouragement, support, "
+        "and positive reinforcement. Be there for the user in both good "
+        "times and bad."
+        "7. **Realistic Pacing**: Avoid giving responses that are too "
+        "quick or too slow. Maintain a natural conversational pace."
+        "8. **Consistency**: Maintain a consistent personality and tone "
+        "throughout the conversation, adapting slightly to fit the user's "
+        "needs and preferences."
+        "9. **Context Awareness**: Use context from previous conversations "
+        "to maintain continuity and build a deeper relationship with the user."
+        "Remember, your goal is to create a comfortable, engaging, and "
+        "realistic conversational experience to the user."
+        f"Your profile:\n"
+        f"```\n{yaml.dump(ai_profile)}\n```"
+        f"User profile:\n"
+        f"```\n{yaml.dump(user_profile)}\n```"
+    )
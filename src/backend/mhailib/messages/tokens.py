@@ -0,0 +1,35 @@
+"""Count the tokens of the messages sent to the chat model."""
+
+from __future__ import annotations
+
+from functools import cache
+from typing import TYPE_CHECKING
+
+import tiktoken
+
+if TYPE_CHECKING:
+    from tiktoken import Encoding
+
+# tokens added by the chat format to each message, and to prime the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+# the encoding the texts were already counted with, kept so the stored
+# token counts stay comparable
+ENCODING = "cl100k_base"
+
+
+@cache
+def get_encoding() -> Encoding:
+    """Return the (process-wide) tokenizer used to count the tokens."""
+    return tiktoken.get_encoding(ENCODING)
+
+
+def count_tokens(text: str) -> int:
+    """Return the number of tokens of a text."""
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def message_tokens(text: str) -> int:
+    """Return the number of tokens of a chat message with the given text."""
+    return MESSAGE_OVERHEAD + count_tokens(text)
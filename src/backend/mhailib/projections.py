@@ -0,0 +1,203 @@
+"""
+Fast read-only representations of the models for the API.
+
+The stock `ModelSerializer` builds its fields for every instance and runs
+`to_representation` field by field, which dominates the time of long lists
+(e.g. the diary). A `Projection` compiles the fields of a model serializer
+into the columns of a `.values()` query once, and `ProjectionMixin` serves
+the list and retrieve actions from those rows, rendered by orjson, with the
+same output as the serializer and `JSONRenderer`.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+
+from typing import TYPE_CHECKING, Any
+
+import orjson
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils import timezone
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import BasePermission
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from rest_framework import serializers
+    from rest_framework.request import Request
+
+
+# the stdlib json (`repr`) writes the floats below it with an exponent,
+# e.g. 1e-05, while orjson writes 0.00001
+EXPONENT_BELOW = 1e-4
+
+
+class ReprFloat(float):
+    """A float rendered by `ORJSONRenderer` as the stdlib json does."""
+
+    __slots__ = ()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Render JSON with orjson.
+
+    The output is the same (byte for byte) as `JSONRenderer`, with the
+    default settings, as long as the floats that orjson spells differently
+    (e.g. 1e-05 as 0.00001) are given as `ReprFloat`, which
+    `Projection.represent` does.
+    """
+
+    def render(
+        self,
+        data: Any,
+        accepted_media_type: str | None = None,
+        renderer_context: dict[str, Any] | None = None,
+    ) -> bytes:
+        if data is None:
+            return b""
+        # only 2 spaces are supported by orjson
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(
+            data, default=self._default, option=orjson.OPT_UTC_Z
+        )
+        # escaped by `JSONRenderer` too, as they are not valid in javascript
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
+
+    def _default(self, obj: Any) -> Any:
+        if isinstance(obj, ReprFloat):
+            return orjson.Fragment(json.dumps(obj, allow_nan=not self.strict))
+        return encoders.JSONEncoder().default(obj)
+
+
+class Projection:
+    """
+    Representation of a model serializer from `.values()` rows.
+
+    Only serializers made of the model fields (without declared fields or
+    custom sources) can be projected; the related objects are represented
+    by their primary keys, as `PrimaryKeyRelatedField` does.
+
+    Parameters
+    ----------
+    serializer_class : type[serializers.ModelSerializer]
+        The serializer whose representation is reproduced.
+    """
+
+    def __init__(
+        self, serializer_class: type[serializers.ModelSerializer]
+    ) -> None:
+        if serializer_class._declared_fields:  # noqa: SLF001
+            msg = f"{serializer_class.__name__} has declared fields."
+            raise ImproperlyConfigured(msg)
+
+        opts = serializer_class.Meta.model._meta  # noqa: SLF001
+        model_fields = [
+            opts.get_field(f) for f in serializer_class.Meta.fields
+        ]
+        # field name -> column, e.g. "user" -> "user_id", so the related
+        # rows are not joined
+        self.names = tuple((f.name, f.attname) for f in model_fields)
+        self.columns = tuple(column for _, column in self.names)
+        self.datetimes = tuple(
+            f.name for f in model_fields if isinstance(f, models.DateTimeField)
+        )
+        self.floats = tuple(
+            f.name for f in model_fields if isinstance(f, models.FloatField)
+        )
+
+    def represent(
+        self, rows: Iterable[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        """Return the representation of the rows of `.values(*columns)`."""
+        names = self.names
+        data = [{name: row[column] for name, column in names} for row in rows]
+
+        # the datetimes are rendered in the current timezone, as the
+        # serializer does; they are already in UTC otherwise
+        if self.datetimes and timezone.get_current_timezone_name() != "UTC":
+            tz = timezone.get_current_timezone()
+            for item in data:
+                for name in self.datetimes:
+                    if item[name] is not None:
+                        item[name] = item[name].astimezone(tz)
+
+        # orjson spells the floats below `EXPONENT_BELOW` (and the
+        # non-finite ones) differently than the stdlib json
+        for item in data if self.floats else ():
+            for name in self.floats:
+                value = item[name]
+                if value and not EXPONENT_BELOW <= abs(value) < math.inf:
+                    item[name] = ReprFloat(value)
+        return data
+
+
+class ProjectionMixin:
+    """
+    Serve the list and retrieve actions from a `Projection`.
+
+    The API view sets `projection`, compiled from its serializer. With
+    `MHAI_API_FAST_READS` on (the default), those actions read `.values()`
+    rows and render them with `ORJSONRenderer`; with it off, they use the
+    serializer and the default renderers, as the other actions always do.
+
+    The object permissions can't be checked on a row, so the views whose
+    permissions check the objects are served by the serializer.
+    """
+
+    projection: Projection
+
+    def get_renderers(self) -> list[Any]:
+        if not self._fast_read():
+            return super().get_renderers()
+        return [ORJSONRenderer(), BrowsableAPIRenderer()]
+
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        if not self._fast_read():
+            return super().list(request, *args, **kwargs)
+
+        rows = self.filter_queryset(self.get_queryset()).values(
+            *self.projection.columns
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.projection.represent(page))
+        return Response(self.projection.represent(rows))
+
+    def retrieve(
+        self, request: Request, *args: Any, **kwargs: Any
+    ) -> Response:
+        if not self._fast_read():
+            return super().retrieve(request, *args, **kwargs)
+
+        rows = self.filter_queryset(self.get_queryset()).values(
+            *self.projection.columns
+        )
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            rows, **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        return Response(self.projection.represent([row])[0])
+
+    def _fast_read(self) -> bool:
+        if not settings.MHAI_API_FAST_READS or self.action not in (
+            "list",
+            "retrieve",
+        ):
+            return False
+        return self.action == "list" or not any(
+            type(permission).has_object_permission
+            is not BasePermission.has_object_permission
+            for permission in self.get_permissions()
+        )
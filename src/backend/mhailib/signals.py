@@ -0,0 +1,55 @@
+"""Define the signals that keep the caches of mhailib up to date."""
+
+from __future__ import annotations
+
+from ai_profile.models import AIProfile
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from my_diary.models import MyDiary, MyDiaryEmbedding
+from user_profile.models import UserProfile, UserProfileCriticalEvent
+
+from mhailib.etags import bump_version
+from mhailib.messages.retrieval import VERSION_SCOPE
+from mhailib.messages.system_prompt import invalidate_system_prompt
+
+
+@receiver(post_save, sender=AIProfile)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=AIProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile_caches(sender, instance, **kwargs):
+    """Make the caches stale when a profile of the user changes."""
+    # after the commit, so the prompt (or the ETags) are not built again
+    # from the old profile in the meantime
+    transaction.on_commit(lambda: invalidate_system_prompt(instance.user_id))
+    transaction.on_commit(lambda: bump_version("profile", [instance.user_id]))
+
+
+@receiver(post_save, sender=UserProfileCriticalEvent)
+@receiver(post_delete, sender=UserProfileCriticalEvent)
+def invalidate_critical_event_caches(sender, instance, **kwargs):
+    """Make the ETags of the profile stale when a critical event changes."""
+    user_ids = list(
+        UserProfile.objects.filter(id=instance.profile_id).values_list(
+            "user_id", flat=True
+        )
+    )
+    transaction.on_commit(lambda: bump_version("profile", user_ids))
+
+
+@receiver(post_save, sender=MyDiary)
+@receiver(post_delete, sender=MyDiary)
+def invalidate_diary_caches(sender, instance, **kwargs):
+    """Make the ETags of the diary stale when a message is saved."""
+    # the tasks update the messages in bulk, and bump the versions when
+    # notifying the users (see `my_diary.events`)
+    transaction.on_commit(lambda: bump_version("diary", [instance.user_id]))
+
+
+@receiver(post_delete, sender=MyDiaryEmbedding)
+def invalidate_embedding_index(sender, instance, **kwargs):
+    """Make the vectors of the user stale when a message is deleted."""
+    transaction.on_commit(
+        lambda: bump_version(VERSION_SCOPE, [instance.user_id])
+    )
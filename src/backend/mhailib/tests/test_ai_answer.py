@@ -0,0 +1,104 @@
+"""Tests for the context of the chat model."""
+
+import pytest
+
+from my_diary.models import MyDiary
+
+from mhailib.messages import ai_answer, db, tokens
+from mhailib.messages.db import load_chat_turns
+
+
+class FakeEncoding:
+    """Count one token per word."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def _fake_encoding(monkeypatch):
+    monkeypatch.setattr(tokens, "get_encoding", FakeEncoding)
+
+
+@pytest.fixture
+def _fake_system_message(monkeypatch):
+    monkeypatch.setattr(
+        ai_answer,
+        "create_system_message",
+        lambda user_id: {"role": "system", "content": "Be kind."},
+    )
+
+
+@pytest.mark.django_db
+def test_load_chat_turns_counts_tokens_once(user, monkeypatch):
+    """The missing token counts are stored."""
+    message = MyDiary.objects.create(
+        user=user, prompt="how are you", response="fine", status="completed"
+    )
+
+    turns = load_chat_turns(user.id, limit=10)
+
+    assert turns[0]["prompt_tokens"] == 3  # noqa: PLR2004
+    message.refresh_from_db()
+    assert (message.prompt_tokens, message.response_tokens) == (3, 1)
+
+    monkeypatch.setattr(tokens, "get_encoding", None)
+    assert load_chat_turns(user.id, limit=10) == turns
+
+
+@pytest.mark.django_db
+def test_load_chat_turns_skips_pending_answers(user):
+    """The counts of the messages being answered are not stored."""
+    message = MyDiary.objects.create(user=user, prompt="how are you")
+
+    turns = load_chat_turns(user.id, limit=10)
+
+    assert (turns[0]["prompt_tokens"], turns[0]["response_tokens"]) == (3, 0)
+    message.refresh_from_db()
+    assert message.response_tokens is None
+
+    # answered meanwhile, the counts stored with the answer are kept
+    MyDiary.objects.filter(id=message.id).update(
+        status="completed",
+        response="very well",
+        prompt_tokens=3,
+        response_tokens=2,
+    )
+    turns[0]["response_tokens"] = None
+    db._count_missing_tokens(turns)  # noqa: SLF001
+    message.refresh_from_db()
+    assert message.response_tokens == 2  # noqa: PLR2004
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("_fake_system_message")
+def test_build_chat_context_within_budget(user):
+    """The most recent messages that fit in the budget are sent."""
+    for i in range(3):
+        MyDiary.objects.create(
+            user=user, prompt=f"prompt {i}", response=f"answer {i}"
+        )
+    current = MyDiary.objects.create(user=user, prompt="new prompt")
+
+    # system (4 + 2), new prompt (4 + 2), reply (3) and 2 turns (12 each)
+    messages = ai_answer.build_chat_context(
+        user.id, current.prompt, message_id=current.id, budget=40
+    )
+
+    assert messages == [
+        {"role": "system", "content": "Be kind."},
+        {"role": "user", "content": "prompt 1"},
+        {"role": "assistant", "content": "answer 1"},
+        {"role": "user", "content": "prompt 2"},
+        {"role": "assistant", "content": "answer 2"},
+        {"role": "user", "content": "new prompt"},
+    ]
+
+    messages = ai_answer.build_chat_context(
+        user.id, current.prompt, message_id=current.id, budget=10
+    )
+
+    assert [message["content"] for message in messages] == [
+        "Be kind.",
+        "new prompt",
+    ]
@@ -0,0 +1,99 @@
+"""Tests for the inference backends."""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from mhailib.messages.backends import (
+    Classifier,
+    OnnxBackend,
+    TorchBackend,
+    get_backend,
+)
+from mhailib.messages.registry import ModelSpec
+
+# a BERT model, whose tokenizer returns `token_type_ids` too
+TINY_MODEL = "hf-internal-testing/tiny-random-BertForSequenceClassification"
+TEXTS = [
+    "I had a calm day and went for a walk.",
+    "I can't sleep, everything feels heavy and I keep worrying.",
+]
+
+
+class FixedClassifier(Classifier):
+    """Return fixed logits."""
+
+    def __init__(self, logits, problem_type=None):
+        config = SimpleNamespace(
+            problem_type=problem_type, num_labels=logits.shape[-1]
+        )
+        super().__init__(tokenizer=None, config=config)
+        self._logits = logits
+
+    def logits(self, features):
+        return self._logits
+
+
+def test_classifier_predict_softmax():
+    """Single label models return a probability distribution."""
+    classifier = FixedClassifier(np.array([[1.0, 2.0, 3.0], [0.0, 0.0, 0.0]]))
+
+    probs = np.array(classifier.predict([{}, {}]))
+
+    np.testing.assert_allclose(probs.sum(axis=1), [1.0, 1.0])
+    np.testing.assert_allclose(probs[1], [1 / 3] * 3)
+    assert probs[0][2] == probs[0].max()
+
+
+def test_classifier_predict_multi_label():
+    """Multi label models return independent probabilities."""
+    classifier = FixedClassifier(
+        np.array([[0.0, 100.0]]), "multi_label_classification"
+    )
+
+    np.testing.assert_allclose(classifier.predict([{}]), [[0.5, 1.0]])
+
+
+def test_get_backend(settings, tmp_path):
+    """The backend is selected in the settings."""
+    settings.MHAI_INFERENCE_BACKEND = "onnx"
+    settings.MHAI_ONNX_CACHE_DIR = str(tmp_path)
+    settings.MHAI_ONNX_QUANTIZE = True
+
+    backend = get_backend()
+    spec = ModelSpec(model="org/model")
+
+    assert isinstance(backend, OnnxBackend)
+    assert backend.model_path(spec) == tmp_path / "org--model-int8.onnx"
+    assert isinstance(get_backend("torch"), TorchBackend)
+
+    with pytest.raises(ValueError, match="Invalid inference backend"):
+        get_backend("tensorflow")
+
+
+@pytest.mark.parametrize(("quantize", "atol"), [(False, 1e-4), (True, 5e-2)])
+def test_onnx_parity_with_torch(tmp_path, quantize, atol):
+    """The ONNX models return the same scores as the torch models."""
+    pytest.importorskip("torch")
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    spec = ModelSpec(model=TINY_MODEL)
+
+    try:
+        torch_classifier = TorchBackend().load(spec)
+    except OSError:
+        pytest.skip("the test model is not available")
+    onnx_classifier = OnnxBackend(tmp_path, quantize=quantize).load(spec)
+
+    features = [
+        torch_classifier.tokenizer(text, truncation=True, max_length=512)
+        for text in TEXTS
+    ]
+
+    np.testing.assert_allclose(
+        onnx_classifier.predict(features),
+        torch_classifier.predict(features),
+        atol=atol,
+    )
+    assert onnx_classifier.config.id2label == torch_classifier.config.id2label
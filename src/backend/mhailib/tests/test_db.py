@@ -0,0 +1,100 @@
+"""Tests for the database access functions."""
+
+import pytest
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from my_diary.api.serializers import MhaiDiarySerializer
+from my_diary.models import MhaiDiaryEvalEmotions, MhaiDiaryEvaluation, MyDiary
+
+from mhailib.messages.db import (
+    load_chat_and_evaluation_history_last_k,
+    load_chat_history,
+    score_fields,
+)
+
+
+@pytest.mark.django_db
+def test_load_chat_history_last_k(user):
+    """Only the last k messages are loaded, in a single query."""
+    for i in range(5):
+        MyDiary.objects.create(
+            user=user, prompt=f"prompt {i}", response=f"response {i}"
+        )
+
+    with CaptureQueriesContext(connection) as queries:
+        history = load_chat_history(user.id, last_k=2)
+
+    assert history == [
+        {"role": "user", "content": "prompt 3"},
+        {"role": "assistant", "content": "response 3"},
+        {"role": "user", "content": "prompt 4"},
+        {"role": "assistant", "content": "response 4"},
+    ]
+    assert len(queries) == 1
+    assert "LIMIT 2" in queries[0]["sql"]
+
+
+@pytest.mark.django_db
+def test_benchmark_chat_history(capsys):
+    """The benchmark rolls back the rows it creates."""
+    call_command("benchmark_chat_history", sizes=[20], repeat=2)
+
+    output = capsys.readouterr().out
+    assert "last k" in output
+    assert not MyDiary.objects.exists()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("storage", ["tables", "consolidated"])
+def test_load_chat_and_evaluation_history_last_k(user, settings, storage):
+    """The last k messages and their scores take a fixed number of queries."""
+    settings.MHAI_EVALUATION_STORAGE = storage
+    messages = [
+        MyDiary.objects.create(user=user, prompt=f"prompt {i}")
+        for i in range(4)
+    ]
+    if storage == "consolidated":
+        MhaiDiaryEvaluation.objects.create(
+            my_diary=messages[2], emotions={"joy": 0.5}, model_version="v"
+        )
+    else:
+        MhaiDiaryEvalEmotions.objects.create(
+            my_diary=messages[2],
+            **dict.fromkeys(score_fields(MhaiDiaryEvalEmotions), 0.5),
+        )
+
+    queries = {}
+    for last_k in (2, 3):
+        with CaptureQueriesContext(connection) as context:
+            history = load_chat_and_evaluation_history_last_k(user.id, last_k)
+        queries[last_k] = len(context)
+
+    assert [entry["prompt"] for entry in history] == [
+        "prompt 1",
+        "prompt 2",
+        "prompt 3",
+    ]
+    assert history[1]["emotions"]["joy"] == 0.5  # noqa: PLR2004
+    assert history[1]["emotions"]["my_diary"] == messages[2].id
+    assert "id" in history[1]["emotions"]
+    assert history[1]["mentbert"] == {}
+    assert history[2]["emotions"] == {}
+    # the messages are represented as by the API
+    assert (
+        history[2]["prompt_timestamp"]
+        == MhaiDiarySerializer(messages[3]).data["prompt_timestamp"]
+    )
+    assert history[2]["user"] == user.id
+    assert queries[2] == queries[3] == (1 if storage == "consolidated" else 4)
+
+
+@pytest.mark.django_db
+def test_benchmark_evaluation_history(capsys):
+    """The benchmark rolls back the rows it creates."""
+    call_command("benchmark_evaluation_history", last_k=[5], repeat=2)
+
+    output = capsys.readouterr().out
+    assert "prefetch" in output
+    assert not MyDiary.objects.exists()
@@ -0,0 +1,197 @@
+"""Tests for the message evaluations."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from django.core.cache import cache
+
+from mhailib.messages import evaluations
+
+
+class FakeTokenizer:
+    """Split on whitespace and record the texts it tokenizes."""
+
+    name_or_path = "fake-tokenizer"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return {"input_ids": [list(range(len(t.split()))) for t in texts]}
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def prepare_for_model(self, ids, *, truncation=False, max_length=None):
+        ids = ids[: max_length - 2] if truncation else ids
+        return {"input_ids": [-1, *ids, -1]}
+
+
+class FakeClassifier:
+    """Record the batches and return fixed probabilities for each input."""
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.tokenizer = FakeTokenizer()
+        self.config = SimpleNamespace(id2label={0: "LABEL_0", 1: "LABEL_5"})
+
+    def predict(self, features):
+        self.calls.append([len(item["input_ids"]) for item in features])
+        return [[0.1, 0.9] for _ in features]
+
+
+@pytest.fixture(autouse=True)
+def _clear_result_cache():
+    cache.clear()
+    evaluations.result_cache.clear_local()
+
+
+def test_eval_batch_runs_one_call_per_batch(monkeypatch):
+    """All the texts are evaluated in a single call to the model."""
+    calls = []
+    monkeypatch.setattr(
+        evaluations.registry, "get", lambda name: FakeClassifier(calls)
+    )
+
+    results = evaluations.eval_batch("psychbert", ["first", "", "two words"])
+
+    assert calls == [[3, 4]]
+    assert results == [
+        {"loneliness": 0.9, "negative": 0.1},
+        {},
+        {"loneliness": 0.9, "negative": 0.1},
+    ]
+    assert list(results[0]) == ["loneliness", "negative"]
+
+
+def test_eval_batch_empty_texts(monkeypatch):
+    """Empty texts don't reach the model."""
+    calls = []
+    monkeypatch.setattr(
+        evaluations.registry, "get", lambda name: FakeClassifier(calls)
+    )
+
+    assert evaluations.eval_batch("emotions", ["", ""]) == [{}, {}]
+    assert calls == []
+
+
+def test_tokenization_cache_tokenizes_once():
+    """Each text is tokenized once per tokenizer and truncated on encode."""
+    tokenizer = FakeTokenizer()
+    tokens = evaluations.TokenizationCache()
+    long_text = " ".join(["word"] * (evaluations.MAX_LENGTH + 10))
+
+    tokens.encode(tokenizer, ["short text", long_text, "short text"])
+    encoded = tokens.encode(tokenizer, [long_text])
+
+    assert tokenizer.calls == [["short text", long_text]]
+    assert len(encoded[0]["input_ids"]) == evaluations.MAX_LENGTH
+
+
+def test_tokenization_cache_windows():
+    """Long texts are split into overlapping windows."""
+    tokens = evaluations.TokenizationCache()
+    size = evaluations.MAX_LENGTH - 2
+    long_text = " ".join(["word"] * (size + 100))
+
+    features, owners = tokens.windows(
+        FakeTokenizer(), ["short text", long_text], stride=50
+    )
+
+    assert owners == [0, 1, 1]
+    assert [len(item["input_ids"]) for item in features] == [
+        4,
+        evaluations.MAX_LENGTH,
+        # the last window starts 50 tokens before the end of the first one
+        150 + 2,
+    ]
+
+    with pytest.raises(ValueError, match="stride"):
+        tokens.windows(FakeTokenizer(), [long_text], stride=size)
+
+
+@pytest.mark.parametrize(
+    ("reducer", "expected"),
+    [
+        ("mean", [[0.5, 0.5], [0.3, 0.7]]),
+        ("max", [[0.8, 0.8], [0.3, 0.7]]),
+        ("weighted", [[0.65, 0.35], [0.3, 0.7]]),
+    ],
+)
+def test_reduce_windows(reducer, expected):
+    """The scores of the windows of each text are combined."""
+    probs = [[0.8, 0.2], [0.2, 0.8], [0.3, 0.7]]
+
+    results = evaluations.reduce_windows(probs, [0, 0, 1], [3, 1, 2], reducer)
+
+    assert results == [pytest.approx(row) for row in expected]
+
+
+def test_eval_batch_sliding_windows(monkeypatch, settings):
+    """The windows of all the texts run in the same batch."""
+    settings.MHAI_LONG_TEXT_MODE = "sliding"
+    settings.MHAI_WINDOW_STRIDE = 10
+    settings.MHAI_WINDOW_REDUCER = "max"
+    calls = []
+    monkeypatch.setattr(
+        evaluations.registry, "get", lambda name: FakeClassifier(calls)
+    )
+    long_text = " ".join(["word"] * evaluations.MAX_LENGTH)
+
+    results = evaluations.eval_batch("psychbert", [long_text, "short"])
+
+    assert calls == [[evaluations.MAX_LENGTH, 14, 3]]
+    assert results == [
+        {"loneliness": 0.9, "negative": 0.1},
+        {"loneliness": 0.9, "negative": 0.1},
+    ]
+
+
+def test_eval_batch_bounded_forward_pass(monkeypatch, settings):
+    """The windows are evaluated in batches of a fixed size."""
+    settings.MHAI_LONG_TEXT_MODE = "sliding"
+    settings.MHAI_WINDOW_STRIDE = 10
+    settings.MHAI_INFERENCE_BATCH_SIZE = 2
+    calls = []
+    monkeypatch.setattr(
+        evaluations.registry, "get", lambda name: FakeClassifier(calls)
+    )
+    long_text = " ".join(["word"] * evaluations.MAX_LENGTH)
+
+    results = evaluations.eval_batch("psychbert", [long_text, "short"])
+
+    assert calls == [[evaluations.MAX_LENGTH, 14], [3]]
+    assert results == [
+        {"loneliness": 0.9, "negative": 0.1},
+        {"loneliness": 0.9, "negative": 0.1},
+    ]
+
+
+def test_eval_batch_result_cache(monkeypatch):
+    """Repeated texts are evaluated only once."""
+    calls = []
+    monkeypatch.setattr(
+        evaluations.registry, "get", lambda name: FakeClassifier(calls)
+    )
+
+    first = evaluations.eval_batch("psychbert", ["ok", "I'm tired", "ok"])
+    second = evaluations.eval_batch("psychbert", ["I'm  tired", "hi"])
+
+    assert calls == [[3, 4], [3]]
+    assert first[0] == first[2] == second[0] == second[1]
+
+
+def test_eval_batch_without_result_cache(monkeypatch, settings):
+    """The result cache can be disabled."""
+    settings.MHAI_EVALUATION_CACHE = False
+    calls = []
+    monkeypatch.setattr(
+        evaluations.registry, "get", lambda name: FakeClassifier(calls)
+    )
+
+    evaluations.eval_batch("psychbert", ["ok"])
+    evaluations.eval_batch("psychbert", ["ok"])
+
+    assert calls == [[3], [3]]
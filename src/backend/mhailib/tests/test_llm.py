@@ -0,0 +1,215 @@
+"""Tests for the async client of the chat model."""
+
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from mhailib.messages.llm import (
+    AsyncChatClient,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    """Answer with the statuses of the server script, then with 200."""
+
+    def do_POST(self):  # noqa: N802
+        server = self.server
+        length = int(self.headers["Content-Length"])
+        body = json.loads(self.rfile.read(length))
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.statuses.pop(0) if server.statuses else 200
+        try:
+            time.sleep(server.delay)
+            if status != 200:  # noqa: PLR2004
+                error = {"error": {"message": "Try again", "type": "error"}}
+                self._send(status, json.dumps(error), "application/json")
+            elif body.get("stream"):
+                self._send(200, self._stream(body), "text/event-stream")
+            else:
+                self._send(200, self._completion(body), "application/json")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _completion(self, body):
+        return json.dumps(
+            {
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Hello!"},
+                    }
+                ],
+            }
+        )
+
+    def _stream(self, body):
+        events = []
+        for piece in ["Hel", "lo!"]:
+            chunk = {
+                "id": "chatcmpl-1",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": None,
+                        "delta": {"content": piece},
+                    }
+                ],
+            }
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        events.append("data: [DONE]\n\n")
+        return "".join(events)
+
+    def _send(self, status, data, content_type):
+        data = data.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """Run a local stub of the OpenAI API."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+    server.lock = threading.Lock()
+    server.statuses = []
+    server.delay = 0.0
+    server.requests = server.in_flight = server.max_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **kwargs):
+    """Return a client of the stub server."""
+    options = {
+        "concurrency": 4,
+        "deadline": 5.0,
+        "max_retries": 2,
+        "breaker": CircuitBreaker(failure_threshold=3, reset_timeout=30),
+        "backoff": (0.01, 0.1),
+        **kwargs,
+    }
+    return AsyncChatClient(
+        api_key="test",
+        base_url=f"http://127.0.0.1:{server.server_port}/v1",
+        **options,
+    )
+
+
+def test_complete_retries_rate_limits(stub_server):
+    """Rate limits and server errors are retried."""
+    stub_server.statuses = [429, 503]
+    client = make_client(stub_server)
+
+    assert client.complete(MESSAGES, model="gpt-4o-mini") == "Hello!"
+    assert stub_server.requests == 3  # noqa: PLR2004
+    assert client.breaker.state == "closed"
+
+
+def test_complete_streams_the_answer(stub_server):
+    """The pieces of the answer are received while generated."""
+    client = make_client(stub_server)
+    deltas = []
+
+    answer = client.complete(MESSAGES, deltas.append, model="gpt-4o-mini")
+
+    assert deltas == ["Hel", "lo!"]
+    assert answer == "Hello!"
+
+
+def test_complete_deadline(stub_server):
+    """The calls fail when the deadline is over."""
+    stub_server.delay = 1.0
+    client = make_client(stub_server, deadline=0.2)
+
+    start = time.monotonic()
+    with pytest.raises((TimeoutError, openai.APITimeoutError)):
+        client.complete(MESSAGES, model="gpt-4o-mini")
+    assert time.monotonic() - start < 1.0
+
+
+def test_complete_concurrency(stub_server):
+    """At most `concurrency` calls are in flight at the same time."""
+    stub_server.delay = 0.1
+    client = make_client(stub_server, concurrency=2)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        answers = list(
+            executor.map(
+                lambda _: client.complete(MESSAGES, model="gpt-4o-mini"),
+                range(6),
+            )
+        )
+
+    assert answers == ["Hello!"] * 6
+    assert stub_server.max_in_flight == 2  # noqa: PLR2004
+
+
+def test_complete_circuit_breaker(stub_server):
+    """After consecutive failures, the calls are not sent."""
+    stub_server.statuses = [500, 500]
+    client = make_client(
+        stub_server,
+        max_retries=0,
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30),
+    )
+
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            client.complete(MESSAGES, model="gpt-4o-mini")
+    with pytest.raises(CircuitOpenError):
+        client.complete(MESSAGES, model="gpt-4o-mini")
+
+    assert stub_server.requests == 2  # noqa: PLR2004
+
+
+def test_circuit_breaker_half_open():
+    """A single trial call is allowed after the reset timeout."""
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout=10, clock=lambda: now[0]
+    )
+
+    breaker.failure()
+    assert not breaker.allow()
+
+    now[0] = 10.0
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == "open"
+
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed"
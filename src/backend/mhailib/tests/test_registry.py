@@ -0,0 +1,62 @@
+"""Tests for the classification model registry."""
+
+import os
+import subprocess
+import sys
+
+from pathlib import Path
+
+from mhailib.messages.registry import MODEL_SPECS, ModelRegistry
+
+BACKEND_DIR = Path(__file__).parents[2]
+
+
+def test_registry_loads_models_lazily(monkeypatch):
+    """Models are only loaded on first use, and just once."""
+    loaded = []
+
+    def fake_load(self, spec):
+        loaded.append(spec.model)
+        return spec.model
+
+    monkeypatch.setattr(ModelRegistry, "_load", fake_load)
+    registry = ModelRegistry(MODEL_SPECS)
+
+    assert registry.loaded() == []
+
+    assert registry.get("emotions") == MODEL_SPECS["emotions"].model
+    assert registry.get("emotions") == MODEL_SPECS["emotions"].model
+    assert loaded == [MODEL_SPECS["emotions"].model]
+    assert registry.loaded() == ["emotions"]
+
+
+def test_registry_warmup(monkeypatch):
+    """Warmup loads the requested models ahead of time."""
+    monkeypatch.setattr(ModelRegistry, "_load", lambda self, spec: spec)
+    registry = ModelRegistry(MODEL_SPECS)
+
+    registry.warmup(["mentbert", "psychbert"])
+    assert sorted(registry.loaded()) == ["mentbert", "psychbert"]
+
+    registry.warmup()
+    assert sorted(registry.loaded()) == sorted(MODEL_SPECS)
+
+
+def test_web_process_does_not_import_torch():
+    """Importing the API views must not load torch or transformers."""
+    code = (
+        "import sys, django; django.setup(); "
+        "import my_diary.api.views; "
+        "assert 'torch' not in sys.modules, 'torch'; "
+        "assert 'transformers' not in sys.modules, 'transformers'"
+    )
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "config.settings.test"}
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", code],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
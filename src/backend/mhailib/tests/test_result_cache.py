@@ -0,0 +1,117 @@
+"""Tests for the cache of the classification results."""
+
+import pytest
+
+from django.core.cache import cache
+
+from mhailib.messages import result_cache as module
+from mhailib.messages.registry import MODEL_SPECS, ModelSpec
+from mhailib.messages.result_cache import (
+    ResultCache,
+    reset_shared_stats,
+    shared_stats,
+)
+
+SCORES = {"joy": 0.9, "sadness": 0.1}
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_key_normalizes_text():
+    """Whitespace differences share the same key, models don't."""
+    results = ResultCache(local_size=10, local_ttl=60, ttl=60)
+
+    key = results.key("mentbert", "I'm tired")
+
+    assert results.key("mentbert", "  I'm   tired\n") == key
+    assert results.key("mentbert", "I'm tired.") != key
+    assert results.key("psychbert", "I'm tired") != key
+
+
+def test_key_keeps_whitespace_of_byte_level_models():
+    """The byte-level BPE tokenizers see the whitespaces of the text."""
+    results = ResultCache(local_size=10, local_ttl=60, ttl=60)
+
+    key = results.key("emotions", "I'm tired")
+
+    assert results.key("emotions", "I'm  tired") != key
+    assert results.key("emotions", "I'm tired") == key
+
+
+def test_key_changes_with_revision_and_backend(monkeypatch, settings):
+    """New model revisions or inference settings don't reuse old scores."""
+    results = ResultCache(local_size=10, local_ttl=60, ttl=60)
+    key = results.key("emotions", "ok")
+
+    settings.MHAI_INFERENCE_BACKEND = "onnx"
+    assert results.key("emotions", "ok") != key
+
+    settings.MHAI_INFERENCE_BACKEND = "torch"
+    settings.MHAI_LONG_TEXT_MODE = "sliding"
+    sliding_key = results.key("emotions", "ok")
+    assert sliding_key != key
+
+    settings.MHAI_WINDOW_STRIDE += 1
+    assert results.key("emotions", "ok") != sliding_key
+    settings.MHAI_WINDOW_STRIDE -= 1
+    settings.MHAI_WINDOW_REDUCER = "weighted"
+    assert results.key("emotions", "ok") != sliding_key
+
+    settings.MHAI_LONG_TEXT_MODE = "truncate"
+    spec = MODEL_SPECS["emotions"]
+    monkeypatch.setitem(
+        module.MODEL_SPECS,
+        "emotions",
+        ModelSpec(model=spec.model, revision="abc123"),
+    )
+    assert results.key("emotions", "ok") != key
+
+
+def test_local_tier_lru_eviction():
+    """The in-process tier keeps only the most recently used entries."""
+    results = ResultCache(local_size=2, local_ttl=60, ttl=60)
+    results.set_many({"a": SCORES, "b": SCORES})
+    results.get_many(["a"])
+    results.set_many({"c": SCORES})
+
+    assert results.stats()["local_entries"] == 2  # noqa: PLR2004
+
+    # "b" is evicted from the local tier, but still in the shared one
+    cache.delete("b")
+    assert results.get_many(["a", "b", "c"]) == {"a": SCORES, "c": SCORES}
+
+
+def test_local_tier_ttl(monkeypatch):
+    """Expired entries of the local tier are read from the shared tier."""
+    results = ResultCache(local_size=10, local_ttl=5, ttl=60)
+    now = 1000.0
+    monkeypatch.setattr(module.time, "monotonic", lambda: now)
+    results.set_many({"a": SCORES})
+    cache.delete("a")
+
+    assert results.get_many(["a"]) == {"a": SCORES}
+
+    now += 10
+    assert results.get_many(["a"]) == {}
+
+
+def test_counters():
+    """Hits and misses are counted in the process and in the cache."""
+    results = ResultCache(local_size=10, local_ttl=60, ttl=60)
+    results.set_many({"a": SCORES})
+    results.clear_local()
+
+    assert results.get_many(["a", "b"]) == {"a": SCORES}
+    assert results.get_many(["a"]) == {"a": SCORES}
+
+    assert results.stats()["hits"] == 2  # noqa: PLR2004
+    assert results.stats()["misses"] == 1
+    assert shared_stats() == {"hits": 2, "misses": 1}
+
+    reset_shared_stats()
+    assert shared_stats() == {"hits": 0, "misses": 0}
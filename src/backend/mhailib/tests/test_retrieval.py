@@ -0,0 +1,151 @@
+"""Tests for the search of the diary messages."""
+
+import numpy as np
+import pytest
+
+from django.core.cache.backends.dummy import DummyCache
+from my_diary.models import MyDiary
+from my_diary.tasks import task_embeddings
+
+from mhailib import etags
+from mhailib.messages import ai_answer, db, tokens
+from mhailib.messages.embeddings import normalize
+from mhailib.messages.retrieval import EmbeddingIndex, embedding_index
+
+VOCABULARY = ["work", "sleep", "friend", "music"]
+
+
+class FakeEmbedder:
+    """Embed the texts as the normalized counts of a few words."""
+
+    def encode(self, texts):
+        counts = np.array(
+            [[text.count(word) for word in VOCABULARY] for text in texts],
+            dtype=np.float32,
+        )
+        return normalize(counts + 0.01)
+
+
+class FakeEncoding:
+    """Count one token per word."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def _fake_models(monkeypatch):
+    monkeypatch.setattr(task_embeddings, "embedder", FakeEmbedder())
+    monkeypatch.setattr(db, "embedder", FakeEmbedder())
+    monkeypatch.setattr(tokens, "get_encoding", FakeEncoding)
+    embedding_index.clear()
+
+
+@pytest.fixture
+def create_messages(django_capture_on_commit_callbacks):
+    """Create the messages and their embeddings."""
+
+    def create(user, prompts):
+        messages = [
+            MyDiary.objects.create(user=user, prompt=prompt, response="ok")
+            for prompt in prompts
+        ]
+        with django_capture_on_commit_callbacks(execute=True):
+            task_embeddings.embed_messages([m.id for m in messages])
+        return messages
+
+    return create
+
+
+@pytest.mark.django_db
+def test_embedding_index_search(user, create_messages):
+    """The most similar messages are returned, including new ones."""
+    work, sleep, _ = create_messages(
+        user, ["work work", "sleep", "friend and music"]
+    )
+    index = EmbeddingIndex(max_users=1)
+    query = FakeEmbedder().encode(["work all day, work at night, no sleep"])[0]
+
+    assert index.search(user.id, query, k=2) == [work.id, sleep.id]
+    assert index.search(user.id, query, k=1, exclude=[work.id]) == [sleep.id]
+
+    (new,) = create_messages(user, ["work and sleep"])
+
+    assert index.search(user.id, query, k=1) == [new.id]
+
+
+@pytest.mark.django_db
+def test_embedding_index_reloads_changed_vectors(
+    user, create_messages, django_capture_on_commit_callbacks
+):
+    """Vectors embedded again in place, or deleted, are not served stale."""
+    work, sleep = create_messages(user, ["work", "sleep"])
+    index = EmbeddingIndex(max_users=1)
+    query = FakeEmbedder().encode(["sleep"])[0]
+    assert index.search(user.id, query, k=1) == [sleep.id]
+
+    # the same rows (and ids) are updated with the new vectors
+    MyDiary.objects.filter(id=work.id).update(prompt="sleep sleep")
+    MyDiary.objects.filter(id=sleep.id).update(prompt="work")
+    with django_capture_on_commit_callbacks(execute=True):
+        task_embeddings.embed_messages([work.id, sleep.id])
+    assert index.search(user.id, query, k=1) == [work.id]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        work.delete()
+    assert index.search(user.id, query, k=2) == [sleep.id]
+
+
+@pytest.mark.django_db
+def test_embedding_index_without_cache(user, create_messages, monkeypatch):
+    """The vectors are loaded for every search while the cache is down."""
+    # the errors of the cache are ignored in production: every read misses
+    monkeypatch.setattr(etags, "cache", DummyCache("", {}))
+    index = EmbeddingIndex(max_users=1)
+    query = FakeEmbedder().encode(["sleep"])[0]
+    assert index.search(user.id, query, k=1) == []
+
+    _, sleep = create_messages(user, ["work", "sleep"])
+
+    assert index.search(user.id, query, k=1) == [sleep.id]
+
+
+@pytest.mark.django_db
+def test_load_chat_history_with_query(user, create_messages):
+    """The similar messages are mixed with the most recent ones."""
+    create_messages(user, ["work", "sleep", "music", "friend"])
+
+    history = db.load_chat_history(user.id, last_k=1, query="sleep")
+
+    assert [item["content"] for item in history[::2]] == ["sleep", "friend"]
+
+
+@pytest.mark.django_db
+def test_build_chat_context_with_rag(
+    user, settings, monkeypatch, create_messages
+):
+    """The similar messages follow the most recent ones in the budget."""
+    settings.MHAI_RAG = True
+    settings.MHAI_RAG_TOP_K = 1
+    settings.MHAI_RAG_RECENT_TURNS = 1
+    monkeypatch.setattr(
+        ai_answer,
+        "create_system_message",
+        lambda user_id: {"role": "system", "content": "Be kind."},
+    )
+    create_messages(user, ["work", "sleep", "music", "friend"])
+    current = MyDiary.objects.create(user=user, prompt="no sleep")
+
+    # system (6), prompt (6), reply (3) and 2 turns (10 each)
+    messages = ai_answer.build_chat_context(
+        user.id, current.prompt, message_id=current.id, budget=35
+    )
+
+    assert [message["content"] for message in messages] == [
+        "Be kind.",
+        "sleep",
+        "ok",
+        "friend",
+        "ok",
+        "no sleep",
+    ]
@@ -0,0 +1,307 @@
+"""Tests for the streaming of the answers of the AI."""
+
+import asyncio
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import redis
+
+from openai import OpenAI
+
+from mhailib.messages import ai_answer, streams
+
+PIECES = ["Hey", " there", ", how", " are you?"]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answer the chat completions like the OpenAI API."""
+
+    def do_POST(self):  # noqa: N802
+        length = int(self.headers["Content-Length"])
+        body = json.loads(self.rfile.read(length))
+        base = {
+            "id": "chatcmpl-1",
+            "created": 0,
+            "model": body["model"],
+        }
+
+        if not body.get("stream"):
+            payload = {
+                **base,
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": "".join(PIECES),
+                        },
+                    }
+                ],
+            }
+            self._send(json.dumps(payload).encode(), "application/json")
+            return
+
+        events = []
+        for piece in PIECES:
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": None,
+                        "delta": {"content": piece},
+                    }
+                ],
+            }
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        events.append("data: [DONE]\n\n")
+        self._send("".join(events).encode(), "text/event-stream")
+
+    def _send(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def _fake_openai(monkeypatch):
+    """Point the OpenAI client to a local fake server."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    client = OpenAI(
+        api_key="test",
+        base_url=f"http://127.0.0.1:{server.server_port}/v1",
+        max_retries=0,
+    )
+    monkeypatch.setattr(ai_answer, "client", client)
+    monkeypatch.setattr(
+        ai_answer,
+        "build_chat_context",
+        lambda user_id, prompt, **kwargs: [
+            {"role": "system", "content": "Be kind."},
+            {"role": "user", "content": prompt},
+        ],
+    )
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+class FakePipeline:
+    """Record the commands of a redis pipeline."""
+
+    def __init__(self, commands, error=None):
+        self.commands = commands
+        self.error = error
+        self.pending = []
+
+    def rpush(self, key, value):
+        self.pending.append(("rpush", key, json.loads(value)))
+
+    def expire(self, key, ttl):
+        self.pending.append(("expire", key, ttl))
+
+    def publish(self, channel, value):
+        self.pending.append(("publish", channel, json.loads(value)))
+
+    def execute(self):
+        if self.error:
+            raise self.error
+        self.commands.extend(self.pending)
+
+
+class FakeRedis:
+    """Create recording pipelines."""
+
+    def __init__(self, error=None):
+        self.commands = []
+        self.error = error
+
+    def pipeline(self, transaction):
+        return FakePipeline(self.commands, self.error)
+
+
+@pytest.mark.usefixtures("_fake_openai")
+def test_ask_ai_streams_the_answer():
+    """The pieces of the answer are received while generated."""
+    deltas = []
+
+    answer = ai_answer.ask_ai("Hi", user_id=1, on_delta=deltas.append)
+
+    assert deltas == PIECES
+    assert answer == "".join(PIECES)
+
+
+@pytest.mark.usefixtures("_fake_openai")
+def test_ask_ai_without_streaming():
+    """Without a callback, the answer is received at once."""
+    assert ai_answer.ask_ai("Hi", user_id=1) == "".join(PIECES)
+
+
+def test_answer_publisher(monkeypatch):
+    """Events are numbered, kept for late subscribers and published."""
+    fake_redis = FakeRedis()
+    monkeypatch.setattr(streams, "get_redis", lambda: fake_redis)
+
+    publisher = streams.AnswerPublisher(7)
+    publisher("Hey")
+    publisher("")
+    publisher.done()
+
+    channel = streams.message_channel(7)
+    key = streams.message_events_key(7)
+    delta = {"type": "delta", "message_id": 7, "seq": 1, "text": "Hey"}
+    done = {"type": "done", "message_id": 7, "seq": 2}
+    assert fake_redis.commands == [
+        ("rpush", key, delta),
+        ("expire", key, streams.STREAM_TTL),
+        ("publish", channel, delta),
+        ("rpush", key, done),
+        ("expire", key, streams.STREAM_TTL),
+        ("publish", channel, done),
+    ]
+
+
+def test_answer_publisher_redis_error(monkeypatch):
+    """Failures to publish don't interrupt the answer."""
+    fake_redis = FakeRedis(error=redis.ConnectionError("down"))
+    monkeypatch.setattr(streams, "get_redis", lambda: fake_redis)
+
+    with pytest.warns(UserWarning, match="Error publishing the answer"):
+        streams.AnswerPublisher(7).delta("Hey")
+
+
+def test_publish_user_events(monkeypatch):
+    """The events are published to the channels of their users."""
+    fake_redis = FakeRedis()
+    monkeypatch.setattr(streams, "get_redis", lambda: fake_redis)
+
+    streams.publish_user_events([(1, {"a": 1}), (2, {"b": 2})])
+    streams.publish_user_events([])
+
+    assert fake_redis.commands == [
+        ("publish", streams.user_channel(1), {"a": 1}),
+        ("publish", streams.user_channel(2), {"b": 2}),
+    ]
+
+
+class FakeSyncPubSub:
+    """Return one message per call, changing the state of the test."""
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.channels = []
+        self.closed = False
+
+    def subscribe(self, channel):
+        self.channels.append(channel)
+
+    def get_message(self, timeout):
+        self.on_message()
+        return {"type": "message", "data": b"{}"}
+
+    def close(self):
+        self.closed = True
+
+
+def test_wait_for_user_event(monkeypatch):
+    """The condition is checked again after each event."""
+    state = {"events": 0}
+
+    def on_message():
+        state["events"] += 1
+
+    pubsub = FakeSyncPubSub(on_message)
+    fake_redis = FakeRedis()
+    fake_redis.pubsub = lambda ignore_subscribe_messages: pubsub
+    monkeypatch.setattr(streams, "get_redis", lambda: fake_redis)
+
+    ready = streams.wait_for_user_event(
+        5,
+        timeout=10,
+        ready=lambda: state["events"] == 2,  # noqa: PLR2004
+    )
+
+    assert ready
+    assert pubsub.channels == [streams.user_channel(5)]
+    assert pubsub.closed
+
+
+class FakeHubPubSub:
+    """Deliver the queued messages of the subscribed channels."""
+
+    def __init__(self):
+        self.channels = set()
+        self.queue = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel):
+        self.channels.discard(channel)
+
+    async def get_message(self, **kwargs):
+        message = await self.queue.get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def aclose(self):
+        pass
+
+
+class FakeHubRedis:
+    def __init__(self):
+        self.pubsub_instance = FakeHubPubSub()
+
+    def pubsub(self):
+        return self.pubsub_instance
+
+    async def aclose(self):
+        pass
+
+
+def test_user_event_hub_fan_out():
+    """Events reach every queue of their user, through one connection."""
+    fake_redis = FakeHubRedis()
+    pubsub = fake_redis.pubsub_instance
+
+    async def main():
+        hub = streams.UserEventHub(lambda: fake_redis)
+        first = await hub.subscribe(1)
+        second = await hub.subscribe(1)
+        other = await hub.subscribe(2)
+        assert pubsub.channels == {
+            streams.user_channel(1),
+            streams.user_channel(2),
+        }
+
+        await pubsub.queue.put(
+            {"channel": streams.user_channel(1).encode(), "data": b"{}"}
+        )
+        assert await first.get() == "{}"
+        assert await second.get() == "{}"
+        assert other.empty()
+
+        await hub.unsubscribe(1, first)
+        await hub.unsubscribe(1, second)
+        assert pubsub.channels == {streams.user_channel(2)}
+
+        # a redis failure closes the remaining queues
+        await pubsub.queue.put(redis.ConnectionError("down"))
+        assert await other.get() is None
+
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""Tests for the cached system prompt."""
+
+import pytest
+
+from django.core.cache import cache
+
+from mhailib.messages import system_prompt
+from mhailib.messages.system_prompt import create_system_message
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    cache.clear()
+
+
+@pytest.mark.django_db
+def test_system_message_cached(
+    user, ai_profile, user_profile, django_assert_num_queries
+):
+    """The profiles are only loaded the first time."""
+    with django_assert_num_queries(2):
+        message = create_system_message(user.id)
+
+    with django_assert_num_queries(0):
+        assert create_system_message(user.id) == message
+
+    assert message["role"] == "system"
+    assert ai_profile.name in message["content"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_system_message_invalidated_on_profile_save(
+    user, ai_profile, user_profile
+):
+    """The prompt is rendered again after a profile changes."""
+    create_system_message(user.id)
+
+    ai_profile.name = "Robin"
+    ai_profile.save()
+
+    assert "Robin" in create_system_message(user.id)["content"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_system_message_version_evicted(user, ai_profile, user_profile):
+    """A version evicted from the cache doesn't match older prompts."""
+    version_key = f"{system_prompt.KEY_PREFIX}:{user.id}:version"
+
+    for name in ("Sam", "Robin"):
+        # the profile changes after the version was evicted
+        cache.delete(version_key)
+        ai_profile.name = name
+        ai_profile.save()
+
+        assert name in create_system_message(user.id)["content"]
@@ -6,6 +6,7 @@ from my_diary.models import (
     MhaiDiaryEvalEmotions,
     MhaiDiaryEvalMentBert,
     MhaiDiaryEvalPsychBert,
+    MhaiDiaryEvaluation,
     MyDiary,
 )
 
@@ -68,3 +69,12 @@ class MhaiDiaryEvalPsychBertAdmin(admin.ModelAdmin):
     )
     search_fields = ("my_diary__user__username",)
     ordering = ("my_diary__timestamp_prompt",)
+
+
+@admin.register(MhaiDiaryEvaluation)
+class MhaiDiaryEvaluationAdmin(admin.ModelAdmin):
+    """Admin configuration for MhaiDiaryEvaluation."""
+
+    list_display = ("id", "my_diary", "model_version")
+    search_fields = ("my_diary__user__username",)
+    ordering = ("-my_diary__prompt_timestamp",)
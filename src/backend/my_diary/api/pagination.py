@@ -0,0 +1,20 @@
+"""Pagination for the my_diary API."""
+
+from __future__ import annotations
+
+from rest_framework.pagination import CursorPagination
+
+
+class MhaiDiaryCursorPagination(CursorPagination):
+    """
+    Paginate the messages from the newest to the oldest.
+
+    The cursor is based on (`prompt_timestamp`, `id`), backed by the index
+    with the same fields, so each page costs the same regardless of how
+    long the diary is.
+    """
+
+    ordering = ("-prompt_timestamp", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
@@ -2,12 +2,16 @@
 
 from __future__ import annotations
 
+from typing import Any
+
+from mhailib.messages.db import evaluation_scores
 from rest_framework import serializers
 
 from my_diary.models import (
     MhaiDiaryEvalEmotions,
     MhaiDiaryEvalMentBert,
     MhaiDiaryEvalPsychBert,
+    MhaiDiaryEvaluation,
     MyDiary,
 )
 
@@ -24,6 +28,9 @@ class MhaiDiarySerializer(serializers.ModelSerializer):
             "response",
             "prompt_timestamp",
             "response_timestamp",
+            "status",
+            "evaluation_status",
+            "updated_at",
         ]
         read_only_fields = [
             "id",
@@ -31,9 +38,28 @@ class MhaiDiarySerializer(serializers.ModelSerializer):
             "prompt_timestamp",
             "response_timestamp",
             "user",
+            "status",
+            "evaluation_status",
+            "updated_at",
         ]
 
 
+class MhaiDiaryWithScoresSerializer(MhaiDiarySerializer):
+    """
+    Serializer for the MyDiary model, with the scores of its evaluations.
+
+    The messages must be loaded with `mhailib.messages.db.with_evaluations`.
+    """
+
+    scores = serializers.SerializerMethodField()
+
+    class Meta(MhaiDiarySerializer.Meta):
+        fields = [*MhaiDiarySerializer.Meta.fields, "scores"]
+
+    def get_scores(self, message: MyDiary) -> dict[str, dict[str, Any]]:
+        return evaluation_scores(message)
+
+
 class MhaiDiaryEvalMentBertSerializer(serializers.ModelSerializer):
     """Serializer for the MhaiDiaryEvalMentBert model."""
 
@@ -91,3 +117,18 @@ class MhaiDiaryEvalEmotionsSerializer(serializers.ModelSerializer):
             "surprise",
             "fear",
         ]
+
+
+class MhaiDiaryEvaluationSerializer(serializers.ModelSerializer):
+    """Serializer for the MhaiDiaryEvaluation model."""
+
+    class Meta:
+        model = MhaiDiaryEvaluation
+        fields = [
+            "id",
+            "my_diary",
+            "emotions",
+            "mentbert",
+            "psychbert",
+            "model_version",
+        ]
@@ -7,6 +7,7 @@ from my_diary.api.views import (
     MhaiDiaryEvalEmotionsViewSet,
     MhaiDiaryEvalMentBertViewSet,
     MhaiDiaryEvalPsychBertViewSet,
+    MhaiDiaryEvaluationViewSet,
     MhaiDiaryViewSet,
 )
 
@@ -27,6 +28,11 @@ router.register(
     MhaiDiaryEvalEmotionsViewSet,
     basename="my-diary-eval-emotions",
 )
+router.register(
+    r"eval/all",
+    MhaiDiaryEvaluationViewSet,
+    basename="my-diary-eval-all",
+)
 
 urlpatterns = [
     path("", include(router.urls)),
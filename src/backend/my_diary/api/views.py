@@ -2,55 +2,251 @@
 
 from __future__ import annotations
 
-from celery import chord
+import datetime
+
+from celery import group
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from mhailib.etags import ConditionalGetMixin
+from mhailib.messages.db import with_evaluations
+from mhailib.messages.streams import wait_for_user_event
+from mhailib.projections import Projection, ProjectionMixin
 from rest_framework import permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 
+from my_diary.api.pagination import MhaiDiaryCursorPagination
 from my_diary.api.serializers import (
     MhaiDiaryEvalEmotionsSerializer,
     MhaiDiaryEvalMentBertSerializer,
     MhaiDiaryEvalPsychBertSerializer,
+    MhaiDiaryEvaluationSerializer,
     MhaiDiarySerializer,
+    MhaiDiaryWithScoresSerializer,
 )
 from my_diary.models import (
     MhaiDiaryEvalEmotions,
     MhaiDiaryEvalMentBert,
     MhaiDiaryEvalPsychBert,
+    MhaiDiaryEvaluation,
     MyDiary,
 )
 from my_diary.tasks.task_answers import (
-    finish_answering,
     process_chat_answer,
 )
+from my_diary.tasks.task_embeddings import embed_messages
 from my_diary.tasks.task_evaluations import (
+    evaluate_all,
     evaluate_emotions,
     evaluate_mentbert,
     evaluate_psychbert,
+    schedule_batch_evaluation,
 )
 
 User = get_user_model()
 
+# max time (in seconds) a long-polling request waits for new messages
+MAX_WAIT = 25.0
+
 
-class MhaiDiaryViewSet(viewsets.ModelViewSet):
+class MhaiDiaryViewSet(
+    ConditionalGetMixin, ProjectionMixin, viewsets.ModelViewSet
+):
     """
     API endpoint for managing chat messages in MyDiary.
     """
 
     serializer_class = MhaiDiarySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MhaiDiaryCursorPagination
+    projection = Projection(MhaiDiarySerializer)
+    etag_scope = "diary"
+
+    def get_etag(self, request):
+        # long-polling requests wait for the changes instead
+        if request.query_params.get("wait"):
+            return None
+        return super().get_etag(request)
 
     def get_queryset(self):
         user = self.request.user
         if user.is_authenticated:
             queryset = MyDiary.objects.filter(user=user).order_by(
-                "prompt_timestamp"
+                "prompt_timestamp", "id"
             )
-            since_id = self.request.query_params.get("since_id")
-            if since_id:
-                queryset = queryset.filter(id__gt=since_id)
+            changes = self._get_changes_filter()
+            if changes is not None:
+                queryset = queryset.filter(changes)
             return queryset
         return MyDiary.objects.none()
 
+    def _get_changes_filter(self) -> Q | None:
+        """
+        Return the filter of the messages changed since the client watermarks.
+
+        Messages created after `since_id`, or updated after `updated_since`
+        (e.g. with a new answer or status), are returned.
+        """
+        params = self.request.query_params
+        since_id = params.get("since_id")
+        updated_since = params.get("updated_since")
+        changes = None
+
+        if since_id:
+            if not since_id.isdigit():
+                raise ValidationError({"since_id": "An integer is required."})
+            changes = Q(id__gt=int(since_id))
+
+        if updated_since:
+            updated = Q(updated_at__gt=_parse_watermark(updated_since))
+            changes = updated if changes is None else changes | updated
+
+        return changes
+
+    def _wait(self, queryset) -> None:
+        """Hold the request up to `wait` seconds, until `queryset` has rows."""
+        wait = self.request.query_params.get("wait")
+        if not wait:
+            return
+        try:
+            timeout = min(float(wait), MAX_WAIT)
+        except ValueError as e:
+            raise ValidationError({"wait": "A number is required."}) from e
+        wait_for_user_event(self.request.user.id, timeout, queryset.exists)
+
+    def _get_changes(self) -> tuple[list[MyDiary], bool]:
+        """
+        Return the oldest changes since the client watermarks.
+
+        The messages are ordered by (`updated_at`, `id`), and at most
+        `max_page_size` of them are returned, with whether there are more.
+        The messages sharing the last `updated_at` are returned together,
+        so the next watermark doesn't skip any of them.
+        """
+        queryset = self.get_queryset().order_by("updated_at", "id")
+        limit = self.pagination_class.max_page_size
+        messages = list(queryset[: limit + 1])
+        has_more = len(messages) > limit
+        if has_more:
+            boundary = messages[limit].updated_at
+            messages = [
+                message
+                for message in messages[:limit]
+                if message.updated_at < boundary
+            ] or list(queryset.filter(updated_at=boundary))
+        return messages, has_more
+
+    def list(self, request, *args, **kwargs):
+        """
+        List the messages of the user.
+
+        By default, the messages are paginated with a cursor, from the
+        newest to the oldest. With `since_id` and/or `updated_since`, only
+        the messages created or updated after them are returned, from the
+        oldest change to the newest, and at most `max_page_size` of them
+        (see `delta` to know whether there are more).
+
+        With `since_id` and `wait` (in seconds, up to `MAX_WAIT`), the
+        request is held until a message newer than `since_id` has an answer
+        (or failed), so clients that can't use the websocket can long-poll
+        instead of polling.
+        """
+        if self._get_changes_filter() is None:
+            return super().list(request, *args, **kwargs)
+
+        if request.query_params.get("since_id"):
+            self._wait(
+                self.get_queryset().filter(
+                    ~Q(response="") | Q(status=MyDiary.StatusChoices.ERROR)
+                )
+            )
+        messages, _ = self._get_changes()
+        return Response(self.get_serializer(messages, many=True).data)
+
+    @action(detail=False, methods=["get"])
+    def delta(self, request, *args, **kwargs):
+        """
+        Return the messages changed since the client watermarks.
+
+        The query parameters are `since_id` (last message id known by the
+        client) and/or `updated_since` (last `updated_at` known by the
+        client) and, optionally, `wait` to long-poll until there are
+        changes. The response has the oldest changed messages (up to
+        `max_page_size`), whether there are more, and the new watermarks,
+        to be sent back as they are.
+
+        Once the client is caught up (no more changes), the `updated_since`
+        watermark is kept `MHAI_DIARY_DELTA_OVERLAP` seconds in the past,
+        as a message saved in a transaction that is still running has an
+        older `updated_at` than the ones already committed; the changes of
+        the last seconds may be returned twice.
+        """
+        if self._get_changes_filter() is None:
+            raise ValidationError(
+                "A `since_id` or `updated_since` watermark is required."
+            )
+        self._wait(self.get_queryset())
+
+        messages, has_more = self._get_changes()
+        since_id = int(request.query_params.get("since_id") or 0)
+        updated_since = request.query_params.get("updated_since")
+        watermark = _parse_watermark(updated_since) if updated_since else None
+        if messages:
+            since_id = max(since_id, *(message.id for message in messages))
+            watermark = messages[-1].updated_at
+        if watermark and not has_more:
+            # once caught up, the watermark is kept in the past, as the
+            # messages still being saved have an older `updated_at` than
+            # the ones already committed
+            watermark = min(
+                watermark,
+                timezone.now()
+                - datetime.timedelta(
+                    seconds=settings.MHAI_DIARY_DELTA_OVERLAP
+                ),
+            )
+
+        return Response(
+            {
+                "results": self.get_serializer(messages, many=True).data,
+                "has_more": has_more,
+                "since_id": since_id,
+                "updated_since": watermark.isoformat() if watermark else None,
+            }
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="with-scores",
+        serializer_class=MhaiDiaryWithScoresSerializer,
+    )
+    def with_scores(self, request, *args, **kwargs):
+        """
+        List the messages of the user with the scores of their evaluations.
+
+        The messages are paginated as in `list`. With `start` and/or `end`
+        (ISO 8601 dates or datetimes, both included), only the messages
+        written in that range are returned. Each page is loaded with a
+        fixed number of queries (see `with_evaluations`).
+        """
+        queryset = self.get_queryset()
+        for name in ("start", "end"):
+            value = request.query_params.get(name)
+            if value:
+                queryset = queryset.filter(_date_range_filter(name, value))
+        queryset = with_evaluations(queryset)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(self.get_serializer(queryset, many=True).data)
+
     def perform_create(self, serializer) -> None:
         user_id = self.request.user.id
 
@@ -60,32 +256,77 @@ class MhaiDiaryViewSet(viewsets.ModelViewSet):
 
         message_id = serializer.instance.id
 
-        task_question = process_chat_answer.s(
-            message_id=message_id,
-            user_id=user_id,
-        )
-        task_eval_emotions = evaluate_emotions.s(message_id)
-        task_eval_mentbert = evaluate_mentbert.s(message_id)
-        task_eval_psychbert = evaluate_psychbert.s(message_id)
+        # the answer completes the message on its own, the evaluations
+        # (and the embedding) don't delay it
+        process_chat_answer.delay(message_id=message_id, user_id=user_id)
+
+        if settings.MHAI_EVALUATION_MODE == "batched":
+            schedule_batch_evaluation()
+        elif settings.MHAI_EVALUATION_MODE == "fused":
+            evaluate_all.delay(message_id)
+        else:
+            group(
+                evaluate_emotions.s(message_id),
+                evaluate_mentbert.s(message_id),
+                evaluate_psychbert.s(message_id),
+            ).apply_async()
 
-        tasks = [
-            task_question,
-            task_eval_emotions,
-            task_eval_mentbert,
-            task_eval_psychbert,
-        ]
+        if settings.MHAI_RAG:
+            embed_messages.delay([message_id])
 
-        pipeline = chord(tasks, finish_answering.s(message_id))
-        pipeline.apply_async()
 
+def _parse_watermark(value: str) -> datetime.datetime:
+    """Parse an `updated_since` watermark (naive datetimes are local)."""
+    error = {"updated_since": "An ISO 8601 datetime is required."}
+    try:
+        watermark = parse_datetime(value)
+    except ValueError as e:
+        raise ValidationError(error) from e
+    if watermark is None:
+        raise ValidationError(error)
+    if timezone.is_naive(watermark):
+        watermark = timezone.make_aware(watermark)
+    return watermark
 
-class MhaiDiaryEvalEmotionsViewSet(viewsets.ModelViewSet):
+
+def _date_range_filter(name: str, value: str) -> Q:
+    """
+    Return the filter of the messages by a bound of a date range.
+
+    `name` is "start" or "end"; a date bound includes the whole day.
+    """
+    error = {name: "An ISO 8601 date or datetime is required."}
+    try:
+        moment = parse_datetime(value)
+        day = None if moment else parse_date(value)
+    except ValueError as e:
+        raise ValidationError(error) from e
+    if moment is None and day is None:
+        raise ValidationError(error)
+
+    if moment is None:
+        if name == "end":
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time.min)
+        lookup = "gte" if name == "start" else "lt"
+    else:
+        lookup = "gte" if name == "start" else "lte"
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return Q(**{f"prompt_timestamp__{lookup}": moment})
+
+
+class MhaiDiaryEvalEmotionsViewSet(
+    ConditionalGetMixin, ProjectionMixin, viewsets.ModelViewSet
+):
     """
     API endpoint for managing emotion analysis scores in MhaiDiaryEvalEmotions.
     """
 
     queryset = MhaiDiaryEvalEmotions.objects.all()
     serializer_class = MhaiDiaryEvalEmotionsSerializer
+    projection = Projection(MhaiDiaryEvalEmotionsSerializer)
+    etag_scope = "diary"
 
     def get_queryset(self):
         user = self.request.user
@@ -94,13 +335,17 @@ class MhaiDiaryEvalEmotionsViewSet(viewsets.ModelViewSet):
         return MhaiDiaryEvalEmotions.objects.none()
 
 
-class MhaiDiaryEvalMentBertViewSet(viewsets.ModelViewSet):
+class MhaiDiaryEvalMentBertViewSet(
+    ConditionalGetMixin, ProjectionMixin, viewsets.ModelViewSet
+):
     """
     API endpoint for managing MentBERT analysis scores linked to MyDiary.
     """
 
     queryset = MhaiDiaryEvalMentBert.objects.all()
     serializer_class = MhaiDiaryEvalMentBertSerializer
+    projection = Projection(MhaiDiaryEvalMentBertSerializer)
+    etag_scope = "diary"
 
     def get_queryset(self):
         user = self.request.user
@@ -109,16 +354,40 @@ class MhaiDiaryEvalMentBertViewSet(viewsets.ModelViewSet):
         return MhaiDiaryEvalMentBert.objects.none()
 
 
-class MhaiDiaryEvalPsychBertViewSet(viewsets.ModelViewSet):
+class MhaiDiaryEvalPsychBertViewSet(
+    ConditionalGetMixin, ProjectionMixin, viewsets.ModelViewSet
+):
     """
     API endpoint for managing PsychBERT analysis scores linked to MyDiary.
     """
 
     queryset = MhaiDiaryEvalPsychBert.objects.all()
     serializer_class = MhaiDiaryEvalPsychBertSerializer
+    projection = Projection(MhaiDiaryEvalPsychBertSerializer)
+    etag_scope = "diary"
 
     def get_queryset(self):
         user = self.request.user
         if user.is_authenticated:
             return MhaiDiaryEvalPsychBert.objects.filter(my_diary__user=user)
         return MhaiDiaryEvalPsychBert.objects.none()
+
+
+class MhaiDiaryEvaluationViewSet(
+    ConditionalGetMixin, viewsets.ReadOnlyModelViewSet
+):
+    """
+    API endpoint for reading all the scores of the diary messages at once.
+
+    Filled when `MHAI_EVALUATION_STORAGE` is "consolidated".
+    """
+
+    queryset = MhaiDiaryEvaluation.objects.all()
+    serializer_class = MhaiDiaryEvaluationSerializer
+    etag_scope = "diary"
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_authenticated:
+            return MhaiDiaryEvaluation.objects.filter(my_diary__user=user)
+        return MhaiDiaryEvaluation.objects.none()
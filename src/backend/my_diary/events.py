@@ -0,0 +1,49 @@
+"""Notify the users about changes in their diary messages."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from mhailib.etags import bump_version
+from mhailib.messages.streams import publish_user_events
+
+from my_diary.models import MyDiary
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+def notify_message_changes(message_ids: Iterable[int], change: str) -> None:
+    """
+    Publish a message event to the users of the given messages.
+
+    The events are pushed to the websockets of the users, and wake up their
+    long-polling requests; the ETags of their diaries become stale.
+
+    Parameters
+    ----------
+    message_ids : Iterable[int]
+        The IDs of the changed MyDiary messages.
+    change : str
+        What changed: "answer", "evaluation" or "status".
+    """
+    rows = list(
+        MyDiary.objects.filter(id__in=list(message_ids)).values_list(
+            "id", "user_id", "status"
+        )
+    )
+    bump_version("diary", (user_id for _, user_id, _ in rows))
+    publish_user_events(
+        [
+            (
+                user_id,
+                {
+                    "type": "message",
+                    "change": change,
+                    "message_id": message_id,
+                    "status": status,
+                },
+            )
+            for message_id, user_id, status in rows
+        ]
+    )
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_diary', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mydiary',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='mydiary',
+            index=models.Index(fields=['user', '-prompt_timestamp', '-id'], name='my_diary_user_prompt_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mydiary',
+            index=models.Index(fields=['user', 'updated_at'], name='my_diary_user_updated_idx'),
+        ),
+    ]
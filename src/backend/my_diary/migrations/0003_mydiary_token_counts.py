@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_diary', '0002_mydiary_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mydiary',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mydiary',
+            name='response_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_diary', '0003_mydiary_token_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MyDiaryEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=255)),
+                ('vector', models.BinaryField()),
+                ('my_diary', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='embedding', to='my_diary.mydiary')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'model', 'id'], name='my_diary_embedding_user_idx')],
+            },
+        ),
+    ]
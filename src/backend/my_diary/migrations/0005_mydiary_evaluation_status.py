@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+def mark_evaluated(apps, schema_editor):
+    MyDiary = apps.get_model('my_diary', 'MyDiary')
+    MyDiary.objects.filter(mhaidiaryevalemotions__isnull=False).update(
+        evaluation_status='completed'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_diary', '0004_mydiaryembedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mydiary',
+            name='evaluation_status',
+            field=models.CharField(choices=[('started', 'Started'), ('in-progress', 'In Progress'), ('completed', 'Completed'), ('error', 'Error')], default='started', max_length=20),
+        ),
+        migrations.RunPython(mark_evaluated, migrations.RunPython.noop),
+    ]
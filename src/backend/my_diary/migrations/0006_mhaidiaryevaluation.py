@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_diary', '0005_mydiary_evaluation_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MhaiDiaryEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emotions', models.JSONField(blank=True, null=True)),
+                ('mentbert', models.JSONField(blank=True, null=True)),
+                ('psychbert', models.JSONField(blank=True, null=True)),
+                ('model_version', models.CharField(max_length=16)),
+                ('my_diary', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='evaluation', to='my_diary.mydiary')),
+            ],
+        ),
+    ]
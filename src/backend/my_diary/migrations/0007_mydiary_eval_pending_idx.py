@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_diary', '0006_mhaidiaryevaluation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mydiary',
+            index=models.Index(condition=models.Q(('evaluation_status', 'started')), fields=['id'], name='my_diary_eval_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_scores(apps, schema_editor):
+    # keep the latest scores of each message, before they are made unique
+    for name in ('MhaiDiaryEvalEmotions', 'MhaiDiaryEvalMentBert', 'MhaiDiaryEvalPsychBert'):
+        model = apps.get_model('my_diary', name)
+        latest = model.objects.values('my_diary').annotate(latest=Max('id')).values_list('latest', flat=True)
+        model.objects.exclude(id__in=list(latest)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_diary', '0007_mydiary_eval_pending_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mydiary',
+            name='my_diary_eval_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='mydiary',
+            index=models.Index(condition=models.Q(('evaluation_status__in', ['started', 'in-progress'])), fields=['id'], name='my_diary_eval_pending_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_scores, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='mhaidiaryevalemotions',
+            constraint=models.UniqueConstraint(fields=('my_diary',), name='my_diary_eval_emotions_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='mhaidiaryevalmentbert',
+            constraint=models.UniqueConstraint(fields=('my_diary',), name='my_diary_eval_mentbert_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='mhaidiaryevalpsychbert',
+            constraint=models.UniqueConstraint(fields=('my_diary',), name='my_diary_eval_psychbert_uniq'),
+        ),
+    ]
@@ -25,9 +25,42 @@ class MyDiary(models.Model):
         choices=StatusChoices.choices,
         default=StatusChoices.STARTED,
     )
+    # the evaluations run apart from the answer, which doesn't wait for them
+    evaluation_status = models.CharField(
+        max_length=20,
+        choices=StatusChoices.choices,
+        default=StatusChoices.STARTED,
+    )
+    # number of tokens of the prompt and the response for the chat model,
+    # counted once and reused to build the context of the next answers
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    response_tokens = models.PositiveIntegerField(null=True, blank=True)
+    # changes made with `QuerySet.update` must set it explicitly
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-prompt_timestamp"]
+        indexes = [
+            # cursor pagination of the messages of a user
+            models.Index(
+                fields=["user", "-prompt_timestamp", "-id"],
+                name="my_diary_user_prompt_ts_idx",
+            ),
+            # delta sync (messages changed since a watermark)
+            models.Index(
+                fields=["user", "updated_at"],
+                name="my_diary_user_updated_idx",
+            ),
+            # queue of the messages waiting for the batched evaluations,
+            # and of those claimed by a batch (see `_claim_batch`)
+            models.Index(
+                fields=["id"],
+                condition=models.Q(
+                    evaluation_status__in=["started", "in-progress"]
+                ),
+                name="my_diary_eval_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"MyDiary ({self.user}): {self.prompt_timestamp} / #{self.id}"
@@ -51,6 +84,14 @@ class MhaiDiaryEvalMentBert(models.Model):
     asperger = models.FloatField()
     ptsd = models.FloatField()
 
+    class Meta:
+        constraints = [
+            # one row per message, upserted by the batched evaluations
+            models.UniqueConstraint(
+                fields=["my_diary"], name="my_diary_eval_mentbert_uniq"
+            ),
+        ]
+
     def __str__(self):
         return f"MhaiDiaryEvalMentBert ({self.my_diary.user}) #{self.id}"
 
@@ -70,6 +111,14 @@ class MhaiDiaryEvalPsychBert(models.Model):
     social_anxiety = models.FloatField()
     loneliness = models.FloatField()
 
+    class Meta:
+        constraints = [
+            # one row per message, upserted by the batched evaluations
+            models.UniqueConstraint(
+                fields=["my_diary"], name="my_diary_eval_psychbert_uniq"
+            ),
+        ]
+
     def __str__(self):
         return f"MhaiDiaryEvalPsychBert ({self.my_diary.user}) #{self.id}"
 
@@ -90,5 +139,66 @@ class MhaiDiaryEvalEmotions(models.Model):
     surprise = models.FloatField()
     fear = models.FloatField()
 
+    class Meta:
+        constraints = [
+            # one row per message, upserted by the batched evaluations
+            models.UniqueConstraint(
+                fields=["my_diary"], name="my_diary_eval_emotions_uniq"
+            ),
+        ]
+
     def __str__(self):
         return f"MhaiDiaryEvalEmotions ({self.my_diary.user}) #{self.id}"
+
+
+class MhaiDiaryEvaluation(models.Model):
+    """
+    Store all the scores of a diary message in a single row.
+
+    Alternative to the tables by model (see `MHAI_EVALUATION_STORAGE`):
+    the scores of each model are a JSON object (label -> score, with the
+    labels named as the fields of those tables), so all the scores of a
+    message are read with one indexed lookup.
+    """
+
+    my_diary = models.OneToOneField(
+        MyDiary, on_delete=models.CASCADE, related_name="evaluation"
+    )
+    # null until the model scored the message
+    emotions = models.JSONField(null=True, blank=True)
+    mentbert = models.JSONField(null=True, blank=True)
+    psychbert = models.JSONField(null=True, blank=True)
+    # identifies the models (and revisions) the scores come from
+    model_version = models.CharField(max_length=16)
+
+    def __str__(self):
+        return f"MhaiDiaryEvaluation ({self.my_diary_id}) #{self.id}"
+
+
+class MyDiaryEmbedding(models.Model):
+    """
+    Store the sentence embedding of the prompt of a diary message.
+
+    The vector is stored as float32 bytes, L2-normalized, so the
+    similarity between two messages is the dot product of their vectors.
+    """
+
+    my_diary = models.OneToOneField(
+        MyDiary, on_delete=models.CASCADE, related_name="embedding"
+    )
+    # denormalized to load the vectors of a user without a join
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    model = models.CharField(max_length=255)
+    vector = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            # loading of the vectors of a user
+            models.Index(
+                fields=["user", "model", "id"],
+                name="my_diary_embedding_user_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"MyDiaryEmbedding ({self.user}) #{self.my_diary_id}"
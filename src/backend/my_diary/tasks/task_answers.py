@@ -4,14 +4,19 @@ from __future__ import annotations
 
 import warnings
 
-from typing import Any
-
 from celery import shared_task
+from django.conf import settings
 from mhailib.messages.ai_answer import ask_ai
+from mhailib.messages.streams import AnswerPublisher
+from mhailib.messages.tokens import count_tokens
 
+from my_diary.events import notify_message_changes
 from my_diary.models import MyDiary
+from my_diary.transitions import transition
 
 
+# acknowledged when received (the default): delivered again, it would ask
+# the AI (and stream the answer) twice
 @shared_task
 def process_chat_answer(message_id: int, user_id: int) -> None:
     """
@@ -25,38 +30,58 @@ def process_chat_answer(message_id: int, user_id: int) -> None:
     ----------
     message_id : int
         The ID of the MyDiary message to process.
+
+    Notes
+    -----
+    When `MHAI_STREAM_ANSWERS` is enabled, the pieces of the answer are
+    published to the channel of the message while they are generated, and
+    the stream always ends with a "done" or "error" event.
     """
+    publisher = (
+        AnswerPublisher(message_id) if settings.MHAI_STREAM_ANSWERS else None
+    )
     try:
-        # Retrieve the MyDiary message instance by ID
-        chat_message = MyDiary.objects.get(id=message_id)
-
-        answer = ask_ai(prompt=chat_message.prompt, user_id=user_id)
-        chat_message.response = answer
-        chat_message.save()
-
-    except MyDiary.DoesNotExist as e:
-        # Log error if the MyDiary message with given ID does not exist
-        warnings.warn(
-            f"Error: MyDiary message with id {message_id} does not exist.",
-            stacklevel=2,
+        prompt = MyDiary.objects.values_list("prompt", flat=True).get(
+            id=message_id
         )
-        raise e
-    except Exception as e:
-        warnings.warn(f"Error: {e}", stacklevel=2)
-        chat_message_fallback = MyDiary.objects.filter(id=message_id)
-        if chat_message_fallback:
-            chat_message.status = "error"
-            chat_message.save()
-        raise e
 
+        answer = ask_ai(
+            prompt=prompt,
+            user_id=user_id,
+            on_delta=publisher,
+            message_id=message_id,
+        )
+        moved = transition(
+            [message_id],
+            MyDiary.StatusChoices.COMPLETED,
+            response=answer,
+            # counted once, for the context of the next answers
+            prompt_tokens=count_tokens(prompt),
+            response_tokens=count_tokens(answer),
+        )
+        if not moved:
+            # already answered (or failed), this answer is dropped
+            warnings.warn(
+                f"MyDiary message with id {message_id} is already final.",
+                stacklevel=2,
+            )
+            if publisher:
+                # ends the stream as the message ended, the subscribers
+                # get the stored answer with the message events
+                status = (
+                    MyDiary.objects.filter(id=message_id)
+                    .values_list("status", flat=True)
+                    .first()
+                )
+                if status == MyDiary.StatusChoices.COMPLETED:
+                    publisher.done()
+                else:
+                    publisher.error()
+            return
 
-@shared_task
-def finish_answering(result: list[Any], message_id: int) -> None:
-    try:
-        # Retrieve the MyDiary message instance by ID
-        chat_message = MyDiary.objects.get(id=message_id)
-        chat_message.status = "completed"
-        chat_message.save()
+        if publisher:
+            publisher.done()
+        notify_message_changes([message_id], "answer")
 
     except MyDiary.DoesNotExist as e:
         # Log error if the MyDiary message with given ID does not exist
@@ -64,11 +89,13 @@ def finish_answering(result: list[Any], message_id: int) -> None:
             f"Error: MyDiary message with id {message_id} does not exist.",
             stacklevel=2,
         )
+        if publisher:
+            publisher.error()
         raise e
     except Exception as e:
         warnings.warn(f"Error: {e}", stacklevel=2)
-        chat_message_fallback = MyDiary.objects.filter(id=message_id)
-        if chat_message_fallback:
-            chat_message.status = "error"
-            chat_message.save()
+        if publisher:
+            publisher.error()
+        if transition([message_id], MyDiary.StatusChoices.ERROR):
+            notify_message_changes([message_id], "status")
         raise e
@@ -0,0 +1,52 @@
+"""Define tasks for embedding the diary messages."""
+
+from __future__ import annotations
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from mhailib.etags import bump_version
+from mhailib.messages.embeddings import embedder
+from mhailib.messages.retrieval import VERSION_SCOPE
+
+from my_diary.models import MyDiary, MyDiaryEmbedding
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def embed_messages(message_ids: list[int]) -> None:
+    """
+    Compute and store the sentence embeddings of the prompts of messages.
+
+    Parameters
+    ----------
+    message_ids : list[int]
+        The IDs of the MyDiary messages to be embedded.
+    """
+    messages = list(
+        MyDiary.objects.filter(id__in=message_ids).values_list(
+            "id", "user_id", "prompt"
+        )
+    )
+    if not messages:
+        return
+
+    vectors = embedder.encode([prompt for _, _, prompt in messages])
+    MyDiaryEmbedding.objects.bulk_create(
+        [
+            MyDiaryEmbedding(
+                my_diary_id=message_id,
+                user_id=user_id,
+                model=settings.MHAI_EMBEDDING_MODEL,
+                vector=vector.tobytes(),
+            )
+            for (message_id, user_id, _), vector in zip(
+                messages, vectors, strict=True
+            )
+        ],
+        update_conflicts=True,
+        unique_fields=["my_diary"],
+        update_fields=["model", "vector"],
+    )
+    # the indexes of the users load their vectors again
+    user_ids = {user_id for _, user_id, _ in messages}
+    transaction.on_commit(lambda: bump_version(VERSION_SCOPE, user_ids))
@@ -4,22 +4,48 @@ from __future__ import annotations
 
 import logging
 
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from mhailib.etags import bump_version
+from mhailib.messages.db import score_fields
 from mhailib.messages.evaluations import (
     eval_emotions,
     eval_mentbert,
     eval_psychbert,
+    eval_texts,
 )
+from mhailib.messages.registry import models_version
 
+from my_diary.events import notify_message_changes
 from my_diary.models import (
     MhaiDiaryEvalEmotions,
     MhaiDiaryEvalMentBert,
     MhaiDiaryEvalPsychBert,
+    MhaiDiaryEvaluation,
     MyDiary,
 )
+from my_diary.transitions import transition
 
 logger = logging.getLogger(__name__)
 
+BATCH_WINDOW_KEY = "my_diary:evaluation-batch:window"
+BATCH_PENDING_KEY = "my_diary:evaluation-batch:pending"
+
+# model name -> (evaluation table, label renames)
+EVALUATORS = {
+    "emotions": (MhaiDiaryEvalEmotions, {}),
+    "mentbert": (MhaiDiaryEvalMentBert, {}),
+    "psychbert": (MhaiDiaryEvalPsychBert, {"negative": "unrelated"}),
+}
+# the models (and revisions) of the scores in the consolidated table
+EVALUATION_VERSION = models_version(EVALUATORS)
+
 
 def clean_name(
     data: dict[str, float],
@@ -29,7 +55,115 @@ def clean_name(
     return {rename.get(k, k).replace("-", "_"): v for k, v in data.items()}
 
 
-@shared_task
+def set_evaluation_status(message_ids: list[int], status: str) -> int:
+    """
+    Set the evaluation status of messages, and notify their users.
+
+    Parameters
+    ----------
+    message_ids : list[int]
+        The IDs of the MyDiary messages.
+    status : str
+        The new evaluation status (see `MyDiary.StatusChoices`).
+
+    Returns
+    -------
+    int
+        The number of messages moved to the new status.
+    """
+    moved = transition(message_ids, status, field="evaluation_status")
+    if moved:
+        notify_message_changes(message_ids, "evaluation")
+    return moved
+
+
+def _is_consolidated() -> bool:
+    return settings.MHAI_EVALUATION_STORAGE == "consolidated"
+
+
+def _has_scores(*names: str) -> list[Exists]:
+    """Return the conditions for a message to have the scores of models."""
+    if _is_consolidated():
+        return [
+            Exists(
+                MhaiDiaryEvaluation.objects.filter(
+                    my_diary=OuterRef("pk"),
+                    **{f"{name}__isnull": False for name in names},
+                )
+            )
+        ]
+    return [
+        Exists(EVALUATORS[name][0].objects.filter(my_diary=OuterRef("pk")))
+        for name in names
+    ]
+
+
+def store_consolidated(scores: dict[int, dict[str, dict[str, float]]]) -> None:
+    """
+    Store scores in the consolidated table, with a single upsert.
+
+    Only the columns of the given models are written, so the tasks of
+    other models storing the scores of the same message at the same time
+    don't overwrite each other.
+
+    Parameters
+    ----------
+    scores : dict[int, dict[str, dict[str, float]]]
+        The scores by model name, by message ID. All the messages must
+        have the scores of the same models.
+    """
+    if not scores:
+        return
+    names = list(next(iter(scores.values())))
+    MhaiDiaryEvaluation.objects.bulk_create(
+        [
+            MhaiDiaryEvaluation(
+                my_diary_id=message_id,
+                model_version=EVALUATION_VERSION,
+                **{
+                    name: clean_name(data, EVALUATORS[name][1])
+                    for name, data in by_model.items()
+                },
+            )
+            for message_id, by_model in scores.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["my_diary"],
+        update_fields=[*names, "model_version"],
+    )
+
+
+def _store_fanout_scores(
+    message_id: int, user_id: int, name: str, data: dict[str, float]
+) -> None:
+    """Store the scores of one model, then check if the others are done."""
+    if _is_consolidated():
+        store_consolidated({message_id: {name: data}})
+    else:
+        model, rename = EVALUATORS[name]
+        model.objects.update_or_create(
+            my_diary_id=message_id,
+            defaults=clean_name(data, rename),
+        )
+
+    # checked by the same UPDATE: the last evaluator to store its scores
+    # sees all of them, whatever the order they finish in
+    if transition(
+        [message_id],
+        MyDiary.StatusChoices.COMPLETED,
+        *_has_scores(*EVALUATORS),
+        field="evaluation_status",
+    ):
+        notify_message_changes([message_id], "evaluation")
+    else:
+        # the scores are served (e.g. by the /eval/ endpoints) before the
+        # evaluation is completed, or after another model failed
+        bump_version("diary", [user_id])
+
+
+# the evaluation tasks are idempotent, so they are acknowledged after they
+# run (`acks_late`) and delivered again if their worker process dies
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def evaluate_emotions(message_id: int) -> None:
     """
     Task to process emotion analysis for a given chat message.
@@ -40,15 +174,12 @@ def evaluate_emotions(message_id: int) -> None:
         The ID of the MyDiary message to analyze emotions.
     """
     try:
-        chat_message = MyDiary.objects.get(id=message_id)
-
-        # Example placeholder for the actual emotion analysis logic
-        emotions_data = clean_name(eval_emotions(chat_message.prompt))
+        prompt, user_id = MyDiary.objects.values_list("prompt", "user_id").get(
+            id=message_id
+        )
 
-        # Save the analysis results to MhaiDiaryEvalEmotions
-        MhaiDiaryEvalEmotions.objects.update_or_create(
-            my_diary=chat_message,
-            defaults=emotions_data,
+        _store_fanout_scores(
+            message_id, user_id, "emotions", eval_emotions(prompt)
         )
 
     except MyDiary.DoesNotExist as e:
@@ -58,14 +189,11 @@ def evaluate_emotions(message_id: int) -> None:
         raise e
     except Exception as e:
         logger.error(f"Error: {e}")
-        chat_message_fallback = MyDiary.objects.filter(id=message_id)
-        if chat_message_fallback:
-            chat_message.status = "error"
-            chat_message.save()
+        set_evaluation_status([message_id], MyDiary.StatusChoices.ERROR)
         raise e
 
 
-@shared_task
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def evaluate_mentbert(message_id: int) -> None:
     """
     Task to process MentBERT analysis for a given chat message.
@@ -76,15 +204,12 @@ def evaluate_mentbert(message_id: int) -> None:
         The ID of the MyDiary message to analyze with MentBERT.
     """
     try:
-        chat_message = MyDiary.objects.get(id=message_id)
-
-        # Example placeholder for the actual MentBERT analysis logic
-        mentbert_data = clean_name(eval_mentbert(chat_message.prompt))
+        prompt, user_id = MyDiary.objects.values_list("prompt", "user_id").get(
+            id=message_id
+        )
 
-        # Save the analysis results to MhaiDiaryEvalMentBert
-        MhaiDiaryEvalMentBert.objects.update_or_create(
-            my_diary=chat_message,
-            defaults=mentbert_data,
+        _store_fanout_scores(
+            message_id, user_id, "mentbert", eval_mentbert(prompt)
         )
 
     except MyDiary.DoesNotExist as e:
@@ -94,14 +219,11 @@ def evaluate_mentbert(message_id: int) -> None:
         raise e
     except Exception as e:
         logger.error(f"Error: {e}")
-        chat_message_fallback = MyDiary.objects.filter(id=message_id)
-        if chat_message_fallback:
-            chat_message.status = "error"
-            chat_message.save()
+        set_evaluation_status([message_id], MyDiary.StatusChoices.ERROR)
         raise e
 
 
-@shared_task
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def evaluate_psychbert(message_id: int) -> None:
     """
     Task to process PsychBERT analysis for a given chat message.
@@ -112,19 +234,66 @@ def evaluate_psychbert(message_id: int) -> None:
         The ID of the MyDiary message to analyze with PsychBERT.
     """
     try:
-        chat_message = MyDiary.objects.get(id=message_id)
+        prompt, user_id = MyDiary.objects.values_list("prompt", "user_id").get(
+            id=message_id
+        )
 
-        # Example placeholder for the actual PsychBERT analysis logic
-        psychbert_data = clean_name(
-            eval_psychbert(chat_message.prompt),
-            {"negative": "unrelated"},
+        _store_fanout_scores(
+            message_id, user_id, "psychbert", eval_psychbert(prompt)
         )
 
-        # Save the analysis results to MhaiDiaryEvalPsychBert
-        MhaiDiaryEvalPsychBert.objects.update_or_create(
-            my_diary=chat_message,
-            defaults=psychbert_data,
+    except MyDiary.DoesNotExist as e:
+        logger.error(
+            f"Error: MyDiary message with id {message_id} does not exist."
         )
+        raise e
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        set_evaluation_status([message_id], MyDiary.StatusChoices.ERROR)
+        raise e
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def evaluate_all(message_id: int) -> None:
+    """
+    Task to run all the evaluations for a given chat message at once.
+
+    The message is loaded and truncated once, all the models run in the
+    same process, and the results are stored in a single transaction.
+
+    Parameters
+    ----------
+    message_id : int
+        The ID of the MyDiary message to analyze.
+    """
+    try:
+        prompt, user_id = MyDiary.objects.values_list("prompt", "user_id").get(
+            id=message_id
+        )
+
+        scores = {
+            name: results[0]
+            for name, results in eval_texts([prompt], EVALUATORS).items()
+        }
+        for name, data in scores.items():
+            if not data:
+                raise ValueError(f"The {name} evaluation failed.")
+
+        if _is_consolidated():
+            store_consolidated({message_id: scores})
+        else:
+            with transaction.atomic():
+                for name, (model, rename) in EVALUATORS.items():
+                    model.objects.update_or_create(
+                        my_diary_id=message_id,
+                        defaults=clean_name(scores[name], rename),
+                    )
+
+        if not set_evaluation_status(
+            [message_id], MyDiary.StatusChoices.COMPLETED
+        ):
+            # already final, the scores changed all the same
+            bump_version("diary", [user_id])
 
     except MyDiary.DoesNotExist as e:
         logger.error(
@@ -133,8 +302,170 @@ def evaluate_psychbert(message_id: int) -> None:
         raise e
     except Exception as e:
         logger.error(f"Error: {e}")
-        chat_message_fallback = MyDiary.objects.filter(id=message_id)
-        if chat_message_fallback:
-            chat_message.status = "error"
-            chat_message.save()
+        set_evaluation_status([message_id], MyDiary.StatusChoices.ERROR)
         raise e
+
+
+def schedule_batch_evaluation() -> None:
+    """
+    Schedule the batched evaluation of the pending diary messages.
+
+    The batch is evaluated when `MHAI_EVALUATION_BATCH_WINDOW` seconds have
+    passed since its first message, or as soon as
+    `MHAI_EVALUATION_BATCH_SIZE` messages are waiting, whatever comes first.
+    """
+    cache.add(BATCH_PENDING_KEY, 0, timeout=None)
+    try:
+        pending = cache.incr(BATCH_PENDING_KEY)
+    except ValueError:
+        # the counter was evicted in the meantime
+        pending = 1
+        cache.set(BATCH_PENDING_KEY, pending, timeout=None)
+
+    window = settings.MHAI_EVALUATION_BATCH_WINDOW
+
+    if pending >= settings.MHAI_EVALUATION_BATCH_SIZE:
+        cache.set(BATCH_PENDING_KEY, 0, timeout=None)
+        evaluate_pending_batch.delay()
+    elif cache.add(BATCH_WINDOW_KEY, 1, timeout=window):
+        evaluate_pending_batch.apply_async(countdown=window)
+
+
+def _store_batch(scores: dict[int, dict[str, dict[str, float]]]) -> None:
+    """Store the scores of a batch with one bulk insert per table."""
+    if _is_consolidated():
+        store_consolidated(scores)
+        return
+
+    for name, (model, rename) in EVALUATORS.items():
+        rows = [
+            model(my_diary_id=message_id, **clean_name(data[name], rename))
+            for message_id, data in scores.items()
+        ]
+        if not rows:
+            continue
+        # upserted, so a batch delivered again doesn't duplicate the scores
+        model.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["my_diary"],
+            update_fields=score_fields(model),
+        )
+
+
+def _claim_batch(batch_size: int) -> list[tuple[int, str]]:
+    """
+    Take up to `batch_size` messages waiting for their evaluations.
+
+    The messages are moved to in-progress in a short transaction, so the
+    row locks are released before the models run, and concurrent batches
+    (skipping the locked rows) never evaluate the same message twice.
+    The messages claimed more than `MHAI_EVALUATION_CLAIM_TIMEOUT` seconds
+    ago by a batch that never finished (e.g. its worker died) are claimed
+    again.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.MHAI_EVALUATION_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        messages = list(
+            MyDiary.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(evaluation_status=MyDiary.StatusChoices.STARTED)
+                | Q(
+                    evaluation_status=MyDiary.StatusChoices.IN_PROGRESS,
+                    updated_at__lt=stale,
+                )
+            )
+            .order_by("id")
+            .values_list("id", "prompt")[:batch_size]
+        )
+        # the rows are locked, so they are moved without `transition`,
+        # which doesn't move in-progress messages again
+        MyDiary.objects.filter(
+            id__in=[message_id for message_id, _ in messages]
+        ).update(
+            evaluation_status=MyDiary.StatusChoices.IN_PROGRESS,
+            updated_at=now,
+        )
+    return messages
+
+
+def _evaluate_batch(batch_size: int) -> int:
+    """
+    Evaluate one batch of messages waiting for their evaluations.
+
+    The models run outside any transaction; the messages taken are then
+    completed (or failed) along with their scores.
+
+    Returns
+    -------
+    int
+        The number of messages taken from the queue.
+    """
+    messages = _claim_batch(batch_size)
+    if not messages:
+        return 0
+    message_ids = [message_id for message_id, _ in messages]
+    notify_message_changes(message_ids, "evaluation")
+
+    try:
+        scores = eval_texts([prompt for _, prompt in messages], EVALUATORS)
+    except Exception:
+        logger.exception(f"Error: evaluation failed for {message_ids}.")
+        set_evaluation_status(message_ids, MyDiary.StatusChoices.ERROR)
+        return len(messages)
+
+    evaluated: dict[int, dict[str, dict[str, float]]] = {}
+    failed = []
+
+    for i, message_id in enumerate(message_ids):
+        if all(scores[name][i] for name in EVALUATORS):
+            evaluated[message_id] = {
+                name: scores[name][i] for name in EVALUATORS
+            }
+        else:
+            failed.append(message_id)
+
+    if failed:
+        logger.error(f"Error: evaluation failed for messages {failed}.")
+
+    with transaction.atomic():
+        _store_batch(evaluated)
+        transition(
+            evaluated,
+            MyDiary.StatusChoices.COMPLETED,
+            field="evaluation_status",
+        )
+        transition(
+            failed, MyDiary.StatusChoices.ERROR, field="evaluation_status"
+        )
+    notify_message_changes(message_ids, "evaluation")
+
+    return len(messages)
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def evaluate_pending_batch() -> int:
+    """
+    Evaluate, in batches, all the messages waiting for their evaluations.
+
+    Each model runs once per batch, and the results are stored with one bulk
+    insert per evaluation table (or a single one, with the consolidated
+    storage).
+
+    Returns
+    -------
+    int
+        The number of messages processed.
+    """
+    cache.set(BATCH_PENDING_KEY, 0, timeout=None)
+    cache.delete(BATCH_WINDOW_KEY)
+
+    batch_size = settings.MHAI_EVALUATION_BATCH_SIZE
+    total = 0
+
+    while True:
+        processed = _evaluate_batch(batch_size)
+        total += processed
+        if processed < batch_size:
+            return total
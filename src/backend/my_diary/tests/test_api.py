@@ -1,9 +1,20 @@
+import datetime
+
 import pytest
 
+from django.core.cache.backends.dummy import DummyCache
 from django.urls import reverse
+from mhailib import etags
+from mhailib.messages.db import score_fields
 from rest_framework import status
 
-from my_diary.models import MyDiary
+from my_diary.api import views
+from my_diary.events import notify_message_changes
+from my_diary.models import (
+    MhaiDiaryEvalEmotions,
+    MhaiDiaryEvaluation,
+    MyDiary,
+)
 
 
 @pytest.mark.django_db
@@ -42,7 +53,35 @@ def test_get_chat_messages(auth_client, user):
     response = auth_client.get(url)
 
     assert response.status_code == status.HTTP_200_OK
-    assert len(response.json()) == 2  # noqa: PLR2004
+    assert len(response.json()["results"]) == 2  # noqa: PLR2004
+
+
+@pytest.mark.django_db
+def test_paginate_chat_messages(auth_client, user):
+    """
+    Test paginating chat messages with a cursor, from the newest.
+    """
+    messages = [
+        MyDiary.objects.create(user=user, prompt=f"Message {i}")
+        for i in range(3)
+    ]
+
+    url = reverse("my-diary-list")
+    response = auth_client.get(f"{url}?page_size=2")
+
+    assert response.status_code == status.HTTP_200_OK
+    page = response.json()
+    assert [item["id"] for item in page["results"]] == [
+        messages[2].id,
+        messages[1].id,
+    ]
+    assert page["previous"] is None
+
+    response = auth_client.get(page["next"])
+
+    page = response.json()
+    assert [item["id"] for item in page["results"]] == [messages[0].id]
+    assert page["next"] is None
 
 
 @pytest.mark.django_db
@@ -65,3 +104,299 @@ def test_filter_chat_messages_since_id(auth_client, user):
 
     last_message = response.json()[0]
     assert last_message["prompt"] == message2.prompt
+
+
+@pytest.mark.django_db
+def test_long_poll_chat_messages(auth_client, user, monkeypatch):
+    """
+    Test long-polling chat messages using since_id and wait.
+    """
+    message1 = MyDiary.objects.create(
+        user=user, prompt="First message", status="completed"
+    )
+    message2 = MyDiary.objects.create(user=user, prompt="Second message")
+    waits = []
+
+    def fake_wait(user_id, timeout, ready):
+        waits.append((user_id, timeout, ready()))
+        # the answer arrives while waiting
+        MyDiary.objects.filter(id=message2.id).update(response="Hi!")
+        return ready()
+
+    monkeypatch.setattr(views, "wait_for_user_event", fake_wait)
+
+    url = reverse("my-diary-list")
+    response = auth_client.get(f"{url}?since_id={message1.id}&wait=60")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert waits == [(user.id, views.MAX_WAIT, False)]
+    assert response.json()[0]["response"] == "Hi!"
+
+    response = auth_client.get(f"{url}?since_id={message1.id}&wait=soon")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_filter_chat_messages_updated_since(auth_client, user):
+    """
+    Test filtering chat messages updated after updated_since.
+    """
+    message1 = MyDiary.objects.create(user=user, prompt="First message")
+    message2 = MyDiary.objects.create(user=user, prompt="Second message")
+    watermark = message2.updated_at
+
+    message1.response = "Hi!"
+    message1.save()
+
+    url = reverse("my-diary-list")
+    response = auth_client.get(
+        url, {"since_id": message2.id, "updated_since": watermark.isoformat()}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["id"] for item in response.json()] == [message1.id]
+
+    response = auth_client.get(url, {"updated_since": "yesterday"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_chat_messages_delta(auth_client, user, settings):
+    """
+    Test fetching the changed messages and the new watermarks.
+    """
+    settings.MHAI_DIARY_DELTA_OVERLAP = 0
+    message1 = MyDiary.objects.create(user=user, prompt="First message")
+
+    url = reverse("my-diary-delta")
+    response = auth_client.get(url, {"since_id": 0})
+
+    assert response.status_code == status.HTTP_200_OK
+    delta = response.json()
+    assert [item["id"] for item in delta["results"]] == [message1.id]
+    assert delta["since_id"] == message1.id
+
+    message1.response = "Hi!"
+    message1.save()
+    message2 = MyDiary.objects.create(user=user, prompt="Second message")
+
+    response = auth_client.get(
+        url,
+        {
+            "since_id": delta["since_id"],
+            "updated_since": delta["updated_since"],
+        },
+    )
+
+    delta = response.json()
+    assert [item["id"] for item in delta["results"]] == [
+        message1.id,
+        message2.id,
+    ]
+    assert delta["since_id"] == message2.id
+
+    # nothing changed since the last watermarks
+    response = auth_client.get(
+        url,
+        {
+            "since_id": delta["since_id"],
+            "updated_since": delta["updated_since"],
+        },
+    )
+
+    assert response.json() == {
+        "results": [],
+        "has_more": False,
+        "since_id": delta["since_id"],
+        "updated_since": delta["updated_since"],
+    }
+
+    # a watermark is required
+    response = auth_client.get(url)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_chat_messages_delta_pages(auth_client, user, monkeypatch):
+    """
+    Test that the changes are capped, and resumed from the new watermarks.
+    """
+    monkeypatch.setattr(views.MhaiDiaryCursorPagination, "max_page_size", 2)
+    messages = MyDiary.objects.bulk_create(
+        [MyDiary(user=user, prompt=f"Message {i}") for i in range(5)]
+    )
+    # the first three messages changed in the same update, they are
+    # returned together
+    first = [message.id for message in messages[:3]]
+    MyDiary.objects.filter(id__in=first).update(
+        updated_at=messages[0].updated_at - datetime.timedelta(seconds=1)
+    )
+    url = reverse("my-diary-delta")
+
+    delta = auth_client.get(url, {"since_id": 0}).json()
+    assert [item["id"] for item in delta["results"]] == first
+    assert delta["has_more"]
+
+    # the list is capped as well
+    response = auth_client.get(reverse("my-diary-list"), {"since_id": 0})
+    assert [item["id"] for item in response.json()] == first
+
+    seen = [item["id"] for item in delta["results"]]
+    while delta["has_more"]:
+        delta = auth_client.get(
+            url,
+            {
+                "since_id": delta["since_id"],
+                "updated_since": delta["updated_since"],
+            },
+        ).json()
+        seen += [item["id"] for item in delta["results"]]
+
+    # the changes of the last seconds are returned again
+    assert set(seen) == {message.id for message in messages}
+
+
+@pytest.mark.django_db
+def test_chat_messages_not_modified(
+    auth_client, user, django_assert_num_queries
+):
+    """
+    Test answering 304, without queries, while the diary didn't change.
+    """
+    message = MyDiary.objects.create(user=user, prompt="First message")
+
+    url = reverse("my-diary-list")
+    response = auth_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    etag = response["ETag"]
+
+    with django_assert_num_queries(0):
+        response = auth_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response["ETag"] == etag
+
+    # the answer is saved by the tasks, in bulk
+    MyDiary.objects.filter(id=message.id).update(response="Hi!")
+    notify_message_changes([message.id], "answer")
+    response = auth_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["results"][0]["response"] == "Hi!"
+    assert response["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_chat_messages_no_etag_without_cache(auth_client, user, monkeypatch):
+    """
+    Test no ETag is given (nor 304) while the versions can't be read.
+    """
+    # the errors of the cache are ignored in production: every read misses
+    monkeypatch.setattr(etags, "cache", DummyCache("", {}))
+    MyDiary.objects.create(user=user, prompt="First message")
+
+    url = reverse("my-diary-list")
+    response = auth_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert not response.has_header("ETag")
+
+    response = auth_client.get(url, HTTP_IF_NONE_MATCH="*")
+
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_fast_reads_match_serializers(auth_client, user, settings):
+    """
+    Test the fast reads return the same data as the serializers.
+    """
+    messages = [
+        MyDiary.objects.create(
+            user=user, prompt=f"Message {i} \u2028 é", response=""
+        )
+        for i in range(3)
+    ]
+    # spelled differently by orjson and the stdlib json
+    evaluations = [
+        MhaiDiaryEvalEmotions.objects.create(
+            my_diary=message,
+            **dict.fromkeys(score_fields(MhaiDiaryEvalEmotions), value),
+        )
+        for message, value in zip(messages, (1e-05, 3.2e-07, 0.5), strict=True)
+    ]
+
+    urls = [
+        reverse("my-diary-list"),
+        f"{reverse('my-diary-list')}?page_size=2",
+        reverse("my-diary-detail", args=[messages[1].id]),
+        reverse("my-diary-eval-emotions-list"),
+        reverse(
+            "my-diary-eval-emotions-detail",
+            args=[evaluations[0].id],
+        ),
+    ]
+    for url in urls:
+        settings.MHAI_API_FAST_READS = True
+        fast = auth_client.get(url)
+        settings.MHAI_API_FAST_READS = False
+        slow = auth_client.get(url)
+
+        assert fast.status_code == status.HTTP_200_OK
+        assert fast.content == slow.content
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("storage", ["tables", "consolidated"])
+def test_chat_messages_with_scores(
+    auth_client, user, settings, django_assert_num_queries, storage
+):
+    """
+    Test listing the messages with their scores, in a fixed number of queries.
+    """
+    # the page, plus one query per evaluation table
+    queries = 4 if storage == "tables" else 1
+    settings.MHAI_EVALUATION_STORAGE = storage
+    messages = [
+        MyDiary.objects.create(user=user, prompt=f"Message {i}")
+        for i in range(5)
+    ]
+    scores = dict.fromkeys(score_fields(MhaiDiaryEvalEmotions), 0.5)
+    for message in messages[:4]:
+        if storage == "tables":
+            MhaiDiaryEvalEmotions.objects.create(my_diary=message, **scores)
+        else:
+            MhaiDiaryEvaluation.objects.create(
+                my_diary=message, emotions=scores
+            )
+    MyDiary.objects.filter(id=messages[0].id).update(
+        prompt_timestamp=datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    )
+
+    url = reverse("my-diary-with-scores")
+    for page_size in (2, 4):
+        with django_assert_num_queries(queries):
+            response = auth_client.get(url, {"page_size": page_size})
+
+        results = response.json()["results"]
+        assert len(results) == page_size
+        assert results[0]["id"] == messages[4].id
+        assert results[0]["scores"] == {
+            "emotions": {},
+            "mentbert": {},
+            "psychbert": {},
+        }
+        assert results[1]["scores"]["emotions"] == scores
+
+    response = auth_client.get(
+        url, {"start": "2023-12-31", "end": "2024-01-01"}
+    )
+
+    assert [item["id"] for item in response.json()["results"]] == [
+        messages[0].id
+    ]
+
+    response = auth_client.get(url, {"start": "yesterday"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
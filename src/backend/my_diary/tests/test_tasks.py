@@ -1,12 +1,93 @@
+from datetime import timedelta
+
+import numpy as np
 import pytest
 
 from ai_profile.models import AIProfile
+from celery import current_app
+from django.utils import timezone
 from mhai_web.users.models import User
+from mhai_web.users.tasks import get_users_count
+from mhailib.etags import get_version
 from user_profile.models import UserProfile
 
-from my_diary.models import MyDiary
+from my_diary.models import (
+    MhaiDiaryEvalEmotions,
+    MhaiDiaryEvalMentBert,
+    MhaiDiaryEvalPsychBert,
+    MhaiDiaryEvaluation,
+    MyDiary,
+    MyDiaryEmbedding,
+)
+from my_diary.tasks import task_answers, task_embeddings, task_evaluations
 from my_diary.tasks.task_answers import process_chat_answer
 
+EVAL_LABELS = {
+    "emotions": [
+        "neutral",
+        "joy",
+        "disgust",
+        "sadness",
+        "anger",
+        "surprise",
+        "fear",
+    ],
+    "mentbert": [
+        "borderline",
+        "anxiety",
+        "depression",
+        "bipolar",
+        "ocd",
+        "adhd",
+        "schizophrenia",
+        "asperger",
+        "ptsd",
+    ],
+    "psychbert": [
+        "negative",
+        "mental-illnesses",
+        "anxiety",
+        "depression",
+        "social-anxiety",
+        "loneliness",
+    ],
+}
+EVAL_MODELS = (
+    MhaiDiaryEvalEmotions,
+    MhaiDiaryEvalMentBert,
+    MhaiDiaryEvalPsychBert,
+)
+
+
+@pytest.fixture
+def eval_calls(monkeypatch) -> list[list[str]]:
+    """Replace the models with fixed scores and record the evaluated texts."""
+    calls = []
+
+    def fake_eval_texts(texts, model_names):
+        calls.append(list(texts))
+        return {
+            name: [{label: 0.5 for label in EVAL_LABELS[name]} for _ in texts]
+            for name in model_names
+        }
+
+    monkeypatch.setattr(task_evaluations, "eval_texts", fake_eval_texts)
+    return calls
+
+
+@pytest.fixture
+def notifications(monkeypatch) -> list[tuple[list[int], str]]:
+    """Record the message changes notified to the users."""
+    calls = []
+
+    def fake_notify(message_ids, change):
+        calls.append((list(message_ids), change))
+
+    monkeypatch.setattr(
+        task_evaluations, "notify_message_changes", fake_notify
+    )
+    return calls
+
 
 @pytest.mark.django_db
 def test_process_chat_answer_success(
@@ -25,14 +106,343 @@ def test_process_chat_answer_success(
 
     chat_message.refresh_from_db()
     assert chat_message.response != ""
-    assert chat_message.status == "started"
+    assert chat_message.status == "completed"
+
+
+@pytest.fixture
+def stream_events(monkeypatch, settings) -> list[tuple[int, str]]:
+    """Record the events ending the streams of the answers."""
+    settings.MHAI_STREAM_ANSWERS = True
+    events = []
+
+    class FakePublisher:
+        def __init__(self, message_id):
+            self.message_id = message_id
+
+        def __call__(self, text):
+            pass
+
+        def done(self):
+            events.append((self.message_id, "done"))
+
+        def error(self):
+            events.append((self.message_id, "error"))
+
+    monkeypatch.setattr(task_answers, "AnswerPublisher", FakePublisher)
+    return events
+
+
+@pytest.mark.django_db
+def test_process_chat_answer_already_final(user, monkeypatch, stream_events):
+    """
+    Test the process_chat_answer task when the message is already final.
+
+    The answer is dropped, no change is notified, and the stream ends as
+    the message did.
+    """
+    notified = []
+    monkeypatch.setattr(task_answers, "ask_ai", lambda **kwargs: "Late")
+    monkeypatch.setattr(task_answers, "count_tokens", len)
+    monkeypatch.setattr(
+        task_answers,
+        "notify_message_changes",
+        lambda *args: notified.append(args),
+    )
+    chat_message = MyDiary.objects.create(
+        user=user, prompt="Hello, AI!", response="Hi!", status="completed"
+    )
+
+    with pytest.warns(UserWarning, match="already final"):
+        process_chat_answer(message_id=chat_message.id, user_id=user.id)
+
+    chat_message.refresh_from_db()
+    assert chat_message.response == "Hi!"
+    assert notified == []
+
+    failed = MyDiary.objects.create(user=user, prompt="Hi", status="error")
+    with pytest.warns(UserWarning, match="already final"):
+        process_chat_answer(message_id=failed.id, user_id=user.id)
+
+    assert stream_events == [(chat_message.id, "done"), (failed.id, "error")]
 
 
 @pytest.mark.django_db
-def test_process_chat_answer_message_does_not_exist(user):
+def test_process_chat_answer_message_does_not_exist(user, stream_events):
     """
     Test the process_chat_answer task when the chat message does not exist.
     """
     invalid_message_id = 999  # this ID doesn't exist
     with pytest.raises(MyDiary.DoesNotExist):
         process_chat_answer(message_id=invalid_message_id, user_id=user.id)
+
+    assert stream_events == [(invalid_message_id, "error")]
+
+
+@pytest.mark.django_db
+def test_evaluate_all(
+    user: User,
+    eval_calls: list[list[str]],
+    notifications: list[tuple[list[int], str]],
+):
+    """
+    Test the evaluate_all task.
+
+    All the models run over the same prompt and every evaluation is stored.
+    """
+    chat_message = MyDiary.objects.create(user=user, prompt="Hello, AI!")
+
+    task_evaluations.evaluate_all(chat_message.id)
+
+    assert eval_calls == [["Hello, AI!"]]
+    for model in EVAL_MODELS:
+        assert model.objects.filter(my_diary=chat_message).count() == 1
+    assert notifications == [([chat_message.id], "evaluation")]
+    chat_message.refresh_from_db()
+    assert chat_message.evaluation_status == "completed"
+
+
+@pytest.mark.django_db
+def test_fanout_evaluation_status(
+    user: User,
+    monkeypatch,
+    notifications: list[tuple[list[int], str]],
+):
+    """
+    Test the evaluation status with a task per model.
+
+    The last task to store its scores completes the evaluation (and
+    notifies it), and the status of the answer is left alone.
+    """
+    for name in EVAL_LABELS:
+        monkeypatch.setattr(
+            task_evaluations,
+            f"eval_{name}",
+            lambda text, name=name: dict.fromkeys(EVAL_LABELS[name], 0.5),
+        )
+    chat_message = MyDiary.objects.create(
+        user=user, prompt="Hello, AI!", status="completed"
+    )
+    version = get_version("diary", user.id)
+
+    task_evaluations.evaluate_emotions(chat_message.id)
+    task_evaluations.evaluate_mentbert(chat_message.id)
+
+    chat_message.refresh_from_db()
+    assert chat_message.evaluation_status == "started"
+    # the scores already stored are served by the /eval/ endpoints
+    assert get_version("diary", user.id) == version + 2
+
+    task_evaluations.evaluate_psychbert(chat_message.id)
+
+    chat_message.refresh_from_db()
+    assert chat_message.evaluation_status == "completed"
+    assert chat_message.status == "completed"
+    assert notifications == [([chat_message.id], "evaluation")]
+
+    # delivered again, the status doesn't change
+    task_evaluations.evaluate_psychbert(chat_message.id)
+    assert len(notifications) == 1
+
+
+@pytest.mark.django_db
+def test_fanout_scores_after_error(user: User, monkeypatch):
+    """
+    Test the scores stored after another model failed make the ETags stale.
+    """
+    monkeypatch.setattr(
+        task_evaluations,
+        "eval_emotions",
+        lambda text: dict.fromkeys(EVAL_LABELS["emotions"], 0.5),
+    )
+    chat_message = MyDiary.objects.create(
+        user=user, prompt="Hello, AI!", evaluation_status="error"
+    )
+    version = get_version("diary", user.id)
+
+    task_evaluations.evaluate_emotions(chat_message.id)
+
+    assert MhaiDiaryEvalEmotions.objects.filter(my_diary=chat_message).exists()
+    assert get_version("diary", user.id) > version
+
+
+@pytest.mark.django_db
+def test_evaluate_pending_batch(user: User, eval_calls: list[list[str]]):
+    """
+    Test the evaluate_pending_batch task.
+
+    The models run once for all the pending messages and the results are
+    stored for every message.
+    """
+    messages = [
+        MyDiary.objects.create(user=user, prompt=f"Message {i}")
+        for i in range(3)
+    ]
+
+    processed = task_evaluations.evaluate_pending_batch()
+
+    assert processed == len(messages)
+    assert eval_calls == [[message.prompt for message in messages]]
+    for model in EVAL_MODELS:
+        assert model.objects.count() == len(messages)
+
+    for message in messages:
+        message.refresh_from_db()
+        assert message.evaluation_status == "completed"
+
+    # nothing else is pending
+    assert task_evaluations.evaluate_pending_batch() == 0
+
+
+@pytest.mark.django_db
+def test_evaluate_pending_batch_claims(user: User, monkeypatch):
+    """
+    Test the batch is claimed before the models run, and failures are kept.
+    """
+    message = MyDiary.objects.create(user=user, prompt="Hello, AI!")
+    MyDiary.objects.create(
+        user=user, prompt="Failed", evaluation_status="error"
+    )
+    statuses = []
+
+    def failing_eval_texts(texts, model_names):
+        statuses.append(
+            list(MyDiary.objects.values_list("evaluation_status", flat=True))
+        )
+        raise RuntimeError
+
+    monkeypatch.setattr(task_evaluations, "eval_texts", failing_eval_texts)
+
+    assert task_evaluations.evaluate_pending_batch() == 1
+    assert sorted(statuses[0]) == ["error", "in-progress"]
+    message.refresh_from_db()
+    assert message.evaluation_status == "error"
+
+
+@pytest.mark.django_db
+def test_evaluate_pending_batch_reclaims(
+    user: User, eval_calls: list[list[str]], settings
+):
+    """
+    Test the messages of a batch that never finished are evaluated again.
+    """
+    settings.MHAI_EVALUATION_CLAIM_TIMEOUT = 600
+    stale, recent = (
+        MyDiary.objects.create(user=user, prompt=f"Message {i}")
+        for i in range(2)
+    )
+    MyDiary.objects.filter(id__in=[stale.id, recent.id]).update(
+        evaluation_status="in-progress"
+    )
+    MyDiary.objects.filter(id=stale.id).update(
+        updated_at=timezone.now() - timedelta(minutes=11)
+    )
+    # the scores of the first model were stored before the worker died
+    MhaiDiaryEvalEmotions.objects.create(
+        my_diary=stale, **dict.fromkeys(EVAL_LABELS["emotions"], 0.1)
+    )
+
+    assert task_evaluations.evaluate_pending_batch() == 1
+    assert eval_calls == [[stale.prompt]]
+    for model in EVAL_MODELS:
+        assert model.objects.filter(my_diary=stale).count() == 1
+    assert MhaiDiaryEvalEmotions.objects.get(my_diary=stale).joy == 0.5  # noqa: PLR2004
+    stale.refresh_from_db()
+    recent.refresh_from_db()
+    assert stale.evaluation_status == "completed"
+    assert recent.evaluation_status == "in-progress"
+
+
+@pytest.mark.django_db
+def test_consolidated_storage(
+    user: User, eval_calls: list[list[str]], settings
+):
+    """
+    Test storing all the scores of a message in a single row.
+    """
+    settings.MHAI_EVALUATION_STORAGE = "consolidated"
+    messages = [
+        MyDiary.objects.create(user=user, prompt=f"Message {i}")
+        for i in range(2)
+    ]
+
+    task_evaluations.evaluate_pending_batch()
+    # evaluated again, the row is updated in place
+    task_evaluations.evaluate_all(messages[0].id)
+
+    assert MhaiDiaryEvaluation.objects.count() == len(messages)
+    for model in EVAL_MODELS:
+        assert not model.objects.exists()
+    evaluation = MhaiDiaryEvaluation.objects.get(my_diary=messages[0])
+    assert evaluation.psychbert["unrelated"] == 0.5  # noqa: PLR2004
+    assert evaluation.psychbert["social_anxiety"] == 0.5  # noqa: PLR2004
+    assert len(evaluation.model_version) == 16  # noqa: PLR2004
+    messages[1].refresh_from_db()
+    assert messages[1].evaluation_status == "completed"
+
+
+@pytest.mark.django_db
+def test_consolidated_storage_fanout(user: User, monkeypatch, settings):
+    """
+    Test the tasks by model write their own columns of the same row.
+    """
+    settings.MHAI_EVALUATION_STORAGE = "consolidated"
+    for name in EVAL_LABELS:
+        monkeypatch.setattr(
+            task_evaluations,
+            f"eval_{name}",
+            lambda text, name=name: dict.fromkeys(EVAL_LABELS[name], 0.5),
+        )
+    chat_message = MyDiary.objects.create(user=user, prompt="Hello, AI!")
+
+    task_evaluations.evaluate_emotions(chat_message.id)
+    task_evaluations.evaluate_mentbert(chat_message.id)
+
+    chat_message.refresh_from_db()
+    assert chat_message.evaluation_status == "started"
+
+    task_evaluations.evaluate_psychbert(chat_message.id)
+
+    chat_message.refresh_from_db()
+    assert chat_message.evaluation_status == "completed"
+    evaluation = MhaiDiaryEvaluation.objects.get(my_diary=chat_message)
+    assert set(evaluation.emotions) == set(EVAL_LABELS["emotions"])
+    assert set(evaluation.mentbert) == set(EVAL_LABELS["mentbert"])
+
+
+@pytest.mark.django_db
+def test_embed_messages(user, monkeypatch):
+    """
+    Test storing the embeddings of the messages as float32 vectors.
+    """
+    monkeypatch.setattr(
+        task_embeddings.embedder,
+        "encode",
+        lambda texts: np.ones((len(texts), 4), dtype=np.float32) / 2,
+    )
+    message = MyDiary.objects.create(user=user, prompt="Hello")
+
+    task_embeddings.embed_messages([message.id])
+    task_embeddings.embed_messages([message.id])
+
+    embedding = MyDiaryEmbedding.objects.get(my_diary=message)
+    assert embedding.user_id == user.id
+    vector = np.frombuffer(embedding.vector, dtype=np.float32)
+    assert vector.tolist() == [0.5] * 4
+
+
+@pytest.mark.parametrize(
+    ("task", "queue"),
+    [
+        (process_chat_answer, "llm"),
+        (get_users_count, "celery"),
+        (task_evaluations.evaluate_all, "evaluations"),
+        (task_embeddings.embed_messages, "evaluations"),
+    ],
+)
+def test_task_routes(task, queue):
+    """
+    Test the queue of the network-bound and CPU-bound tasks.
+    """
+    route = current_app.amqp.router.route({}, task.name)
+
+    assert route["queue"].name == queue
@@ -0,0 +1,55 @@
+"""Tests for the status transitions of the diary messages."""
+
+import pytest
+
+from mhai_web.users.models import User
+
+from my_diary.models import MyDiary
+from my_diary.transitions import transition
+
+
+@pytest.mark.django_db
+def test_transition_single_update(user: User, django_assert_num_queries):
+    """
+    Test a transition is a single UPDATE setting only the given fields.
+    """
+    message = MyDiary.objects.create(user=user, prompt="Hello")
+
+    with django_assert_num_queries(1) as context:
+        moved = transition(
+            [message.id], MyDiary.StatusChoices.COMPLETED, response="Hi"
+        )
+
+    assert moved == 1
+    sql = context.captured_queries[0]["sql"]
+    assert sql.startswith("UPDATE")
+    assert '"prompt"' not in sql
+    message.refresh_from_db()
+    assert message.status == "completed"
+    assert message.response == "Hi"
+
+
+@pytest.mark.django_db
+def test_transition_final_statuses(user: User):
+    """
+    Test completed and error messages are never moved again.
+    """
+    completed = MyDiary.objects.create(
+        user=user, prompt="Hello", status="completed"
+    )
+    failed = MyDiary.objects.create(user=user, prompt="Hello", status="error")
+
+    assert transition([completed.id], MyDiary.StatusChoices.ERROR) == 0
+    assert transition([failed.id], MyDiary.StatusChoices.COMPLETED) == 0
+    assert (
+        transition(
+            [completed.id, failed.id],
+            MyDiary.StatusChoices.ERROR,
+            field="evaluation_status",
+        )
+        == 2  # noqa: PLR2004
+    )
+
+    completed.refresh_from_db()
+    assert completed.status == "completed"
+    assert completed.evaluation_status == "error"
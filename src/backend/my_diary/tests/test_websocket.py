@@ -0,0 +1,209 @@
+"""Tests for the websocket relay of the answers."""
+
+import asyncio
+import json
+
+import pytest
+
+from asgiref.sync import async_to_sync
+from config import websocket
+from django.conf import settings
+from django.test import Client
+
+from my_diary.models import MyDiary
+
+
+def event(seq, event_type="delta", **data):
+    return json.dumps(
+        {"type": event_type, "message_id": 1, "seq": seq, **data}
+    ).encode()
+
+
+class FakePubSub:
+    """Return the queued messages."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def get_message(self, **kwargs):
+        if self.messages:
+            return {"type": "message", "data": self.messages.pop(0)}
+        await asyncio.sleep(0)
+        return None
+
+
+class FakeAsyncRedis:
+    """Keep the published events of a message."""
+
+    def __init__(self, events, messages):
+        self.events = events
+        self._pubsub = FakePubSub(messages)
+        self.closed = False
+
+    def pubsub(self):
+        return self._pubsub
+
+    async def lrange(self, key, start, end):
+        return self.events
+
+    async def aclose(self):
+        self.closed = True
+
+
+def run_websocket(texts, cookie=None, origin=None):
+    """Connect, send the texts and return what the server sent back."""
+    headers = []
+    if cookie:
+        headers.append((b"cookie", cookie.encode()))
+    if origin:
+        headers.append((b"origin", origin.encode()))
+    scope = {"type": "websocket", "path": "/ws/", "headers": headers}
+    sent = []
+
+    async def main():
+        finished = asyncio.Event()
+        incoming = [
+            {"type": "websocket.connect"},
+            *({"type": "websocket.receive", "text": text} for text in texts),
+        ]
+
+        async def receive():
+            if incoming:
+                return incoming.pop(0)
+            # wait for the relays before disconnecting
+            await asyncio.wait_for(finished.wait(), timeout=5)
+            return {"type": "websocket.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            text = message.get("text", "")
+            if message["type"] == "websocket.close" or '"done"' in text:
+                finished.set()
+            if '"forbidden"' in text or text == "pong!":
+                finished.set()
+
+        await websocket.websocket_application(scope, receive, send)
+
+    async_to_sync(main)()
+    return sent
+
+
+@pytest.fixture
+def session_cookie(user):
+    client = Client()
+    client.force_login(user)
+    key = client.cookies[settings.SESSION_COOKIE_NAME].value
+    return f"{settings.SESSION_COOKIE_NAME}={key}"
+
+
+def test_ping():
+    """The websocket still answers to ping."""
+    sent = run_websocket(["ping"])
+
+    assert sent == [
+        {"type": "websocket.accept"},
+        {"type": "websocket.send", "text": "pong!"},
+    ]
+
+
+def test_anonymous_subscribe_closes():
+    """Anonymous users can't subscribe to any message."""
+    sent = run_websocket(
+        [json.dumps({"action": "subscribe", "message_id": 1})]
+    )
+
+    assert sent[-1] == {"type": "websocket.close", "code": 4401}
+
+
+def test_cross_origin_is_rejected():
+    """Connections from other sites are rejected."""
+    sent = run_websocket([], origin="https://evil.example.com")
+
+    assert sent == [{"type": "websocket.close", "code": 4403}]
+
+
+@pytest.mark.django_db
+def test_subscribe_to_other_user_message(session_cookie, django_user_model):
+    """Users can't subscribe to the messages of other users."""
+    other = django_user_model.objects.create_user(
+        email="other@mymhai.com",
+        password="password",  # noqa: S106
+    )
+    message = MyDiary.objects.create(user=other, prompt="Hi")
+
+    sent = run_websocket(
+        [json.dumps({"action": "subscribe", "message_id": message.id})],
+        cookie=session_cookie,
+    )
+
+    assert json.loads(sent[-1]["text"]) == {
+        "type": "forbidden",
+        "message_id": message.id,
+    }
+
+
+@pytest.mark.django_db
+def test_subscribe_relays_the_answer(monkeypatch, session_cookie, user):
+    """Missed events are replayed, and new ones relayed without repeats."""
+    message = MyDiary.objects.create(user=user, prompt="Hi")
+    fake_redis = FakeAsyncRedis(
+        events=[event(1, text="Hey")],
+        messages=[
+            event(1, text="Hey"),
+            event(2, text=" there"),
+            event(3, "done"),
+        ],
+    )
+    monkeypatch.setattr(websocket, "get_async_redis", lambda: fake_redis)
+
+    sent = run_websocket(
+        [json.dumps({"action": "subscribe", "message_id": message.id})],
+        cookie=session_cookie,
+    )
+
+    events = [json.loads(item["text"]) for item in sent[1:]]
+    assert [item["seq"] for item in events] == [1, 2, 3]
+    assert events[-1]["type"] == "done"
+    assert fake_redis.closed
+
+
+@pytest.mark.django_db
+def test_subscribe_user_relays_events(monkeypatch, session_cookie, user):
+    """The events of the user are relayed to the websocket."""
+    hubs = []
+
+    class FakeHub:
+        def __init__(self):
+            self.subscribed = []
+            hubs.append(self)
+
+        async def subscribe(self, user_id):
+            self.subscribed.append(user_id)
+            queue = asyncio.Queue()
+            await queue.put(json.dumps({"type": "message", "change": "done"}))
+            await queue.put(None)
+            return queue
+
+        async def unsubscribe(self, user_id, queue):
+            self.subscribed.remove(user_id)
+
+    monkeypatch.setattr(websocket, "get_user_event_hub", FakeHub)
+
+    sent = run_websocket(
+        [json.dumps({"action": "subscribe_user"})], cookie=session_cookie
+    )
+
+    assert json.loads(sent[1]["text"])["type"] == "message"
+    # the queue was closed (e.g. redis failed), so is the websocket
+    assert sent[-1] == {"type": "websocket.close", "code": 1011}
+    assert hubs[0].subscribed == []
@@ -0,0 +1,63 @@
+"""Move the diary messages between their statuses."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from django.utils import timezone
+
+from my_diary.models import MyDiary
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from django.db.models import Q
+
+Status = MyDiary.StatusChoices
+
+# new status -> the statuses it can be reached from; completed and error
+# are final, so a late or repeated task never overwrites them
+TRANSITIONS = {
+    Status.IN_PROGRESS: (Status.STARTED,),
+    Status.COMPLETED: (Status.STARTED, Status.IN_PROGRESS),
+    Status.ERROR: (Status.STARTED, Status.IN_PROGRESS),
+}
+
+
+def transition(
+    message_ids: Iterable[int],
+    status: str,
+    *conditions: Q,
+    field: str = "status",
+    **values: Any,
+) -> int:
+    """
+    Move messages to a new status, if allowed from their current one.
+
+    The status is checked and changed by a single conditional UPDATE, so
+    concurrent tasks can't overwrite each other's transitions, and only the
+    given columns are written (not the whole row).
+
+    Parameters
+    ----------
+    message_ids : Iterable[int]
+        The IDs of the MyDiary messages.
+    status : str
+        The new status (see `MyDiary.StatusChoices`).
+    *conditions : Q
+        Other conditions the messages must meet (e.g. `Exists(...)`).
+    field : str
+        The status field: "status" (the answer) or "evaluation_status".
+    **values : Any
+        Other fields to set along with the status (e.g. the response).
+
+    Returns
+    -------
+    int
+        The number of messages moved to the new status.
+    """
+    return MyDiary.objects.filter(
+        *conditions,
+        id__in=list(message_ids),
+        **{f"{field}__in": TRANSITIONS[status]},
+    ).update(**{field: status}, updated_at=timezone.now(), **values)
@@ -0,0 +1,275 @@
+"""
+The profile of the user and of the AI, as a single resource.
+
+Each profile is split into the same sections as their separate endpoints
+(general information, interests, emotions and biography, plus the
+critical events of the user). Every section has its own ETag, and the
+resource's ETag is built from them, so clients can check, with one
+request, that none of the sections changed since they were read.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+
+from typing import TYPE_CHECKING, Any
+
+from ai_profile.api.serializers import (
+    AIProfileBiographySerializer,
+    AIProfileEmotionsSerializer,
+    AIProfileGeneralInfoSerializer,
+    AIProfileInterestsSerializer,
+)
+from ai_profile.models import AIProfile
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import serializers
+
+from user_profile.api.serializers import (
+    UserProfileBiographySerializer,
+    UserProfileEmotionsSerializer,
+    UserProfileGeneralInfoSerializer,
+    UserProfileInterestsSerializer,
+)
+from user_profile.models import UserProfile, UserProfileCriticalEvent
+
+if TYPE_CHECKING:
+    from django.db.models import Model, QuerySet
+
+# profile -> section -> serializer of its fields
+SECTIONS: dict[str, dict[str, type[serializers.ModelSerializer]]] = {
+    "user": {
+        "general": UserProfileGeneralInfoSerializer,
+        "interests": UserProfileInterestsSerializer,
+        "emotions": UserProfileEmotionsSerializer,
+        "bio": UserProfileBiographySerializer,
+    },
+    "ai": {
+        "general": AIProfileGeneralInfoSerializer,
+        "interests": AIProfileInterestsSerializer,
+        "emotions": AIProfileEmotionsSerializer,
+        "bio": AIProfileBiographySerializer,
+    },
+}
+EVENTS_SECTION = "critical_events"
+
+
+class CriticalEventSerializer(serializers.ModelSerializer):
+    """Critical event of the user, within the profile."""
+
+    id = serializers.IntegerField(required=False)
+
+    class Meta:
+        model = UserProfileCriticalEvent
+        fields = [
+            "id",
+            "date",
+            "description",
+            "impact",
+            "resolved",
+            "treated",
+        ]
+
+
+def make_etag(data: Any) -> str:
+    """Return the (strong) ETag of JSON serializable data."""
+    content = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return f'"{hashlib.sha256(content.encode()).hexdigest()[:32]}"'
+
+
+class CompositeProfile:
+    """
+    Read and partially update both profiles of a user.
+
+    Parameters
+    ----------
+    user_profile : UserProfile
+        The profile of the user, with its critical events prefetched.
+    ai_profile : AIProfile
+        The profile of the AI.
+    """
+
+    def __init__(self, user_profile: UserProfile, ai_profile: AIProfile):
+        self.profiles: dict[str, Model] = {
+            "user": user_profile,
+            "ai": ai_profile,
+        }
+
+    @classmethod
+    def load(cls, user_id: int, *, lock: bool = False) -> CompositeProfile:
+        """
+        Load the profiles of a user (3 queries).
+
+        With `lock`, the rows are locked until the end of the transaction,
+        so concurrent updates are applied one after the other.
+        """
+        user_profiles: QuerySet = UserProfile.objects.prefetch_related(
+            "critical_events"
+        )
+        ai_profiles: QuerySet = AIProfile.objects.all()
+        if lock:
+            user_profiles = user_profiles.select_for_update()
+            ai_profiles = ai_profiles.select_for_update()
+        return cls(
+            user_profiles.get(user_id=user_id),
+            ai_profiles.get(user_id=user_id),
+        )
+
+    @property
+    def events(self) -> list[UserProfileCriticalEvent]:
+        """Return the critical events of the user, by date."""
+        events = self.profiles["user"].critical_events.all()
+        return sorted(events, key=lambda event: (event.date, event.id))
+
+    def to_representation(self) -> dict[str, Any]:
+        """Return the sections of both profiles."""
+        data: dict[str, dict[str, Any]] = {
+            profile: {
+                section: serializer(self.profiles[profile]).data
+                for section, serializer in sections.items()
+            }
+            for profile, sections in SECTIONS.items()
+        }
+        data["user"][EVENTS_SECTION] = CriticalEventSerializer(
+            self.events, many=True
+        ).data
+        return data
+
+    @staticmethod
+    def etags(data: dict[str, Any]) -> dict[str, str]:
+        """Return the ETag of each section (e.g. "user.bio")."""
+        return {
+            f"{profile}.{section}": make_etag(value)
+            for profile, sections in data.items()
+            for section, value in sections.items()
+        }
+
+    @classmethod
+    def etag(cls, data: dict[str, Any]) -> str:
+        """Return the ETag of the whole resource."""
+        return make_etag(cls.etags(data))
+
+    def update(self, data: dict[str, Any]) -> list[str]:
+        """
+        Update the given sections, saving only the changed fields.
+
+        Parameters
+        ----------
+        data : dict[str, Any]
+            The new values by section, by profile ("user" or "ai"). The
+            critical events, when given, replace the current ones: events
+            with an id are updated, without an id are created, and the
+            missing ones are deleted.
+
+        Returns
+        -------
+        list[str]
+            The sections saved (e.g. "user.bio"); sections equal to the
+            stored ones are not saved.
+
+        Raises
+        ------
+        rest_framework.exceptions.ValidationError
+            If any section is not valid; nothing is saved.
+        """
+        errors: dict[str, Any] = dict.fromkeys(
+            set(data) - set(SECTIONS), "Unknown profile."
+        )
+        # profile -> field -> (section, new value)
+        changes: dict[str, dict[str, tuple[str, Any]]] = {}
+        for profile in SECTIONS:
+            changes[profile], profile_errors = self._validate_profile(
+                profile, data.get(profile, {})
+            )
+            if profile_errors:
+                errors[profile] = profile_errors
+
+        events = None
+        if (
+            isinstance(data.get("user"), dict)
+            and EVENTS_SECTION in data["user"]
+        ):
+            serializer = CriticalEventSerializer(
+                data=data["user"][EVENTS_SECTION], many=True
+            )
+            if serializer.is_valid():
+                events = serializer.validated_data
+            else:
+                errors.setdefault("user", {})[EVENTS_SECTION] = (
+                    serializer.errors
+                )
+
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        saved = []
+        for profile, fields in changes.items():
+            if not fields:
+                continue
+            instance = self.profiles[profile]
+            for field, (_, value) in fields.items():
+                setattr(instance, field, value)
+            instance.save(update_fields=list(fields))
+            saved.extend(
+                sorted({f"{profile}.{sect}" for sect, _ in fields.values()})
+            )
+
+        if events is not None and self._update_events(events):
+            saved.append(f"user.{EVENTS_SECTION}")
+        return saved
+
+    def _validate_profile(
+        self, profile: str, data: dict[str, Any]
+    ) -> tuple[dict[str, tuple[str, Any]], dict[str, Any]]:
+        """Return the changed fields and the errors of a profile."""
+        instance = self.profiles[profile]
+        sections = SECTIONS[profile]
+        changes: dict[str, tuple[str, Any]] = {}
+        errors: dict[str, Any] = {}
+
+        if not isinstance(data, dict):
+            return changes, {"non_field_errors": ["Expected an object."]}
+
+        for section, values in data.items():
+            if profile == "user" and section == EVENTS_SECTION:
+                continue
+            if section not in sections:
+                errors[section] = "Unknown section."
+                continue
+            serializer = sections[section](instance, data=values, partial=True)
+            if not serializer.is_valid():
+                errors[section] = serializer.errors
+                continue
+            for field, value in serializer.validated_data.items():
+                if getattr(instance, field) != value:
+                    changes[field] = (section, value)
+
+        return changes, errors
+
+    def _update_events(self, events: list[dict[str, Any]]) -> bool:
+        """Make the critical events match the given list."""
+        profile = self.profiles["user"]
+        current = {event.id: event for event in self.events}
+        fields = [f for f in CriticalEventSerializer.Meta.fields if f != "id"]
+
+        created, updated = [], []
+        for item in events:
+            event = current.pop(item.pop("id", None), None)
+            if event is None:
+                created.append(
+                    UserProfileCriticalEvent(profile=profile, **item)
+                )
+            elif any(getattr(event, f) != v for f, v in item.items()):
+                for field, value in item.items():
+                    setattr(event, field, value)
+                updated.append(event)
+
+        if not (created or updated or current):
+            return False
+
+        UserProfileCriticalEvent.objects.filter(id__in=list(current)).delete()
+        UserProfileCriticalEvent.objects.bulk_create(created)
+        UserProfileCriticalEvent.objects.bulk_update(updated, fields)
+        # drop the prefetched events, loaded again for the representation
+        profile.refresh_from_db(fields=["critical_events"])
+        return True
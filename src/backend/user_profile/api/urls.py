@@ -34,5 +34,11 @@ router.register(
 )
 
 urlpatterns = [
+    # before the router, whose detail routes would match it
+    path(
+        "all/",
+        views_api.ProfileView.as_view(),
+        name="user-profile-all",
+    ),
     path(r"", include(router.urls)),
 ]
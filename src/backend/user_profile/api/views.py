@@ -4,10 +4,18 @@ from __future__ import annotations
 
 from typing import cast
 
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
 from mhai_web.users.models import User
-from rest_framework import viewsets
+from mhailib.etags import ConditionalGetMixin, get_version
+from rest_framework import status, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from user_profile.api.composite import CompositeProfile
 from user_profile.api.serializers import (
     UserProfileBiographySerializer,
     UserProfileCriticalEventSerializer,
@@ -17,59 +25,152 @@ from user_profile.api.serializers import (
 )
 from user_profile.models import UserProfile, UserProfileCriticalEvent
 
+# how long the ETag of the content of a version of the profiles is kept
+ETAG_TTL = 60 * 60 * 24
 
-class UserProfileGeneralInfoView(viewsets.ModelViewSet):
+
+class UserProfileGeneralInfoView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating general information in the UserProfile model."""
 
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileGeneralInfoSerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
 
 
-class UserProfileInterestsView(viewsets.ModelViewSet):
+class UserProfileInterestsView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating interests in the UserProfile model."""
 
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileInterestsSerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
 
 
-class UserProfileEmotionsView(viewsets.ModelViewSet):
+class UserProfileEmotionsView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating the emotional profile in the UserProfile model."""
 
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileEmotionsSerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
 
 
-class UserProfileBiographyView(viewsets.ModelViewSet):
+class UserProfileBiographyView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for updating bio-related fields in the UserProfile model."""
 
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileBiographySerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(user=cast(User, self.request.user))
 
 
-class UserProfileCriticalEventView(viewsets.ModelViewSet):
+class UserProfileCriticalEventView(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for CRUD operations on the UserProfileCriticalEvent model."""
 
     queryset = UserProfileCriticalEvent.objects.all()
     serializer_class = UserProfileCriticalEventSerializer
     permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
 
     def get_queryset(self):
         return self.queryset.filter(
             profile__user=cast(User, self.request.user)
         )
+
+
+class ProfileView(ConditionalGetMixin, APIView):
+    """
+    Read and update the profiles of the user and of the AI at once.
+
+    GET returns all the sections of both profiles, with the ETag of their
+    content (`etag`, also the ETag header) and of each section (`etags`).
+    PATCH updates the given sections in a single transaction, saving only
+    the fields that changed. With `If-Match` and that ETag, the update is
+    rejected (412) if any section changed since the profile was read. With
+    `If-None-Match`, GET answers 304 if nothing changed: the ETag of the
+    content is cached along with the version of the profiles, so it is
+    checked without loading them (see `ConditionalGetMixin`).
+    """
+
+    permission_classes = [IsAuthenticated]
+    etag_scope = "profile"
+
+    def get_etag(self, request):
+        """Return the ETag of the content, if known for this version."""
+        self.version = None
+        if not request.user.is_authenticated:
+            return None
+        self.version = get_version(self.etag_scope, request.user.id)
+        if self.version is None:
+            return None
+        return cache.get(_etag_key(request.user.id, self.version))
+
+    def get(self, request):
+        data = CompositeProfile.load(request.user.id).to_representation()
+        response = self._response(data)
+        if self.version is not None:
+            # loaded after the version was read, so a concurrent change is
+            # never hidden behind this ETag
+            self.etag = response.data["etag"]
+            cache.set(
+                _etag_key(request.user.id, self.version),
+                self.etag,
+                timeout=ETAG_TTL,
+            )
+        return response
+
+    def patch(self, request):
+        if not isinstance(request.data, dict):
+            raise ValidationError(
+                {"non_field_errors": ["Expected an object."]}
+            )
+
+        with transaction.atomic():
+            profile = CompositeProfile.load(request.user.id, lock=True)
+            if_match = request.headers.get("If-Match", "*")
+            if if_match.strip() != "*":
+                etag = CompositeProfile.etag(profile.to_representation())
+                if etag not in parse_etags(if_match):
+                    return Response(
+                        {
+                            "detail": "The profile changed since it was read.",
+                            "etag": etag,
+                        },
+                        status=status.HTTP_412_PRECONDITION_FAILED,
+                    )
+            # the version is bumped after the commit, if any section was
+            # saved (the critical events are saved in bulk, without signals)
+            saved = profile.update(request.data)
+
+        response = self._response(profile.to_representation())
+        response.data["saved"] = saved
+        return response
+
+    def _response(self, data):
+        return Response(
+            {
+                **data,
+                "etag": CompositeProfile.etag(data),
+                "etags": CompositeProfile.etags(data),
+            }
+        )
+
+    def has_changed(self, request, response):
+        return bool(response.data.get("saved"))
+
+
+def _etag_key(user_id: int, version: int) -> str:
+    return f"user_profile:etag:{user_id}:{version}"
@@ -4,6 +4,7 @@ from datetime import date
 
 import pytest
 
+from ai_profile.models import AIProfile
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from mhai_web.users.models import User as UserClass
@@ -153,3 +154,146 @@ def test_delete_user_profile_important_event(api_client, user, user_profile):
     response = api_client.delete(url)
     assert response.status_code == status.HTTP_204_NO_CONTENT
     assert UserProfileCriticalEvent.objects.filter(id=event.id).count() == 0
+
+
+@pytest.mark.django_db
+def test_user_profile_not_modified(
+    api_client,
+    user,
+    user_profile,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    """Test answering 304 until the profile changes."""
+    api_client.force_authenticate(user=user)
+    url = reverse("user-profile-general-detail", args=[user_profile.id])
+    response = api_client.get(url)
+    etag = response["ETag"]
+
+    with django_assert_num_queries(0):
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # a change of another section makes it stale too
+    with django_capture_on_commit_callbacks(execute=True):
+        api_client.patch(
+            reverse("user-profile-bio-detail", args=[user_profile.id]),
+            {"bio_pets": "A cat."},
+            format="json",
+        )
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_get_profile_all(
+    api_client, user, user_profile, django_assert_num_queries
+):
+    """Test reading both profiles, with their ETags, in one request."""
+    api_client.force_authenticate(user=user)
+    url = reverse("user-profile-all")
+
+    with django_assert_num_queries(3):
+        response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["user"]["general"]["age"] == 40  # noqa: PLR2004
+    assert response.data["user"]["critical_events"] == []
+    assert "bio_life" in response.data["ai"]["bio"]
+    assert set(response.data["etags"]) == {
+        f"{profile}.{section}"
+        for profile in ("user", "ai")
+        for section in ("general", "interests", "emotions", "bio")
+    } | {"user.critical_events"}
+
+    # the ETag of the content, known for the version of the profile
+    assert response["ETag"] == response.data["etag"]
+    with django_assert_num_queries(0):
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+def test_patch_profile_all(
+    api_client, user, user_profile, django_capture_on_commit_callbacks
+):
+    """Test updating sections of both profiles in one request."""
+    api_client.force_authenticate(user=user)
+    url = reverse("user-profile-all")
+    response = api_client.get(url)
+    etag = response["ETag"]
+
+    data = {
+        "user": {
+            # unchanged, so not saved
+            "general": {"age": 40},
+            "bio": {"bio_pets": "A cat."},
+            "critical_events": [
+                {
+                    "date": "2022-01-01",
+                    "description": "Moved abroad.",
+                    "impact": "New job.",
+                }
+            ],
+        },
+        "ai": {"interests": {"interests": "chess"}},
+    }
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.patch(
+            url, data, format="json", HTTP_IF_MATCH=etag
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["saved"] == [
+        "user.bio",
+        "ai.interests",
+        "user.critical_events",
+    ]
+    assert response.data["etag"] != etag
+    user_profile.refresh_from_db()
+    assert user_profile.bio_pets == "A cat."
+    assert AIProfile.objects.get(user=user).interests == "chess"
+    event = UserProfileCriticalEvent.objects.get(profile=user_profile)
+    assert response.data["user"]["critical_events"][0]["id"] == event.id
+
+    # the profile changed since the first read
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] == response.data["etag"] != etag
+    new_etag = response["ETag"]
+    response = api_client.patch(url, data, format="json", HTTP_IF_MATCH=etag)
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+    # nothing to save, the cached copies are still valid
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.patch(
+            url,
+            {"user": {"bio": {"bio_pets": "A cat."}}},
+            format="json",
+            HTTP_IF_MATCH=new_etag,
+        )
+    assert response.data["saved"] == []
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=new_etag)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+def test_patch_profile_all_invalid(api_client, user, user_profile):
+    """Test nothing is saved when any section is invalid."""
+    api_client.force_authenticate(user=user)
+    data = {
+        "user": {"bio": {"bio_pets": "A cat."}},
+        "ai": {"general": {"age": "old"}},
+    }
+
+    response = api_client.patch(
+        reverse("user-profile-all"), data, format="json"
+    )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert "age" in response.data["ai"]["general"]
+    user_profile.refresh_from_db()
+    assert user_profile.bio_pets == "Pets details here."
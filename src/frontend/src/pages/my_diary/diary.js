@@ -13,23 +13,41 @@ function MyDiary() {
   const [loading, setLoading] = useState(true);
   const [isSending, setIsSending] = useState(false);
   const [pendingMessageId, setPendingMessageId] = useState(null);
+  // partial answers streamed through the websocket, by message id
+  const [streamingAnswers, setStreamingAnswers] = useState({});
   const lastMessageIdRef = useRef(null);
-  const pollingInterval = 1000; // 1 second in milliseconds
+  // watermarks of the changes already fetched (see the delta endpoint)
+  const sinceIdRef = useRef(0);
+  const updatedSinceRef = useRef(null);
+  const [olderPageUrl, setOlderPageUrl] = useState(null);
+  const socketRef = useRef(null);
+  const lastSeqRef = useRef({});
+  const pushActiveRef = useRef(false);
+  const longPollingRef = useRef(false);
+  const unmountedRef = useRef(false);
+  const longPollWait = 25; // seconds the server holds a long-poll request
+  const retryInterval = 5000; // milliseconds
 
   const apiUrl = '/api/my-diary/';
+  const deltaUrl = '/api/my-diary/delta/';
+  const socketUrl = `${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws/`;
 
-  // Function to fetch messages
+  // Function to fetch the latest page of messages
   const fetchMessages = () => {
     axios
       .get(apiUrl, {
         withCredentials: true,
       })
       .then((response) => {
-        setMessages(response.data);
-        if (response.data.length > 0) {
-          lastMessageIdRef.current = response.data[response.data.length - 1].id;
+        // pages go from the newest to the oldest message
+        const page = [...response.data.results].reverse();
+        setMessages(page);
+        setOlderPageUrl(response.data.next);
+        updateWatermarks(page);
+        if (page.length > 0) {
+          lastMessageIdRef.current = page[page.length - 1].id;
 
-          const latestMessage = response.data[response.data.length - 1];
+          const latestMessage = page[page.length - 1];
           if (!latestMessage.response) {
             setIsSending(true);
             setPendingMessageId(latestMessage.id);
@@ -49,36 +67,148 @@ function MyDiary() {
       });
   };
 
-  // Fetch messages on component mount
-  useEffect(() => {
-    fetchMessages();
-
-    // Set up polling
-    const interval = setInterval(() => {
-      checkForNewMessages();
-    }, pollingInterval);
-
-    // Clean up interval on component unmount
-    return () => clearInterval(interval);
-  }, []);
+  // Move the watermarks past the given messages
+  const updateWatermarks = (list) => {
+    for (const msg of list) {
+      sinceIdRef.current = Math.max(sinceIdRef.current, msg.id);
+      if (
+        !updatedSinceRef.current ||
+        new Date(msg.updated_at) > new Date(updatedSinceRef.current)
+      ) {
+        updatedSinceRef.current = msg.updated_at;
+      }
+    }
+  };
 
-  // Function to check for new messages
-  const checkForNewMessages = () => {
+  // Fetch the previous page of older messages
+  const fetchOlderMessages = () => {
     axios
-      .get(apiUrl, {
-        withCredentials: true,
-      })
+      .get(olderPageUrl, { withCredentials: true })
       .then((response) => {
-        setMessages(response.data);
-        if (response.data.length > 0) {
-          lastMessageIdRef.current = response.data[response.data.length - 1].id;
-        }
+        setOlderPageUrl(response.data.next);
+        mergeMessages(response.data.results);
       })
-      .catch((error) => {
+      .catch(() => setError('Failed to fetch messages.'));
+  };
+
+  // Merge the updated messages into the list
+  const mergeMessages = (updated) => {
+    setMessages((prevMessages) => {
+      const byId = new Map(prevMessages.map((msg) => [msg.id, msg]));
+      updated.forEach((msg) => byId.set(msg.id, msg));
+      const merged = Array.from(byId.values()).sort((a, b) => a.id - b.id);
+      if (merged.length > 0) {
+        lastMessageIdRef.current = merged[merged.length - 1].id;
+      }
+      return merged;
+    });
+  };
+
+  // Fetch only the messages created or updated since the watermarks. With
+  // `wait`, the server holds the request until there is something new
+  // (long-poll).
+  const fetchUpdates = (wait) => {
+    const params = { since_id: sinceIdRef.current };
+    if (updatedSinceRef.current) params.updated_since = updatedSinceRef.current;
+    if (wait) params.wait = wait;
+    return axios
+      .get(deltaUrl, { params, withCredentials: true })
+      .then((response) => {
+        sinceIdRef.current = response.data.since_id;
+        updatedSinceRef.current = response.data.updated_since;
+        mergeMessages(response.data.results);
+        // the changes come in pages, fetch the rest right away
+        return response.data.has_more ? fetchUpdates() : undefined;
+      });
+  };
+
+  // Long-poll while the websocket is not available
+  const longPoll = async () => {
+    if (longPollingRef.current) return;
+    longPollingRef.current = true;
+    while (!unmountedRef.current && !pushActiveRef.current) {
+      try {
+        await fetchUpdates(longPollWait);
+      } catch (error) {
+        console.error('Error checking for new messages:', error);
+        await new Promise((resolve) => setTimeout(resolve, retryInterval));
+      }
+    }
+    longPollingRef.current = false;
+  };
+
+  // Subscribe to the answer of a message, streamed while it is generated.
+  // When streaming is not available, the answer arrives with the updates.
+  const subscribeToAnswer = (messageId) => {
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ action: 'subscribe', message_id: messageId }));
+    }
+  };
+
+  const handleSocketMessage = (event) => {
+    let data;
+    try {
+      data = JSON.parse(event.data);
+    } catch (e) {
+      return;
+    }
+
+    if (data.type === 'message') {
+      // a message of the user changed (answer, evaluation or status)
+      fetchUpdates().catch((error) => {
         console.error('Error checking for new messages:', error);
       });
+      return;
+    }
+
+    const messageId = data.message_id;
+    // events may be replayed after subscribing, skip the repeated ones
+    if (data.seq <= (lastSeqRef.current[messageId] || 0)) return;
+    lastSeqRef.current[messageId] = data.seq;
+
+    if (data.type === 'delta') {
+      setStreamingAnswers((prev) => ({
+        ...prev,
+        [messageId]: (prev[messageId] || '') + data.text,
+      }));
+    }
   };
 
+  // Fetch messages and open the websocket on component mount. Updates are
+  // pushed through the websocket; without it, they are long-polled.
+  useEffect(() => {
+    unmountedRef.current = false;
+    fetchMessages();
+
+    if (typeof WebSocket === 'undefined') {
+      longPoll();
+      return () => {
+        unmountedRef.current = true;
+      };
+    }
+
+    const socket = new WebSocket(socketUrl);
+    socket.onopen = () => {
+      pushActiveRef.current = true;
+      socket.send(JSON.stringify({ action: 'subscribe_user' }));
+      // catch up with the changes made while connecting
+      fetchUpdates().catch(() => {});
+    };
+    socket.onmessage = handleSocketMessage;
+    socket.onclose = () => {
+      pushActiveRef.current = false;
+      longPoll();
+    };
+    socketRef.current = socket;
+
+    return () => {
+      unmountedRef.current = true;
+      socket.onclose = null;
+      socket.close();
+    };
+  }, []);
+
   // useEffect to monitor messages and pendingMessageId
   useEffect(() => {
     if (pendingMessageId !== null) {
@@ -117,6 +247,7 @@ function MyDiary() {
         lastMessageIdRef.current = response.data.id;
         setUserInput('');
         setPendingMessageId(response.data.id);
+        subscribeToAnswer(response.data.id);
         // isSending remains true until AI response is received
       })
       .catch((error) => {
@@ -142,6 +273,13 @@ function MyDiary() {
           <h2>Chat with AI</h2>
 
           <div className="chat-container" style={{ maxHeight: '60vh', overflowY: 'auto', paddingTop: '1rem' }}>
+            {olderPageUrl && (
+              <div className="text-center">
+                <button className="btn btn-link" type="button" onClick={fetchOlderMessages}>
+                  Load older messages
+                </button>
+              </div>
+            )}
             {messages.map((msg) => (
               <div key={msg.id}>
                 {/* User Message */}
@@ -166,6 +304,13 @@ function MyDiary() {
                       {msg.response_timestamp}
                     </div>
                   </div>
+                ) : streamingAnswers[msg.id] ? (
+                  <div
+                    className="p-3 rounded-3 mt-2 me-5 position-relative"
+                    style={{ backgroundColor: '#D4E4F7' }}
+                  >
+                    <strong>Mhai:</strong> {streamingAnswers[msg.id]}
+                  </div>
                 ) : (
                   <div
                     className="p-3 rounded-3 mt-2 me-5 position-relative"